@@ -27,6 +27,12 @@ ENVIRONMENT = env('ENVIRONMENT', default="prod")
 
 FIREPLAN_USERNAME = env("FIREPLAN_USERNAME")
 FIREPLAN_PASSWORD = env("FIREPLAN_PASSWORD")
+# Logged-in Fireplan sessions kept per process for reuse (fireplan.client.client_pool)
+FIREPLAN_CLIENT_POOL_SIZE = int(os.getenv("FIREPLAN_CLIENT_POOL_SIZE", "4"))
+# Fireplan radios looked up or created at the same time by the bulk radio onboarding
+RADIO_ONBOARDING_CONCURRENCY = int(os.getenv("RADIO_ONBOARDING_CONCURRENCY", "4"))
+# Fireplan sync runs (fireplan.SyncRun) shown in the admin dashboard are kept this long
+FIREPLAN_SYNC_RUN_RETENTION_DAYS = int(os.getenv("FIREPLAN_SYNC_RUN_RETENTION_DAYS", "90"))
 ROIP_API_KEYS = env.list("ROIP_API_KEYS", default=[])
 
 
@@ -276,6 +282,29 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_TIMEZONE = "Europe/Brussels"
 
+# CACHE
+#
+# Shared between the web workers and the Celery worker (e.g. Astrid upload
+# previews), so production uses Redis. Without CACHE_URL a local memory cache
+# is used: it lives in one process only, so an Astrid preview made by the
+# Celery worker cannot be confirmed from the web process (use it with
+# CELERY_TASK_ALWAYS_EAGER or a single process only).
+CACHE_URL = env("CACHE_URL", default="redis://127.0.0.1:6379/1" if ENVIRONMENT == "prod" else "")
+
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 ASGI_APPLICATION = "RadioAssetManagement.asgi.application" 
 
 CHANNEL_LAYERS = {
@@ -296,8 +325,44 @@ ROIP_RECORDINGS_BASE_URL = os.getenv(
     "ROIP_RECORDINGS_BASE_URL",
     "/media/recordings/",
 )
-
-
+# Changes to ISSIs, radios, vehicles and vectors are published here so the
+# MQTT bridge can refresh its enrichment cache.
+ROIP_ENRICHMENT_REDIS_URL = os.getenv("ROIP_ENRICHMENT_REDIS_URL", "redis://127.0.0.1:6379/0")
+ROIP_ENRICHMENT_CHANNEL = os.getenv("ROIP_ENRICHMENT_CHANNEL", "roip:enrichment")
+ROIP_ENRICHMENT_REWARM_SECONDS = int(os.getenv("ROIP_ENRICHMENT_REWARM_SECONDS", "900"))
+# Recent live TX events, replayed to browsers that (re)connect
+ROIP_HISTORY_REDIS_URL = os.getenv("ROIP_HISTORY_REDIS_URL", ROIP_ENRICHMENT_REDIS_URL)
+ROIP_HISTORY_STREAM = os.getenv("ROIP_HISTORY_STREAM", "roip:live_tx")
+ROIP_HISTORY_MAXLEN = int(os.getenv("ROIP_HISTORY_MAXLEN", "1000"))
+ROIP_HISTORY_BACKLOG = int(os.getenv("ROIP_HISTORY_BACKLOG", "50"))
+ROIP_HISTORY_APPEND_TIMEOUT_MS = int(os.getenv("ROIP_HISTORY_APPEND_TIMEOUT_MS", "200"))
+# Every live TX event is stored in roip.TxEvent, in batches of
+# ROIP_TX_STORE_BATCH_SIZE events or every ROIP_TX_STORE_FLUSH_MS milliseconds.
+ROIP_TX_STORE_ENABLED = os.getenv("ROIP_TX_STORE_ENABLED", "1") == "1"
+ROIP_TX_STORE_BATCH_SIZE = int(os.getenv("ROIP_TX_STORE_BATCH_SIZE", "500"))
+ROIP_TX_STORE_FLUSH_MS = int(os.getenv("ROIP_TX_STORE_FLUSH_MS", "500"))
+ROIP_TX_RETENTION_DAYS = int(os.getenv("ROIP_TX_RETENTION_DAYS", "365"))
+# Clients syncing with /api/roip/snapshot/?since= must do so at least this often
+ROIP_DIRECTORY_CHANGE_RETENTION_DAYS = int(os.getenv("ROIP_DIRECTORY_CHANGE_RETENTION_DAYS", "30"))
+# Directory versions only cover changes at least this old, so none can still commit below them;
+# keep it above the longest transaction that writes directory data (imports, Fireplan syncs)
+ROIP_DIRECTORY_VERSION_LAG_SECONDS = int(os.getenv("ROIP_DIRECTORY_VERSION_LAG_SECONDS", "60"))
+# Radio changes are pushed to the RoIP ingest endpoint. TEIs are collected in a
+# Redis set and flushed every ROIP_OUTBOX_FLUSH_SECONDS, in chunks of
+# ROIP_OUTBOX_CHUNK_SIZE, with only the fields that changed since the last push.
+ROIP_INGEST_URL = os.getenv("ROIP_INGEST_URL", "")
+ROIP_INGEST_TOKEN = os.getenv("ROIP_INGEST_TOKEN", "")
+ROIP_OUTBOX_REDIS_URL = os.getenv("ROIP_OUTBOX_REDIS_URL", ROIP_ENRICHMENT_REDIS_URL)
+ROIP_OUTBOX_FLUSH_SECONDS = float(os.getenv("ROIP_OUTBOX_FLUSH_SECONDS", "5"))
+ROIP_OUTBOX_CHUNK_SIZE = int(os.getenv("ROIP_OUTBOX_CHUNK_SIZE", "500"))
+ROIP_OUTBOX_LOCK_SECONDS = int(os.getenv("ROIP_OUTBOX_LOCK_SECONDS", "120"))
+
+
+
+
+# Uploaded Astrid exports wait here until the Celery worker has imported them.
+# The web and worker processes must share this directory.
+ASTRID_UPLOAD_DIR = env("ASTRID_UPLOAD_DIR", default=str(BASE_DIR / "uploads" / "astrid"))
 
 
 CELERY_BEAT_SCHEDULE = {
@@ -305,4 +370,20 @@ CELERY_BEAT_SCHEDULE = {
         "task": "fireplan.tasks.sync_inventories",
         "schedule": crontab(minute=0),  # elk uur
     },
+    "purge-roip-tx-events-daily": {
+        "task": "roip.tasks.purge_tx_events",
+        "schedule": crontab(hour=3, minute=30),
+    },
+    "purge-directory-changes-daily": {
+        "task": "roip.tasks.purge_directory_changes",
+        "schedule": crontab(hour=3, minute=45),
+    },
+    "purge-fireplan-sync-runs-daily": {
+        "task": "fireplan.tasks.purge_sync_runs",
+        "schedule": crontab(hour=4, minute=0),
+    },
+    "flush-roip-outbox": {
+        "task": "RadioAssetManagement.tasks.flush_roip_outbox",
+        "schedule": ROIP_OUTBOX_FLUSH_SECONDS,
+    },
 }
@@ -0,0 +1,45 @@
+# RadioAssetManagement/task_status.py
+"""
+Progress polling for Celery tasks started from a page.
+
+A view that queues a task calls remember_task(); its status view answers with
+task_status_response(), which only reports on tasks of the expected kind that
+were started from the same session. Other task ids are a 404, so one user
+cannot read another user's (or another page's) task results.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+from celery.result import AsyncResult
+from django.http import Http404, JsonResponse
+
+SESSION_KEY = "celery_tasks"
+# Older task ids are forgotten; pages only poll their most recent tasks
+MAX_REMEMBERED_TASKS = 20
+
+
+def remember_task(request, task, result: AsyncResult) -> None:
+    """Let this session poll `result`, a run of `task`."""
+    tasks = dict(request.session.get(SESSION_KEY, {}))
+    tasks[result.id] = task.name
+    request.session[SESSION_KEY] = dict(list(tasks.items())[-MAX_REMEMBERED_TASKS:])
+
+
+def task_status_response(request, task_id: str, tasks: Iterable) -> JsonResponse:
+    """State, progress and outcome of a task this session started, as JSON."""
+    if request.session.get(SESSION_KEY, {}).get(task_id) not in {task.name for task in tasks}:
+        raise Http404("Onbekende taak")
+
+    result = AsyncResult(task_id)
+    data = {"state": result.state}
+
+    if result.state == "PROGRESS":
+        data["progress"] = result.info
+    elif result.successful():
+        data["result"] = result.result
+    elif result.failed():
+        data["error"] = str(result.result)
+
+    return JsonResponse(data)
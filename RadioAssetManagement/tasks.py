@@ -1,19 +1,54 @@
 # RadioAssetManagement/tasks.py
 from __future__ import annotations
 
+import json
 import logging
-from typing import Any, Iterable, Union
+import uuid
+from typing import Any, Iterable, Optional, Union
 
 from celery import shared_task
 from django.apps import apps
 from django.db import transaction
+import redis
 import requests
 from django.conf import settings
 
 log = logging.getLogger(__name__)
 
+# RoIP push outbox: TEIs waiting to be pushed, and the last line pushed per TEI
+OUTBOX_KEY = "roip:outbox"
+PUSHED_KEY = "roip:outbox:pushed"
+FLUSH_LOCK_KEY = "roip:outbox:lock"
+# The chunk being pushed; put back into the outbox if its flusher died mid-push
+PROCESSING_KEY = "roip:outbox:processing"
+
+# Delete the lock only if it still holds our token, not the next flusher's
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+_redis_client: Optional[redis.Redis] = None
+
+
+def outbox_redis() -> redis.Redis:
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.ROIP_OUTBOX_REDIS_URL,
+            socket_connect_timeout=1,
+            socket_timeout=5,
+        )
+    return _redis_client
+
 
 def enqueue_roip_sync_for_tei(teI_or_list: Union[int, Iterable[int]]) -> None:
+    """
+    Add TEIs to the RoIP outbox once the transaction commits.
+    flush_roip_outbox pushes them a few seconds later, however often they were added.
+    """
     # Normalize to list[int]
     if isinstance(teI_or_list, int):
         tei_list = [teI_or_list]
@@ -27,23 +62,27 @@ def enqueue_roip_sync_for_tei(teI_or_list: Union[int, Iterable[int]]) -> None:
     if not tei_list:
         return
 
-    transaction.on_commit(lambda: roip_sync_radios_snapshot.delay(tei_list))
+    transaction.on_commit(lambda: _add_to_outbox(tei_list))
 
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={"max_retries": 5, "countdown": 10})
-def roip_sync_radios_snapshot(self, tei_list: list[int]) -> dict[str, int]:
-    """
-    Build one payload line per TEI, in a single task run.
-    """
+def _add_to_outbox(tei_list: list[int]) -> None:
+    try:
+        outbox_redis().sadd(OUTBOX_KEY, *tei_list)
+    except redis.RedisError:
+        log.warning("Could not queue %s TEIs for the RoIP sync", len(tei_list))
+
+
+def build_roip_sync_lines(tei_list: Iterable[int]) -> dict[int, dict[str, Any]]:
+    """One payload line per existing TEI, in one query."""
     Radio = apps.get_model("radio", "Radio")
 
     radios = (
         Radio.objects
-        .filter(TEI__in=tei_list)
+        .filter(TEI__in=list(tei_list))
         .select_related("subscription__issi", "vehicle__vector")
     )
 
-    payload_lines: list[dict[str, Any]] = []
+    lines: dict[int, dict[str, Any]] = {}
     for r in radios:
         sub = getattr(r, "subscription", None)
         issi = getattr(sub, "issi", None) if sub else None
@@ -51,23 +90,20 @@ def roip_sync_radios_snapshot(self, tei_list: list[int]) -> dict[str, int]:
         vehicle = getattr(r, "vehicle", None)
         vector = getattr(vehicle, "vector", None) if vehicle else None
 
-        payload_lines.append(
-            {
-                "tei": int(r.TEI),
-                "issi": int(issi.number) if issi else None,
-                "issi_alias": (issi.alias or None) if issi else None,
-                "vehicle_call_sign": (vehicle.call_sign or None) if vehicle else None,
-                "vector_abbreviation": (vector.abbreviation or None) if vector else None,
-            }
-        )
-
-    log.info("ROIP sync batch size=%s", len(payload_lines))
+        lines[int(r.TEI)] = {
+            "tei": int(r.TEI),
+            "issi": int(issi.number) if issi else None,
+            "issi_alias": (issi.alias or None) if issi else None,
+            "vehicle_call_sign": (vehicle.call_sign or None) if vehicle else None,
+            "vector_abbreviation": (vector.abbreviation or None) if vector else None,
+        }
+    return lines
 
-    payload = {"items": payload_lines}
 
+def post_roip_sync(payload_lines: list[dict[str, Any]]) -> None:
     resp = requests.post(
         settings.ROIP_INGEST_URL,
-        json=payload,
+        json={"items": payload_lines},
         headers={
             "X-RAM-TOKEN": settings.ROIP_INGEST_TOKEN,
             "Content-Type": "application/json",
@@ -77,4 +113,104 @@ def roip_sync_radios_snapshot(self, tei_list: list[int]) -> dict[str, int]:
 
     resp.raise_for_status()
 
-    return {"requested": len(tei_list), "built": len(payload_lines)}
\ No newline at end of file
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={"max_retries": 5, "countdown": 10})
+def roip_sync_radios_snapshot(self, tei_list: list[int]) -> dict[str, int]:
+    """
+    Build one full payload line per TEI, in a single task run.
+    """
+    payload_lines = list(build_roip_sync_lines(tei_list).values())
+
+    log.info("ROIP sync batch size=%s", len(payload_lines))
+
+    post_roip_sync(payload_lines)
+
+    return {"requested": len(tei_list), "built": len(payload_lines)}
+
+
+def roip_sync_delta(line: dict[str, Any], pushed: Optional[dict[str, Any]]) -> Optional[dict[str, Any]]:
+    """The fields of `line` that differ from the last pushed line, with the TEI; None if nothing changed."""
+    if pushed is None:
+        return line
+    changed = {key: value for key, value in line.items() if pushed.get(key, object()) != value}
+    if not changed:
+        return None
+    return {"tei": line["tei"], **changed}
+
+
+def _take_chunk(client: redis.Redis, chunk_size: int) -> list[int]:
+    """Move up to chunk_size TEIs from the outbox to the processing set, atomically."""
+    chunk = client.srandmember(OUTBOX_KEY, chunk_size) or []
+    if chunk:
+        # Only the lock holder removes from the outbox, so these are still members
+        pipe = client.pipeline(transaction=True)
+        pipe.srem(OUTBOX_KEY, *chunk)
+        pipe.sadd(PROCESSING_KEY, *chunk)
+        pipe.execute()
+    return sorted(int(tei) for tei in chunk)
+
+
+def _requeue_processing(client: redis.Redis) -> None:
+    if client.exists(PROCESSING_KEY):
+        client.sunionstore(OUTBOX_KEY, [OUTBOX_KEY, PROCESSING_KEY])
+        client.delete(PROCESSING_KEY)
+
+
+@shared_task(ignore_result=True)
+def flush_roip_outbox(chunk_size: Optional[int] = None) -> dict[str, int]:
+    """
+    Push the TEIs waiting in the outbox, chunk by chunk, sending only the
+    fields that changed since the last successful push of each TEI.
+
+    A chunk stays in a processing set until it is pushed. When the push fails,
+    or the worker died during an earlier run, it goes back into the outbox.
+    """
+    if not settings.ROIP_INGEST_URL:
+        return {"queued": 0, "pushed": 0}
+
+    chunk_size = chunk_size or settings.ROIP_OUTBOX_CHUNK_SIZE
+    client = outbox_redis()
+
+    # One flusher at a time; the lock expires if a worker dies mid-run
+    token = uuid.uuid4().hex
+    if not client.set(FLUSH_LOCK_KEY, token, nx=True, ex=settings.ROIP_OUTBOX_LOCK_SECONDS):
+        return {"queued": 0, "pushed": 0}
+
+    queued = pushed = 0
+    try:
+        _requeue_processing(client)
+
+        while True:
+            tei_list = _take_chunk(client, chunk_size)
+            if not tei_list:
+                break
+            queued += len(tei_list)
+
+            try:
+                lines = build_roip_sync_lines(tei_list)
+                previous = client.hmget(PUSHED_KEY, list(lines)) if lines else []
+                deltas = [
+                    delta
+                    for line, raw in zip(lines.values(), previous)
+                    if (delta := roip_sync_delta(line, json.loads(raw) if raw else None)) is not None
+                ]
+                if deltas:
+                    post_roip_sync(deltas)
+            except Exception:
+                _requeue_processing(client)
+                log.exception("RoIP sync of %s TEIs failed, retrying on the next run", len(tei_list))
+                break
+
+            if deltas:
+                client.hset(PUSHED_KEY, mapping={
+                    line["tei"]: json.dumps(line)
+                    for line in lines.values()
+                })
+            client.delete(PROCESSING_KEY)
+            pushed += len(deltas)
+    finally:
+        client.eval(RELEASE_LOCK_SCRIPT, 1, FLUSH_LOCK_KEY, token)
+
+    if queued:
+        log.info("ROIP outbox flushed: %s queued, %s pushed", queued, pushed)
+    return {"queued": queued, "pushed": pushed}
@@ -0,0 +1,401 @@
+# astrid/subscription_import.py
+"""
+Reconcile an Astrid subscriptions export with the Subscription table.
+
+The export is streamed once, row by row, and diffed in memory against the
+current subscriptions. The diff is then applied with a handful of bulk
+queries instead of several queries per row.
+"""
+
+from __future__ import annotations
+
+import csv
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+import openpyxl
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from radio.models import ISSI, Radio, Subscription
+from radio.services.range_index import issi_range_resolver, tei_range_index
+from RadioAssetManagement.tasks import enqueue_roip_sync_for_tei
+from roip.signals import directory_changed
+
+logger = logging.getLogger(__name__)
+
+
+SPARE_MODEL_TYPE = "Spare subscription"
+REQUIRED_COLUMNS = ("TEI", "ISSI", "CICAlias", "ModelType")
+CSV_DELIMITERS = ",;\t"
+BATCH_SIZE = 500
+PREVIEW_LIMIT = 500
+PLAN_CACHE_TIMEOUT = 60 * 60
+SUBSCRIPTION_FIELDS = ("pk", "radio_id", "issi_id", "astrid_alias", "DMO_only", "issi__customer__owner")
+
+
+@dataclass(frozen=True)
+class SubscriptionRow:
+    tei: int
+    issi: int
+    alias: str
+    model_type: str = ""
+
+
+@dataclass
+class SubscriptionImportPlan:
+    """
+    Changes needed to make the Subscription table match an Astrid export.
+    """
+    radios_to_create: list[tuple[int, int]] = field(default_factory=list)       # (TEI, RadioModel id)
+    issis_to_create: list[int] = field(default_factory=list)
+    subscriptions_to_create: list[SubscriptionRow] = field(default_factory=list)
+    aliases_to_update: list[tuple[int, int, str, str]] = field(default_factory=list)  # (id, ISSI, old, new)
+    issis_moved: list[tuple[int, int, int]] = field(default_factory=list)       # (ISSI, old TEI, new TEI)
+    subscriptions_to_replace: list[int] = field(default_factory=list)           # Subscription ids
+    subscriptions_to_delete: list[tuple[int, int, int]] = field(default_factory=list)  # (id, TEI, ISSI)
+    registered: int = 0
+    errors: list[str] = field(default_factory=list)
+    # Database state the plan was computed from, see plan_fingerprint()
+    watched_teis: list[int] = field(default_factory=list)
+    watched_issis: list[int] = field(default_factory=list)
+    fingerprint: str = ""
+
+    def summary(self, limit: int = PREVIEW_LIMIT) -> dict[str, Any]:
+        """JSON friendly overview of the changes, each list capped at `limit` entries."""
+        return {
+            "registered": self.registered,
+            "counts": {
+                "created": len(self.subscriptions_to_create),
+                "moved": len(self.issis_moved),
+                "aliases": len(self.aliases_to_update),
+                "deleted": len(self.subscriptions_to_delete),
+                "radios": len(self.radios_to_create),
+                "issis": len(self.issis_to_create),
+            },
+            "created": [[row.tei, row.issi, row.alias] for row in self.subscriptions_to_create[:limit]],
+            "moved": [list(move) for move in self.issis_moved[:limit]],
+            "aliases": [[issi, old, new] for _, issi, old, new in self.aliases_to_update[:limit]],
+            "deleted": [[tei, issi] for _, tei, issi in self.subscriptions_to_delete[:limit]],
+            "errors": self.errors,
+        }
+
+
+@dataclass
+class SubscriptionImportResult:
+    registered: int = 0
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    radios_created: int = 0
+    issis_created: int = 0
+
+
+def iter_export_rows(path: str | Path) -> Iterator[tuple[Any, ...]]:
+    """
+    Stream the raw rows of an Astrid export, header row first.
+
+    Excel files are opened read-only so rows are read one at a time instead of
+    loading the whole workbook. CSV exports are read line by line.
+    """
+    path = Path(path)
+
+    if path.suffix.lower() == ".csv":
+        with path.open(newline="", encoding="utf-8-sig") as f:
+            try:
+                dialect = csv.Sniffer().sniff(f.read(4096), delimiters=CSV_DELIMITERS)
+            except csv.Error:
+                dialect = csv.excel
+            f.seek(0)
+            for row in csv.reader(f, dialect):
+                yield tuple(value.strip() or None for value in row)
+        return
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def parse_subscription_rows(rows: Iterable[tuple[Any, ...]], errors: list[str]) -> Iterator[SubscriptionRow]:
+    """
+    Turn raw export rows (header row first) into SubscriptionRows.
+
+    Spare subscriptions and rows without TEI or ISSI are skipped, unparsable
+    rows are reported in `errors`. Raises KeyError when a column is missing.
+    """
+    rows = iter(rows)
+    header = next(rows, None) or ()
+    col = {name: idx for idx, name in enumerate(header)}
+    tei_idx, issi_idx, alias_idx, model_type_idx = (col[name] for name in REQUIRED_COLUMNS)
+
+    for row in rows:
+        tei_cell = row[tei_idx] if tei_idx < len(row) else None
+        issi_cell = row[issi_idx] if issi_idx < len(row) else None
+        alias_cell = row[alias_idx] if alias_idx < len(row) else None
+        model_type_cell = row[model_type_idx] if model_type_idx < len(row) else None
+
+        # Skip rows with missing TEI or ISSI
+        if tei_cell is None or issi_cell is None:
+            continue
+
+        # Skip spare subscriptions
+        if model_type_cell == SPARE_MODEL_TYPE:
+            continue
+
+        try:
+            # TEI is stored as the full 15-digit number
+            tei = int(str(tei_cell).strip())
+            issi = int(str(issi_cell).strip())
+        except ValueError:
+            errors.append(f"Onjuiste waarde TEI={tei_cell}, ISSI={issi_cell}")
+            continue
+
+        alias = str(alias_cell).strip() if alias_cell else ""
+        model_type = str(model_type_cell).strip() if model_type_cell else ""
+
+        yield SubscriptionRow(tei=tei, issi=issi, alias=alias, model_type=model_type)
+
+
+def plan_subscription_import(rows: Iterable[SubscriptionRow], errors: Optional[list[str]] = None) -> SubscriptionImportPlan:
+    """
+    Diff the export rows against the database without writing anything.
+
+    Only subscriptions of owned customers that are not DMO only are managed by
+    the export: those are the ones that get deleted when missing from it.
+    """
+    plan = SubscriptionImportPlan(errors=errors if errors is not None else [])
+
+    # Last row wins when the export lists an ISSI or a TEI more than once
+    wanted: dict[int, SubscriptionRow] = {}
+    issi_by_tei: dict[int, int] = {}
+    excel_pairs: set[tuple[int, int]] = set()
+
+    for row in rows:
+        previous_issi = issi_by_tei.get(row.tei)
+        if previous_issi is not None and previous_issi != row.issi:
+            wanted.pop(previous_issi, None)
+        previous_row = wanted.get(row.issi)
+        if previous_row is not None and previous_row.tei != row.tei:
+            issi_by_tei.pop(previous_row.tei, None)
+
+        wanted[row.issi] = row
+        issi_by_tei[row.tei] = row.issi
+        excel_pairs.add((row.tei, row.issi))
+
+    # ------------------------------------------------------------ radios / ISSIs
+    plan.watched_teis = sorted({row.tei for row in wanted.values()})
+    plan.watched_issis = sorted(wanted)
+    plan.fingerprint = plan_fingerprint(plan)
+
+    existing_teis = set(
+        Radio.objects.filter(TEI__in=plan.watched_teis).values_list("TEI", flat=True)
+    )
+    for row in list(wanted.values()):
+        if row.tei in existing_teis:
+            continue
+        model_id = tei_range_index.lookup(row.tei)
+        if model_id is None:
+            plan.errors.append(f"Geen RadioModel gevonden voor TEI {row.tei}")
+            del wanted[row.issi]
+            continue
+        existing_teis.add(row.tei)
+        plan.radios_to_create.append((row.tei, model_id))
+
+    existing_issis = set(
+        ISSI.objects.filter(number__in=wanted.keys()).values_list("number", flat=True)
+    )
+    plan.issis_to_create = sorted(set(wanted) - existing_issis)
+
+    # ------------------------------------------------------------ subscriptions
+    sub_by_issi: dict[int, tuple[int, int, str]] = {}
+    sub_by_radio: dict[int, tuple[int, int, str]] = {}
+    existing_pairs: dict[tuple[int, int], int] = {}
+
+    subscriptions = _plan_subscriptions(plan).values_list(*SUBSCRIPTION_FIELDS)
+    for pk, tei, issi, astrid_alias, dmo_only, owner in subscriptions:
+        sub_by_issi[issi] = (pk, tei, astrid_alias)
+        sub_by_radio[tei] = (pk, issi, astrid_alias)
+        if owner and not dmo_only:
+            existing_pairs[(tei, issi)] = pk
+
+    replaced: set[int] = set()
+
+    for row in wanted.values():
+        if (row.tei, row.issi) in existing_pairs:
+            pk, _, astrid_alias = sub_by_issi[row.issi]
+            if astrid_alias != row.alias:
+                plan.aliases_to_update.append((pk, row.issi, astrid_alias, row.alias))
+            continue
+
+        # The ISSI or the radio belongs to another subscription: replace it
+        for conflict in (sub_by_issi.get(row.issi), sub_by_radio.get(row.tei)):
+            if conflict is not None:
+                replaced.add(conflict[0])
+
+        issi_sub = sub_by_issi.get(row.issi)
+        if issi_sub is not None and issi_sub[1] != row.tei:
+            plan.issis_moved.append((row.issi, issi_sub[1], row.tei))
+
+        plan.subscriptions_to_create.append(row)
+
+    plan.subscriptions_to_replace = sorted(replaced)
+
+    # Remove subscriptions that no longer exist in the export
+    for (tei, issi), pk in existing_pairs.items():
+        if (tei, issi) not in excel_pairs and pk not in replaced:
+            plan.subscriptions_to_delete.append((pk, tei, issi))
+
+    plan.registered = len(excel_pairs)
+    return plan
+
+
+class StalePlanError(Exception):
+    """The database changed since the plan was computed."""
+
+
+def _plan_subscriptions(plan: SubscriptionImportPlan):
+    """
+    The subscriptions a plan depends on: the ones the export manages (owned,
+    not DMO only), and the ones holding a radio or ISSI of the export.
+    """
+    return Subscription.objects.filter(
+        Q(issi__customer__owner=True, DMO_only=False)
+        | Q(radio__in=plan.watched_teis)
+        | Q(issi__in=plan.watched_issis)
+    )
+
+
+def plan_fingerprint(plan: SubscriptionImportPlan, lock: bool = False) -> str:
+    """
+    Hash of every row a plan was computed from: the subscriptions of
+    _plan_subscriptions() (with the owner flag of their customer), and the
+    radios and ISSIs of the export. With lock=True those subscriptions stay
+    locked until the transaction ends.
+    """
+    subscriptions = _plan_subscriptions(plan).order_by("pk")
+    if lock:
+        subscriptions = subscriptions.select_for_update(of=("self",))
+
+    digest = hashlib.sha256()
+    for row in subscriptions.values_list(*SUBSCRIPTION_FIELDS).iterator(chunk_size=2000):
+        digest.update(repr(row).encode())
+    digest.update(repr(sorted(
+        Radio.objects.filter(TEI__in=plan.watched_teis).values_list("TEI", flat=True)
+    )).encode())
+    digest.update(repr(sorted(
+        ISSI.objects.filter(number__in=plan.watched_issis).values_list("number", flat=True)
+    )).encode())
+    return digest.hexdigest()
+
+
+def plan_is_current(plan: SubscriptionImportPlan) -> bool:
+    return plan.fingerprint == plan_fingerprint(plan)
+
+
+def apply_subscription_import(plan: SubscriptionImportPlan) -> SubscriptionImportResult:
+    """
+    Write a SubscriptionImportPlan to the database in one short transaction.
+    Raises StalePlanError when the rows it was computed from changed since.
+    """
+    result = SubscriptionImportResult(registered=plan.registered)
+
+    customers = issi_range_resolver.resolve_many(plan.issis_to_create)
+
+    with transaction.atomic():
+        if plan_fingerprint(plan, lock=True) != plan.fingerprint:
+            raise StalePlanError("De gegevens zijn gewijzigd sinds het voorbeeld, upload het bestand opnieuw.")
+
+        Radio.objects.bulk_create(
+            [Radio(TEI=tei, model_id=model_id) for tei, model_id in plan.radios_to_create],
+            batch_size=BATCH_SIZE,
+        )
+        result.radios_created = len(plan.radios_to_create)
+
+        ISSI.objects.bulk_create(
+            [
+                ISSI(number=number, customer_id=customer_id, discipline_id=discipline_id)
+                for number, (customer_id, discipline_id) in customers.items()
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        result.issis_created = len(customers)
+
+        delete_ids = plan.subscriptions_to_replace + [pk for pk, _, _ in plan.subscriptions_to_delete]
+        for pk, tei, issi in plan.subscriptions_to_delete:
+            logger.info("Delete subscription: TEI %s, ISSI %s", tei, issi)
+        if delete_ids:
+            Subscription.objects.filter(pk__in=delete_ids).delete()
+        result.deleted = len(plan.subscriptions_to_delete)
+
+        Subscription.objects.bulk_create(
+            [
+                Subscription(radio_id=row.tei, issi_id=row.issi, astrid_alias=row.alias)
+                for row in plan.subscriptions_to_create
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        result.created = len(plan.subscriptions_to_create)
+
+        Subscription.objects.bulk_update(
+            [Subscription(pk=pk, astrid_alias=alias) for pk, _, _, alias in plan.aliases_to_update],
+            ["astrid_alias"],
+            batch_size=BATCH_SIZE,
+        )
+        result.updated = len(plan.aliases_to_update)
+
+        # Bulk queries skip the model signals, tell the RoIP caches ourselves
+        changed = {
+            "issis": (
+                [row.issi for row in plan.subscriptions_to_create]
+                + [issi for _, _, issi in plan.subscriptions_to_delete]
+                + [issi for issi, _, _ in plan.issis_moved]
+            ),
+            "radios": (
+                [row.tei for row in plan.subscriptions_to_create]
+                + [tei for _, tei, _ in plan.subscriptions_to_delete]
+                + [old_tei for _, old_tei, _ in plan.issis_moved]
+            ),
+        }
+        directory_changed(**changed)
+        # The radios that got, lost or changed their ISSI, pushed to RoIP once committed
+        enqueue_roip_sync_for_tei(changed["radios"])
+
+    return result
+
+
+def import_subscriptions(rows: Iterable[SubscriptionRow], errors: Optional[list[str]] = None) -> SubscriptionImportResult:
+    return apply_subscription_import(plan_subscription_import(rows, errors))
+
+
+# ---------------------------------------------------------------- dry-run cache
+# Plans are cached by the SHA-256 of the uploaded file, so the confirm step
+# (or a second upload of the same file) does not parse the export again. A
+# cached plan is only reused while plan_is_current(), and applying it first
+# claims it, so two confirms cannot apply the same plan twice.
+
+def _plan_cache_key(file_hash: str) -> str:
+    return f"astrid:subscription-plan:{file_hash}"
+
+
+def cache_plan(file_hash: str, plan: SubscriptionImportPlan) -> None:
+    cache.set(_plan_cache_key(file_hash), plan, PLAN_CACHE_TIMEOUT)
+
+
+def get_cached_plan(file_hash: str) -> Optional[SubscriptionImportPlan]:
+    return cache.get(_plan_cache_key(file_hash))
+
+
+def claim_plan(file_hash: str) -> Optional[SubscriptionImportPlan]:
+    """Take the cached plan out of the cache; None when it expired or another confirm claimed it."""
+    plan = get_cached_plan(file_hash)
+    # delete() only returns True for the one caller that actually removed the key
+    if plan is None or not cache.delete(_plan_cache_key(file_hash)):
+        return None
+    return plan
+
@@ -0,0 +1,72 @@
+# astrid/tasks.py
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import asdict
+
+from celery import shared_task
+
+from .subscription_import import (
+    StalePlanError,
+    apply_subscription_import,
+    cache_plan,
+    claim_plan,
+    get_cached_plan,
+    iter_export_rows,
+    parse_subscription_rows,
+    plan_is_current,
+    plan_subscription_import,
+)
+
+log = logging.getLogger(__name__)
+
+PROGRESS_EVERY = 500
+
+
+@shared_task(bind=True)
+def preview_subscriptions_file(self, path: str, file_hash: str) -> dict:
+    """
+    Dry-run an uploaded Astrid export and cache the resulting plan by file hash.
+
+    Progress is reported as a PROGRESS state with the number of rows read.
+    The uploaded file is removed once it has been parsed.
+    """
+    errors: list[str] = []
+
+    def rows_with_progress():
+        for count, row in enumerate(iter_export_rows(path), start=1):
+            if count % PROGRESS_EVERY == 0:
+                self.update_state(state="PROGRESS", meta={"stage": "parsing", "rows": count})
+            yield row
+
+    try:
+        plan = get_cached_plan(file_hash)
+        if plan is None or not plan_is_current(plan):
+            plan = plan_subscription_import(parse_subscription_rows(rows_with_progress(), errors), errors)
+            cache_plan(file_hash, plan)
+    except KeyError as e:
+        # Raised if a required column is missing in the export
+        return {"errors": [f"Kolom ontbreekt in Excel: {e}"]}
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            log.warning("Could not remove uploaded Astrid export %s", path)
+
+    return {**plan.summary(), "preview": True, "file_hash": file_hash}
+
+
+@shared_task
+def apply_subscriptions_plan(file_hash: str) -> dict:
+    """Apply the plan cached by preview_subscriptions_file, if the database still matches it."""
+    plan = claim_plan(file_hash)
+    if plan is None:
+        return {"errors": ["Het voorbeeld is verlopen, upload het bestand opnieuw."]}
+
+    try:
+        result = apply_subscription_import(plan)
+    except StalePlanError as e:
+        return {"errors": [str(e)]}
+
+    return {**asdict(result), "errors": plan.errors}
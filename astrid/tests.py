@@ -1,11 +1,29 @@
-from django.test import TestCase
+import os
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+
+import openpyxl
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils.translation import activate
 
 from helpdesk.models import TicketStatus
-from radio.models import ISSI, Radio, RadioModel, Subscription, TEIRange
+from radio.models import ISSI, Customer, ISSICustomerRange, Radio, RadioModel, Subscription, TEIRange
+from radio.services.range_index import issi_range_resolver
 
 from .models import Request
+from .subscription_import import (
+    claim_plan,
+    import_subscriptions,
+    iter_export_rows,
+    parse_subscription_rows,
+    plan_subscription_import,
+)
+from .tasks import apply_subscriptions_plan, preview_subscriptions_file
 
 
 class VTEIRequestCreateViewTests(TestCase):
@@ -60,3 +78,254 @@ class VTEIRequestCreateViewTests(TestCase):
         self.assertEqual(request.request_type, Request.RequestType.VISSI_VTEI)
         self.assertEqual(request.old_issi, self.old_issi)
         self.assertEqual(request.new_issi, self.new_issi)
+
+
+SUBSCRIPTION_HEADER = ("TEI", "ISSI", "CICAlias", "ModelType")
+
+
+def subscriptions_workbook(rows):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(SUBSCRIPTION_HEADER)
+    for row in rows:
+        ws.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return SimpleUploadedFile(
+        "subscriptions.xlsx",
+        buffer.getvalue(),
+        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    )
+
+
+class SubscriptionImportTests(TestCase):
+    def setUp(self):
+        activate("en")
+        self.addCleanup(issi_range_resolver.invalidate)
+        self.addCleanup(cache.clear)
+        model = RadioModel.objects.create(name="Test radio")
+        TEIRange.objects.create(model=model, min_tei=750000000000000, max_tei=750000000000999)
+        customer = Customer.objects.create(name="Brandweer", owner=True)
+        ISSICustomerRange.objects.create(customer=customer, min_issi=1000000, max_issi=1999999)
+
+        self.kept = Subscription.objects.create(
+            radio=Radio.objects.create(TEI=750000000000001),
+            issi=ISSI.objects.create(number=1000001),
+            astrid_alias="OLD",
+        )
+        self.stale = Subscription.objects.create(
+            radio=Radio.objects.create(TEI=750000000000002),
+            issi=ISSI.objects.create(number=1000002),
+        )
+        self.moved = Subscription.objects.create(
+            radio=Radio.objects.create(TEI=750000000000003),
+            issi=ISSI.objects.create(number=1000003),
+        )
+
+    def parse(self, rows, errors):
+        return list(parse_subscription_rows([SUBSCRIPTION_HEADER, *rows], errors))
+
+    def test_import_creates_updates_and_deletes_in_bulk(self):
+        errors = []
+        rows = self.parse(
+            [
+                (750000000000001, 1000001, "NEW", "MTP850"),
+                (750000000000004, 1000003, "MOVED", "MTP850"),
+                (750000000000005, 1000005, "", "MTP850"),
+                (750000000000006, 1000006, "", "Spare subscription"),
+                ("abc", 1000007, "", "MTP850"),
+            ],
+            errors,
+        )
+
+        # The delete selects the rows first because Subscription has delete signals, which
+        # log a directory change per row; the three fingerprint queries run when planning
+        # and again before applying; one more directory change log for the bulk writes
+        with self.assertNumQueries(20):
+            result = import_subscriptions(rows, errors)
+
+        self.assertEqual(errors, ["Onjuiste waarde TEI=abc, ISSI=1000007"])
+        self.assertEqual(result.registered, 3)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.updated, 1)
+        self.assertEqual(result.deleted, 1)
+        self.assertEqual(result.radios_created, 2)
+        self.assertEqual(result.issis_created, 1)
+
+        self.assertEqual(Subscription.objects.get(issi=1000001).astrid_alias, "NEW")
+        self.assertFalse(Subscription.objects.filter(pk=self.stale.pk).exists())
+        self.assertEqual(Subscription.objects.get(issi=1000003).radio_id, 750000000000004)
+        self.assertEqual(Radio.objects.get(TEI=750000000000005).model.name, "Test radio")
+        self.assertTrue(ISSI.objects.get(number=1000005).customer.owner)
+        self.assertFalse(Radio.objects.filter(TEI=750000000000006).exists())
+
+    def test_import_queues_changed_radios_for_roip_in_one_push(self):
+        errors = []
+        rows = self.parse(
+            [
+                (750000000000001, 1000001, "NEW", "MTP850"),
+                (750000000000004, 1000003, "MOVED", "MTP850"),
+                (750000000000005, 1000005, "", "MTP850"),
+            ],
+            errors,
+        )
+
+        with patch("roip.enrichment.redis_client"), patch("RadioAssetManagement.tasks.outbox_redis") as outbox:
+            with self.captureOnCommitCallbacks(execute=True):
+                import_subscriptions(rows, errors)
+
+        # Created, moved away from and deleted; the alias change is not pushed
+        outbox.return_value.sadd.assert_called_once()
+        self.assertEqual(
+            sorted(outbox.return_value.sadd.call_args.args[1:]),
+            [750000000000002, 750000000000003, 750000000000004, 750000000000005],
+        )
+
+    def test_plan_reports_unknown_tei_range(self):
+        errors = []
+        plan = plan_subscription_import(
+            self.parse([(760000000000001, 1000001, "", "MTP850")], errors),
+            errors,
+        )
+
+        self.assertEqual(errors, ["Geen RadioModel gevonden voor TEI 760000000000001"])
+        self.assertEqual(plan.subscriptions_to_create, [])
+
+    def test_csv_export_is_streamed_into_rows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "export.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("TEI;ISSI;CICAlias;ModelType\n")
+                f.write("000750000000000001;1000001;NEW;MTP850\n")
+                f.write("000750000000000006;1000006;;Spare subscription\n")
+
+            errors = []
+            rows = list(parse_subscription_rows(iter_export_rows(path), errors))
+
+        self.assertEqual(errors, [])
+        self.assertEqual([(row.tei, row.issi, row.alias) for row in rows], [(750000000000001, 1000001, "NEW")])
+
+    def write_export(self, directory, rows):
+        path = os.path.join(directory, "export.xlsx")
+        with open(path, "wb") as f:
+            f.write(subscriptions_workbook(rows).read())
+        return path
+
+    def test_preview_task_writes_nothing_and_caches_plan(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.write_export(tmp, [(750000000000004, 1000003, "MOVED", "MTP850")])
+
+            summary = preview_subscriptions_file.apply(args=(path, "hash-1")).get()
+
+            self.assertFalse(os.path.exists(path))
+
+        self.assertTrue(summary["preview"])
+        self.assertEqual(summary["counts"]["created"], 1)
+        self.assertEqual(summary["moved"], [[1000003, 750000000000003, 750000000000004]])
+        self.assertEqual(summary["counts"]["deleted"], 2)
+        self.assertTrue(Subscription.objects.filter(pk=self.moved.pk).exists())
+        self.assertFalse(Radio.objects.filter(TEI=750000000000004).exists())
+
+        # Uploading the same file again reuses the cached plan
+        with patch("astrid.tasks.plan_subscription_import") as plan:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = self.write_export(tmp, [])
+                preview_subscriptions_file.apply(args=(path, "hash-1")).get()
+        plan.assert_not_called()
+
+        result = apply_subscriptions_plan.apply(args=("hash-1",)).get()
+
+        self.assertEqual(result["created"], 1)
+        self.assertEqual(result["deleted"], 2)
+        self.assertEqual(Subscription.objects.get(issi=1000003).radio_id, 750000000000004)
+
+        expired = apply_subscriptions_plan.apply(args=("hash-1",)).get()
+        self.assertEqual(len(expired["errors"]), 1)
+
+    def test_cached_plan_is_recomputed_when_database_changed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            preview_subscriptions_file.apply(args=(self.write_export(tmp, [(750000000000004, 1000003, "MOVED", "MTP850")]), "hash-2")).get()
+        Subscription.objects.filter(pk=self.moved.pk).update(astrid_alias="EDITED")
+
+        with patch("astrid.tasks.plan_subscription_import", wraps=plan_subscription_import) as plan:
+            with tempfile.TemporaryDirectory() as tmp:
+                preview_subscriptions_file.apply(args=(self.write_export(tmp, [(750000000000004, 1000003, "MOVED", "MTP850")]), "hash-2")).get()
+        plan.assert_called_once()
+
+    def test_stale_plan_is_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            preview_subscriptions_file.apply(args=(self.write_export(tmp, [(750000000000004, 1000003, "MOVED", "MTP850")]), "hash-3")).get()
+        # Changed after the preview: the plan would delete or recreate the wrong rows
+        ISSI.objects.create(number=1000099)
+        Subscription.objects.filter(pk=self.stale.pk).delete()
+
+        result = apply_subscriptions_plan.apply(args=("hash-3",)).get()
+
+        self.assertEqual(len(result["errors"]), 1)
+        self.assertNotIn("created", result)
+        self.assertTrue(Subscription.objects.filter(pk=self.moved.pk).exists())
+
+    def test_plan_ignores_subscriptions_outside_the_export(self):
+        # Not owned and not in the export: neither read nor locked by the plan
+        foreign = Subscription.objects.create(
+            radio=Radio.objects.create(TEI=750000000000009),
+            issi=ISSI.objects.create(number=5000001),
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            preview_subscriptions_file.apply(args=(self.write_export(tmp, [(750000000000004, 1000003, "MOVED", "MTP850")]), "hash-5")).get()
+        Subscription.objects.filter(pk=foreign.pk).update(astrid_alias="EDITED")
+
+        result = apply_subscriptions_plan.apply(args=("hash-5",)).get()
+
+        self.assertEqual(result["created"], 1)
+        self.assertTrue(Subscription.objects.filter(pk=foreign.pk).exists())
+
+    def test_plan_is_claimed_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            preview_subscriptions_file.apply(args=(self.write_export(tmp, [(750000000000004, 1000003, "MOVED", "MTP850")]), "hash-4")).get()
+
+        self.assertIsNotNone(claim_plan("hash-4"))
+        self.assertIsNone(claim_plan("hash-4"))
+
+    def assertStatusVisibleOnlyForOwnTasks(self, response):
+        task_id = response["Location"].split("task=")[1]
+        with patch("RadioAssetManagement.task_status.AsyncResult") as result:
+            result.return_value.configure_mock(**{
+                "state": "PENDING", "successful.return_value": False, "failed.return_value": False,
+            })
+            own = self.client.get(reverse("astrid:upload_subscriptions_status", args=[task_id]))
+            other = self.client.get(reverse("astrid:upload_subscriptions_status", args=["someone-elses-task"]))
+
+        self.assertEqual(own.json(), {"state": "PENDING"})
+        self.assertEqual(other.status_code, 404)
+        result.assert_called_once_with(task_id)
+
+    def test_upload_view_queues_preview_and_confirm_applies_it(self):
+        user = User.objects.create_user(username="astrid", password="secret")
+        user.user_permissions.add(Permission.objects.get(codename="can_upload_subscriptions"))
+        self.client.force_login(user)
+        upload = subscriptions_workbook([(750000000000001, 1000001, "NEW", "MTP850")])
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(ASTRID_UPLOAD_DIR=tmp), patch(
+            "astrid.views.preview_subscriptions_file.delay",
+            side_effect=lambda path, file_hash: preview_subscriptions_file.apply(args=(path, file_hash)),
+        ) as delay:
+            response = self.client.post(reverse("astrid:upload_subscriptions"), {"excelFile": upload})
+
+        self.assertEqual(response.status_code, 302)
+        path, file_hash = delay.call_args.args
+        self.assertTrue(path.endswith(".xlsx"))
+        self.assertStatusVisibleOnlyForOwnTasks(response)
+        self.assertEqual(Subscription.objects.get(issi=1000001).astrid_alias, "OLD")
+
+        with patch(
+            "astrid.views.apply_subscriptions_plan.delay",
+            side_effect=lambda file_hash: apply_subscriptions_plan.apply(args=(file_hash,)),
+        ):
+            response = self.client.post(reverse("astrid:upload_subscriptions"), {"confirm": file_hash})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(Subscription.objects.values_list("radio_id", "issi_id", "astrid_alias")),
+            [(750000000000001, 1000001, "NEW")],
+        )
@@ -15,5 +15,6 @@ urlpatterns = [
     path('requests', RequestOverviewView.as_view(), name='request_overview'),
 
     path('subscritpions/upload', UploadSubscriptionsView.as_view(), name='upload_subscriptions'),
+    path('subscritpions/upload/<str:task_id>', UploadSubscriptionsStatusView.as_view(), name='upload_subscriptions_status'),
 
 ]
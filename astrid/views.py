@@ -14,11 +14,16 @@ from django.db.models import Q
 
 
 from django.db import transaction
-import openpyxl
+from django.utils.http import urlencode
+import hashlib
+import os
+import uuid
 
 from helpdesk.models import *
 from radio.models import *
 from .models import *
+from .tasks import apply_subscriptions_plan, preview_subscriptions_file
+from RadioAssetManagement.task_status import remember_task, task_status_response
 
 import logging
 logger = logging.getLogger(__name__)
@@ -27,110 +32,53 @@ logger = logging.getLogger(__name__)
 class UploadSubscriptionsView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
     permission_required = 'radio.can_upload_subscriptions'
     template_name = "astrid/upload_subscriptions.html"
+    allowed_extensions = (".xlsx", ".xlsm", ".csv")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["task_id"] = self.request.GET.get("task", "")
+        return context
 
     def post(self, request):
+        # Confirm step: apply the plan computed by the dry-run of this file
+        file_hash = request.POST.get("confirm")
+        if file_hash:
+            task = apply_subscriptions_plan.delay(file_hash)
+            remember_task(request, apply_subscriptions_plan, task)
+            return redirect(f"{request.path}?{urlencode({'task': task.id})}")
+
         try:
-            # Get the uploaded Excel file from the request
-            excel_file = request.FILES["excelFile"]
-
-            # Load the Excel workbook (read-only, with formulas resolved to values)
-            wb = openpyxl.load_workbook(excel_file, data_only=True)
-            ws = wb.active
-
-            # Extract the header row and map column names to their index
-            header = [cell.value for cell in next(ws.iter_rows(min_row=1, max_row=1))]
-            col = {name: idx for idx, name in enumerate(header)}
-
-            # Perform all DB operations in a single atomic transaction
-            with transaction.atomic():
-                excel_subs = set()
-
-                # Get existing subscriptions linked to owned customers (TEI, ISSI pairs)
-                existing_subs = set(Subscription.objects.filter(issi__customer__owner=True, DMO_only=False).values_list('radio__TEI', 'issi__number'))
-
-                # Iterate through each row in the Excel file
-                for row in ws.iter_rows(min_row=2):
-                    tei_cell = row[col['TEI']].value
-                    issi_cell = row[col['ISSI']].value
-                    alias_cell = row[col['CICAlias']].value
-                    model_type_cell = row[col['ModelType']].value
-
-                    # Skip rows with missing TEI or ISSI
-                    if tei_cell is None or issi_cell is None:
-                        continue
-
-                    # Skip spare subscriptions
-                    if model_type_cell == "Spare subscription":
-                        continue
-
-                    try:
-                        # Convert TEI to string. TEI is stored as the full 15-digit number.
-                        tei_str = str(tei_cell).strip()
-                        tei = int(tei_str)
-
-                        # Parse ISSI number as integer
-                        issi_number = int(str(issi_cell).strip())
-                    except ValueError:
-                        # Invalid TEI or ISSI formatting -> skip row with error message
-                        messages.error(request, f"Onjuiste waarde TEI={tei_cell}, ISSI={issi_cell}")
-                        continue
-
-                    # Parse alias (optional field)
-                    alias = str(alias_cell).strip() if alias_cell else ""
-
-                    try:
-                        # Get or create the radio object by TEI
-                        radio, _ = Radio.objects.get_or_create(TEI=tei)
-                    except ValueError as e:
-                        # Invalid TEI -> skip row with error message
-                        messages.error(request, f"{e}")
-                        continue
-
-                    # Get or create the ISSI object
-                    issi, _ = ISSI.objects.get_or_create(number=issi_number)
-
-                    if (tei, issi_number) not in existing_subs:
-                        # If ISSI already belongs to another subscription, delete that one
-                        other_subscirption_with_issi = Subscription.objects.filter(issi=issi)
-                        if other_subscirption_with_issi:
-                            other_subscirption_with_issi.delete()
-
-                        # Create a new subscription for this TEI/ISSI combinatiom
-                        Subscription.objects.create(
-                            radio=radio,
-                            issi=issi,
-                            astrid_alias=alias
-                        )
-                        
-                    else:
-                        # Update alias if subscription already exists but alias changed
-                        sub = Subscription.objects.get(radio=radio, issi=issi_number)
-                        if sub.astrid_alias != alias:
-                            sub.astrid_alias = alias
-                            sub.save()
-
-                    # Track the subscriptions present in Excel
-                    excel_subs.add((tei, issi_number))
-
-                # Remove subscriptions that no longer exist in the Excel file
-                to_delete = existing_subs - excel_subs
-                for tei_del, issi_del in to_delete:
-                    subscription_to_delete = Subscription.objects.filter(radio__TEI=tei_del, issi__number=issi_del)
-                    logger.info(f"Delete subscripton: {subscription_to_delete}")
-                    subscription_to_delete.delete()
-
-            # Show success message with summary
-            messages.success(request, f"Succesvol verwerkt. {len(excel_subs)} abonnomenten geregistreerd, {len(to_delete)} abonnomenten verwijderd.")
-
-        except KeyError as e:
-            # Raised if a required column is missing in the Excel file
-            messages.error(request, f"Kolom ontbreekt in Excel: {e}")
-        except Exception as e:
-            # Catch any other unexpected error, include ISSI/TEI context if available
-            messages.error(request, f"Er is een fout opgetreden: {e} (ISSI: {issi_cell}, TEI: {tei_cell})")
+            # Get the uploaded export from the request
+            upload = request.FILES["excelFile"]
+        except KeyError:
+            messages.error(request, "Geen bestand opgegeven")
+            return redirect(request.path)
+
+        extension = os.path.splitext(upload.name)[1].lower()
+        if extension not in self.allowed_extensions:
+            messages.error(request, f"Ongeldig bestandstype: {extension}")
+            return redirect(request.path)
+
+        # Store the upload where the Celery worker can read it, then dry-run it in the background
+        os.makedirs(settings.ASTRID_UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(settings.ASTRID_UPLOAD_DIR, f"{uuid.uuid4().hex}{extension}")
+        digest = hashlib.sha256()
+        with open(path, "wb") as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+                digest.update(chunk)
+
+        task = preview_subscriptions_file.delay(path, digest.hexdigest())
+        remember_task(request, preview_subscriptions_file, task)
+
+        return redirect(f"{request.path}?{urlencode({'task': task.id})}")
+
+
+class UploadSubscriptionsStatusView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    permission_required = 'radio.can_upload_subscriptions'
 
-        # Return the template with updated context after processing
-        return self.get(request)
+    def get(self, request, task_id):
+        return task_status_response(request, task_id, [preview_subscriptions_file, apply_subscriptions_plan])
 
 
 
@@ -5,6 +5,7 @@ from __future__ import annotations
 from django.contrib import admin, messages
 from .models import *
 from .sync import sync_fireplan_fleet, sync_vectors
+from .sync_runs import sync_run_trends
 
 from .auth_admin import *
 from .sync_inventory import sync_closed_inventories_portable_radio_teis
@@ -198,3 +199,34 @@ class FireplanInventoryRadioAdmin(admin.ModelAdmin):
     )
     autocomplete_fields = ("inventory", "radio")
     ordering = ("-id",)
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    change_list_template = "admin/fireplan/syncrun/change_list.html"
+    list_display = (
+        "started_at",
+        "kind",
+        "status",
+        "duration_s",
+        "http_s",
+        "db_s",
+        "db_queries",
+        "fetched",
+        "created",
+        "updated",
+        "deleted",
+        "checkpoint",
+    )
+    list_filter = ("kind", "status")
+    date_hierarchy = "started_at"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {**(extra_context or {}), "sync_trends": sync_run_trends()}
+        return super().changelist_view(request, extra_context=extra_context)
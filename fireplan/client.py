@@ -1,10 +1,27 @@
 import json
+import logging
+import os
 import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
 import requests
 from bs4 import BeautifulSoup
 from django.conf import settings
 from django.utils import timezone
 
+logger = logging.getLogger(__name__)
+
+
+class FireplanPageError(Exception):
+    """A page could not be fetched; every page before it was yielded already."""
+
+    def __init__(self, page):
+        super().__init__(f"Fireplan pagina {page} kon niet opgehaald worden")
+        self.page = page
+
 
 class FireplanClient:
     BASE = "http://fireplan.firebru2k8.local"
@@ -18,12 +35,22 @@ class FireplanClient:
         r"https://infoscan\.firebru\.brussels\?data[=-]\d+,\d+,(?P<fireplan_id>\d+),\d+$"
     )
     LOCATION_ID_PATTERN = re.compile(r"/(\d+)(?:/)?$")
+    PAGE_SIZE = 500
+    MAX_PAGES_IN_FLIGHT = 4
+    PAGE_RETRIES = 2
+    QR_CODES_PAGE_SIZE = 1000
 
     def __init__(self):
         self.session = requests.Session()
+        self._local = threading.local()
+        self._login_lock = threading.Lock()
+        # Bumped on every login, so the page workers pick up the new cookies
+        self._login_generation = 0
         self.login()
 
     def login(self):
+        self.session.cookies.clear()
+
         # GET login page
         r = self.session.get(self.LOGIN_URL)
         soup = BeautifulSoup(r.text, "html.parser")
@@ -41,24 +68,124 @@ class FireplanClient:
         if "Identifiants invalides" in resp.text:
             raise Exception("❌ Foute Fireplan login")
 
+        self._login_generation += 1
+
+    def _session_expired(self, response):
+        # Fireplan answers API calls of an expired session with a 401 or a redirect to the login page
+        return response.status_code == 401 or (response.url or "").startswith(self.LOGIN_URL)
+
+    def _request(self, session, method, path, **kwargs):
+        """Send a request; when the session expired, log in again (once for all threads) and retry."""
+        generation = self._login_generation
+        response = session.request(method, self.BASE + path, **kwargs)
+        if not self._session_expired(response):
+            return response
+
+        with self._login_lock:
+            if self._login_generation == generation:
+                logger.info("Fireplan sessie verlopen, opnieuw aanmelden")
+                self.login()
+        if session is not self.session:
+            session = self._thread_session()
+        return session.request(method, self.BASE + path, **kwargs)
+
     def get(self, path, **kwargs):
-        return self.session.get(self.BASE + path, **kwargs)
+        return self._request(self.session, "GET", path, **kwargs)
 
     def post(self, path, data=None, json=None, **kwargs):
-        return self.session.post(self.BASE + path, data=data, json=json, **kwargs)
+        return self._request(self.session, "POST", path, data=data, json=json, **kwargs)
 
-    def get_radio_qr_code_record(self, serial_number):
+    def close(self):
+        self.session.close()
+
+    def _thread_session(self):
+        # requests.Session is not thread-safe: page workers get their own, logged in with our cookies
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.session.headers)
+            self._local.session = session
+        if getattr(self._local, "generation", None) != self._login_generation:
+            session.cookies.clear()
+            session.cookies.update(self.session.cookies)
+            self._local.generation = self._login_generation
+        return session
+
+    def get_json(self, path, **kwargs):
+        """GET a JSON endpoint; safe to call from several threads at once."""
+        r = self._request(self._thread_session(), "GET", path, **kwargs)
+        r.raise_for_status()
+        return r.json() or {}
+
+    def _fetch_page(self, path, payload, page, page_size):
+        r = self._request(self._thread_session(), "POST", path, json={**payload, "page": page, "size": page_size})
+        r.raise_for_status()
+        return r.json().get("records", [])
+
+    def iter_pages(self, path, payload=None, page_size=None, start_page=1, max_in_flight=None):
+        """
+        Yield (page, records) for a paginated POST endpoint, in page order.
+
+        Up to `max_in_flight` pages are fetched at the same time; the next one is
+        only requested once the oldest has been handed out, so memory is bounded
+        by the pages in flight. The first empty page ends the fetch (a short page
+        does not, in case the server caps the page size). When a page fails,
+        FireplanPageError tells which one, so the caller can resume there.
+        """
+        payload = dict(payload or {})
+        page_size = page_size or self.PAGE_SIZE
+        max_in_flight = max_in_flight or self.MAX_PAGES_IN_FLIGHT
+
+        with ThreadPoolExecutor(max_in_flight, thread_name_prefix="fireplan-page") as pool:
+            pending = deque()
+            next_page = start_page
+            try:
+                while True:
+                    while len(pending) < max_in_flight:
+                        pending.append((next_page, pool.submit(self._fetch_page, path, payload, next_page, page_size)))
+                        next_page += 1
+
+                    page, future = pending.popleft()
+                    try:
+                        records = future.result()
+                    except (requests.RequestException, ValueError) as e:
+                        raise FireplanPageError(page) from e
+
+                    if not records:
+                        return
+                    yield page, records
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def iter_records(self, path, payload=None, page_size=None, start_page=1, max_in_flight=None, retries=None):
+        """All records of a paginated endpoint, resuming at the failed page up to `retries` times."""
+        retries = self.PAGE_RETRIES if retries is None else retries
+        page = start_page
+        while True:
+            try:
+                for page, records in self.iter_pages(path, payload, page_size, page, max_in_flight):
+                    yield from records
+                return
+            except FireplanPageError as e:
+                if retries <= 0:
+                    raise
+                retries -= 1
+                page = e.page
+                logger.warning("%s; hervatten vanaf pagina %s", e, page)
+
+    def _qr_code_params(self, name, serial_number=None, first=0, rows=10):
         filters = {
             "id": {
                 "operator": "and",
                 "constraints": [{"value": None, "matchMode": "contains"}],
             },
             "name": {
-                "value": [self.RADIO_QR_NAME],
+                "value": [name],
                 "matchMode": "in",
             },
             "serialNumber": {
-                "value": str(serial_number),
+                "value": str(serial_number) if serial_number is not None else None,
                 "matchMode": "in",
             },
             "type": {
@@ -74,19 +201,23 @@ class FireplanClient:
                 "constraints": [{"value": None, "matchMode": "dateIs"}],
             },
         }
-        params = {
-            "first": 0,
-            "rows": 10,
+        return {
+            "first": first,
+            "rows": rows,
             "filters": json.dumps(filters, separators=(",", ":")),
             "multiSortMeta": "[]",
         }
-        headers = {
+
+    def _qr_code_headers(self):
+        return {
             "Accept": "application/json, text/plain, */*",
             "X-Requested-With": "XMLHttpRequest",
             "Referer": f"{self.BASE}/fr/inventory/qr-codes",
         }
 
-        response = self.get(self.QR_CODES_PATH, params=params, headers=headers)
+    def get_radio_qr_code_record(self, serial_number):
+        params = self._qr_code_params(self.RADIO_QR_NAME, serial_number)
+        response = self.get(self.QR_CODES_PATH, params=params, headers=self._qr_code_headers())
         response.raise_for_status()
 
         for record in response.json().get("records", []):
@@ -94,11 +225,32 @@ class FireplanClient:
                 return record
         return None
 
-    def get_radio_fireplan_id(self, serial_number):
-        record = self.get_radio_qr_code_record(serial_number)
-        if not record:
-            return None
+    def iter_qr_code_records(self, name, page_size=None):
+        """
+        All QR-code records of one item name, page by page; safe to call from
+        several threads. Stops at totalRecords, or at the first empty page when
+        Fireplan does not send it.
+        """
+        page_size = page_size or self.QR_CODES_PAGE_SIZE
+        first = 0
+        while True:
+            params = self._qr_code_params(name, first=first, rows=page_size)
+            r = self._request(self._thread_session(), "GET", self.QR_CODES_PATH, params=params, headers=self._qr_code_headers())
+            r.raise_for_status()
+            data = r.json() or {}
+
+            records = data.get("records", [])
+            if not records:
+                return
+            yield from records
 
+            # The server may cap rows: continue from what was actually returned
+            first += len(records)
+            total = data.get("totalRecords")
+            if total is not None and first >= total:
+                return
+
+    def fireplan_id_from_qr_record(self, record):
         qr_code = record.get("qrCode") or ""
         match = self.QR_CODE_PATTERN.match(qr_code)
         if match:
@@ -107,6 +259,12 @@ class FireplanClient:
         fireplan_id = record.get("id")
         return int(fireplan_id) if fireplan_id else None
 
+    def get_radio_fireplan_id(self, serial_number):
+        record = self.get_radio_qr_code_record(serial_number)
+        if not record:
+            return None
+        return self.fireplan_id_from_qr_record(record)
+
     def create_radio(self, serial_number):
         payload = {
             "serialNumber": str(serial_number),
@@ -160,3 +318,116 @@ class FireplanClient:
             raise Exception("Fireplan radio aangemaakt, maar Fireplan ID kon niet bepaald worden.")
 
         return fireplan_id, True
+
+
+class FireplanClientPool:
+    """
+    Logged-in FireplanClients shared by a process.
+
+    A client is lent to one caller at a time and keeps its session, cookies
+    and keep-alive connections when it comes back, so only the first use (or
+    an expired session, see FireplanClient._request) pays for a login. At most
+    FIREPLAN_CLIENT_POOL_SIZE idle clients are kept; callers never wait for
+    one, a new client is logged in when all are lent out.
+    """
+
+    def __init__(self, max_idle=None):
+        self._max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+
+    @property
+    def max_idle(self):
+        return self._max_idle if self._max_idle is not None else settings.FIREPLAN_CLIENT_POOL_SIZE
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent's sockets are not ours to use
+                self._idle, self._pid = [], os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return FireplanClient()
+
+    def _release(self, client):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(client)
+                return
+        client.close()
+
+    @contextmanager
+    def client(self):
+        client = self._acquire()
+        try:
+            yield client
+        finally:
+            self._release(client)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for client in idle:
+            client.close()
+
+
+client_pool = FireplanClientPool()
+
+
+def fireplan_client():
+    """Borrow a logged-in FireplanClient from the process pool: `with fireplan_client() as fp: ...`"""
+    return client_pool.client()
+
+
+def _create_radio_fireplan_id(serial_number):
+    with fireplan_client() as fp:
+        fireplan_id = fp.create_radio(serial_number)
+    if not fireplan_id:
+        raise Exception("Fireplan radio aangemaakt, maar Fireplan ID kon niet bepaald worden.")
+    return fireplan_id
+
+
+def get_or_create_radio_fireplan_ids(serial_numbers, concurrency=4, progress=None):
+    """
+    get_or_create_radio_fireplan_id for a batch of serial numbers.
+
+    The radio QR codes are listed once, page by page, instead of being looked
+    up per serial number; the radios Fireplan does not know yet are created
+    `concurrency` at a time, each worker with a client from the pool.
+    Returns {serial_number: (fireplan_id, created, error)}; `progress(done, total)`
+    is called from the calling thread as serial numbers are resolved.
+    """
+    serial_numbers = list(dict.fromkeys(str(serial) for serial in serial_numbers))
+    results = {}
+    if not serial_numbers:
+        return results
+
+    with fireplan_client() as fp:
+        wanted = set(serial_numbers)
+        for record in fp.iter_qr_code_records(fp.RADIO_QR_NAME):
+            serial = str(record.get("serialNumber"))
+            if serial in wanted and serial not in results:
+                fireplan_id = fp.fireplan_id_from_qr_record(record)
+                if fireplan_id:
+                    results[serial] = (fireplan_id, False, None)
+
+    done = len(results)
+    if progress:
+        progress(done, len(serial_numbers))
+
+    missing = [serial for serial in serial_numbers if serial not in results]
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fireplan-radio") as pool:
+        futures = {pool.submit(_create_radio_fireplan_id, serial): serial for serial in missing}
+        for future in as_completed(futures):
+            serial = futures[future]
+            try:
+                results[serial] = (future.result(), True, None)
+            except Exception as e:
+                logger.warning("Fireplan radio %s kon niet aangemaakt worden: %s", serial, e)
+                results[serial] = (None, False, str(e))
+            done += 1
+            if progress:
+                progress(done, len(serial_numbers))
+
+    return results
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fireplan', '0013_make_inventory_uuids_optional'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('fleet', 'Voertuigen'), ('vectors', 'Vectoren'), ('fireplan_id', "Fireplan ID's"), ('inventory', 'Inventarissen')], max_length=20)),
+                ('status', models.CharField(choices=[('running', 'Bezig'), ('success', 'Geslaagd'), ('failed', 'Mislukt')], default='running', max_length=10)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_s', models.FloatField(blank=True, null=True)),
+                ('http_s', models.FloatField(default=0)),
+                ('db_s', models.FloatField(default=0)),
+                ('db_queries', models.PositiveIntegerField(default=0)),
+                ('fetched', models.PositiveIntegerField(default=0)),
+                ('created', models.PositiveIntegerField(default=0)),
+                ('updated', models.PositiveIntegerField(default=0)),
+                ('deleted', models.PositiveIntegerField(default=0)),
+                ('checkpoint', models.CharField(blank=True, max_length=200)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['-started_at', '-id'],
+                'indexes': [models.Index(fields=['kind', 'started_at'], name='fireplan_syncrun_kind_idx')],
+            },
+        ),
+    ]
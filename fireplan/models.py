@@ -242,3 +242,52 @@ class FireplanInventoryRadio(models.Model):
 
     def __str__(self):
         return f"{self.tei} ({self.inventory.vehicle_alpha_code})"
+
+
+class SyncRun(models.Model):
+    """
+    One run of a Fireplan sync, as recorded by fireplan.sync_runs.sync_run().
+
+    http_s is the time spent waiting on Fireplan (login included), db_s the
+    time spent in database queries of the syncing thread.
+    """
+
+    class Kind(models.TextChoices):
+        FLEET = "fleet", "Voertuigen"
+        VECTORS = "vectors", "Vectoren"
+        FIREPLAN_ID = "fireplan_id", "Fireplan ID's"
+        INVENTORY = "inventory", "Inventarissen"
+
+    class Status(models.TextChoices):
+        RUNNING = "running", "Bezig"
+        SUCCESS = "success", "Geslaagd"
+        FAILED = "failed", "Mislukt"
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.RUNNING)
+
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_s = models.FloatField(null=True, blank=True)
+    http_s = models.FloatField(default=0)
+    db_s = models.FloatField(default=0)
+    db_queries = models.PositiveIntegerField(default=0)
+
+    fetched = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    deleted = models.PositiveIntegerField(default=0)
+
+    # Last position the sync got to (page offset, last record, ...)
+    checkpoint = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-started_at", "-id"]
+        indexes = [
+            models.Index(fields=["kind", "started_at"], name="fireplan_syncrun_kind_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} – {self.started_at:%Y-%m-%d %H:%M}"
@@ -1,16 +1,25 @@
-from .client import FireplanClient
+from .client import fireplan_client
 from .models import *
 from radio.models import *
+from RadioAssetManagement.tasks import enqueue_roip_sync_for_tei
+from radio.services.range_index import tei_range_index
+from roip.signals import directory_changed
+from .sync_runs import sync_run
 import requests
 from django.conf import settings
 import json
+import logging
 from django.utils.timezone import make_aware
+from django.db import transaction
 from django.db.models import Q
 
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import re
 from dateutil import parser
 
+logger = logging.getLogger(__name__)
+
 
 def _vehicle_defaults_from_fireplan_record(rec):
     return {
@@ -24,54 +33,145 @@ def _vehicle_defaults_from_fireplan_record(rec):
     }
 
 
-def sync_fireplan_fleet():
-    fp = FireplanClient()   # login gebeurt automatisch
+def _call_sign(number):
+    # Same rule as Vehicle.save(), which bulk writes skip
+    return number.split(" - ")[0]
+
+
+class VehicleIndex:
+    """
+    All vehicles in memory, found by fireplan_id or, like the old
+    number/call_sign/"<number> -" query, by the Fireplan alphacode.
+    """
+
+    def __init__(self, vehicles):
+        self.vehicles = {}
+        self.by_fireplan_id = {}
+        self.by_name = {}
+        for vehicle in sorted(vehicles, key=lambda v: v.pk):
+            self.vehicles[vehicle.pk] = vehicle
+            if vehicle.fireplan_id:
+                self.by_fireplan_id[vehicle.fireplan_id] = vehicle
+            for name in self._names(vehicle):
+                self.by_name.setdefault(name, []).append(vehicle)
+        self.claimed = set()
+
+    @staticmethod
+    def _names(vehicle):
+        names = {vehicle.number, vehicle.call_sign}
+        number = vehicle.number or ""
+        position = number.find(" -")
+        while position != -1:
+            names.add(number[:position])
+            position = number.find(" -", position + 1)
+        names.discard("")
+        names.discard(None)
+        return names
+
+    def find(self, name):
+        candidates = self.by_name.get(name)
+        return candidates[0] if candidates else None
+
+    def match(self, fireplan_id, number):
+        vehicle = self.by_fireplan_id.get(fireplan_id)
+        if vehicle is None and number:
+            # Lowest pk first, but never a vehicle another record already took
+            vehicle = next((v for v in self.by_name.get(number, ()) if v.pk not in self.claimed), None)
+        return vehicle
 
-    path = "/fr/api/charroi/view"
+    def claim(self, vehicle, fireplan_id):
+        if vehicle.fireplan_id and self.by_fireplan_id.get(vehicle.fireplan_id) is vehicle:
+            del self.by_fireplan_id[vehicle.fireplan_id]
+        self.by_fireplan_id[fireplan_id] = vehicle
+        if vehicle.pk is not None:
+            self.claimed.add(vehicle.pk)
 
-    payload = {
-        "page": 1,
-        "size": 5000,
-        "sortby": "number",
-        "sortdesc": False,
-    }
 
-    r = fp.post(path, json=payload)
-    r.raise_for_status()
+CHARROI_PATH = "/fr/api/charroi/view"
 
-    data = r.json()
-    records = data.get("records", [])
 
-    count = 0
+def _fetch_fleet_records(fp):
+    # Page by page, so the fleet size no longer caps (or truncates) the sync
+    return fp.iter_records(CHARROI_PATH, {"sortby": "number", "sortdesc": False})
 
-    for rec in records:
-        fireplan_id = rec.get("id")
-        if not fireplan_id:
-            continue
 
-        defaults = _vehicle_defaults_from_fireplan_record(rec)
+def sync_fireplan_fleet():
+    """
+    Update the vehicles from the Fireplan charroi.
+
+    All vehicles are loaded once; the changes are written with bulk_create and
+    bulk_update, one update per set of changed fields. Returns the number of
+    Fireplan records processed.
+    """
+    with sync_run(SyncRun.Kind.FLEET) as run, fireplan_client() as fp:
+        records = run.fetching(_fetch_fleet_records(fp))
+
+        index = VehicleIndex(Vehicle.objects.all())
+        created = []
+        changed = {}     # vehicle → changed field names
+        moved_ids = []   # vehicles whose old fireplan_id goes to another vehicle
+        count = 0
 
-        vehicle = Vehicle.objects.filter(fireplan_id=fireplan_id).first()
-        if not vehicle and defaults["number"]:
-            vehicle = Vehicle.objects.filter(
-                Q(number=defaults["number"]) |
-                Q(call_sign=defaults["number"]) |
-                Q(number__startswith=defaults["number"] + " -")
-            ).first()
+        for rec in records:
+            fireplan_id = rec.get("id")
+            if not fireplan_id:
+                continue
+            count += 1
+            run.checkpoint(fireplan_id)
+
+            defaults = _vehicle_defaults_from_fireplan_record(rec)
+            if defaults["number"]:
+                defaults["call_sign"] = _call_sign(defaults["number"])
+
+            vehicle = index.match(fireplan_id, defaults["number"])
+            if vehicle is None:
+                vehicle = Vehicle(fireplan_id=fireplan_id, **defaults)
+                created.append(vehicle)
+                index.claim(vehicle, fireplan_id)
+                continue
 
-        if vehicle:
-            for field, value in defaults.items():
-                setattr(vehicle, field, value)
+            fields = changed.setdefault(vehicle, set()) if vehicle.pk is not None else None
+            if vehicle.fireplan_id != fireplan_id and vehicle.pk is not None:
+                if vehicle.fireplan_id:
+                    moved_ids.append(vehicle.pk)
+                fields.add("fireplan_id")
+            index.claim(vehicle, fireplan_id)
             vehicle.fireplan_id = fireplan_id
-            vehicle.save()
-        else:
-            Vehicle.objects.create(
-                fireplan_id=fireplan_id,
-                **defaults,
-            )
 
-        count += 1
+            for field, value in defaults.items():
+                if getattr(vehicle, field) != value:
+                    setattr(vehicle, field, value)
+                    if fields is not None:
+                        fields.add(field)
+
+        by_fields = {}
+        for vehicle, fields in changed.items():
+            if fields:
+                by_fields.setdefault(tuple(sorted(fields)), []).append(vehicle)
+
+        with transaction.atomic():
+            if moved_ids:
+                # fireplan_id is unique: free the old ids before handing them out again
+                Vehicle.objects.filter(pk__in=moved_ids).update(fireplan_id=None)
+            for fields, vehicles in by_fields.items():
+                Vehicle.objects.bulk_update(vehicles, fields, batch_size=500)
+            Vehicle.objects.bulk_create(created, batch_size=500)
+
+            # Bulk writes skip the model signals
+            updated = [vehicle for vehicles in by_fields.values() for vehicle in vehicles]
+            radios = [vehicle.radio_id for vehicle in updated if vehicle.radio_id]
+            directory_changed(
+                vehicles=[vehicle.pk for vehicle in updated],
+                radios=radios,
+                issis=[vehicle.issi_id for vehicle in updated],
+            )
+            enqueue_roip_sync_for_tei(radios)
 
+        run.created, run.updated = len(created), len(updated)
+        logger.info(
+            "Fireplan fleet sync: %s records, %s vehicles created, %s updated",
+            count, len(created), len(updated),
+        )
     return count
 
 
@@ -166,23 +266,25 @@ def test_resourcesoff():
 
 
 
-def sync_vectors():
-    BASE = "http://resourcesoff.firebru2k8.local"
-    LOGIN_URL = BASE + "/php/login_resources.php"
-    AJAX_URL = BASE + "/php/vehicule_ajax.php"
-
-    def _get_priority(status_obj):
-        """Status object → ranking integer."""
-        if status_obj is None:
-            return -1
-        return int(status_obj.code) if status_obj.code.isdigit() else 0
+RESOURCESOFF_BASE = "http://resourcesoff.firebru2k8.local"
 
+VECTOR_SYNC_FIELDS = (
+    "vehicle_id",
+    "name",
+    "abbreviation",
+    "service_id",
+    "resourceTypeCode_id",
+    "statusCode_id",
+    "orderServiceAbbreviation",
+)
 
 
+def _fetch_resourcesoff_items():
+    """Every vehicle record of the resourcesoff atelier view."""
     session = requests.Session()
 
     # --------------------------- LOGIN ---------------------------
-    resp = session.post(LOGIN_URL, data={
+    resp = session.post(RESOURCESOFF_BASE + "/php/login_resources.php", data={
         "username": settings.FIREPLAN_USERNAME,
         "password": settings.FIREPLAN_PASSWORD,
     })
@@ -190,213 +292,232 @@ def sync_vectors():
         raise Exception("❌ Foute login op resourcesoff")
 
     # --------------------------- DATA ---------------------------
-    r = session.get(AJAX_URL, params={
+    r = session.get(RESOURCESOFF_BASE + "/php/vehicule_ajax.php", params={
         "mode": "resources",
         "servicetype": "atelier",
         "version": "cnd",
         "lang": "fr",
     })
-    root = r.json()
-    stations = root.get("data", {})
-
-    # Verzamel alle records *eerder*, zodat we duplicates per voertuig kunnen samenvoegen
-    per_vehicle = {}
+    stations = r.json().get("data", {})
 
     for station_code, groups in stations.items():
         for veh_group, content in groups.items():
+            yield from content.values() if isinstance(content, dict) else content
 
-            if isinstance(content, dict):
-                iterator = content.values()
-            else:
-                iterator = content
-
-            for item in iterator:
-
-                name = item.get("Name")
-                if not name:
-                    continue
-
-                # skip als geen pResourceCode → dit voertuig heeft GEEN vector
-                pcode = item.get("pResourceCode")
-                if not pcode:
-                    continue
-
-                vehicle = _match_or_create_vehicle_from_vector_item(item)
-                if not vehicle:
-                    continue
-
-                status_code = item.get("StatusCode")                
-
-                entry = {
-                    "item": item,
-                    "status": status_code,
-                }
 
-                # append in lijst → elke vehicle kan meerdere vector records hebben
-                per_vehicle.setdefault(vehicle.id, []).append(entry)
-
-    seen_pcodes = set()
-
-    # --------------------------- BESTE RECORD SELECTEREN ---------------------------
-    for vehicle_id, records in per_vehicle.items():
-
-        # kies record met hoogste status
-        best = max(
-            records,
-            key=lambda rec: _get_priority(
-                StatusCode.objects.filter(code=rec["status"]).first()
-            )
-        )
+def _status_priority(code):
+    """Status code → ranking integer; the highest status wins when a vehicle has several vectors."""
+    if not code:
+        return -1
+    return int(code) if code.isdigit() else 0
 
-        item = best["item"]
-        pcode = item["pResourceCode"]
 
-        seen_pcodes.add(pcode)
+def _vector_values(item, vehicle_id):
+    return {
+        "vehicle_id": vehicle_id,
+        "name": item.get("pName") or "",
+        "abbreviation": item.get("pAbbreviation") or "",
+        "service_id": item.get("pServiceAbbreviation") or None,
+        "resourceTypeCode_id": item.get("pResourceTypeCode") or None,
+        "statusCode_id": item.get("StatusCode") or None,
+        "orderServiceAbbreviation": item.get("orderServiceAbbreviation"),
+    }
 
-        # -------- lookup tables --------
-        svc = None
-        if item.get("pServiceAbbreviation"):
-            svc, _ = Service.objects.get_or_create(
-                code=item["pServiceAbbreviation"],
-                defaults={"description": item["pServiceAbbreviation"]},
-            )
 
-        rtype = None
-        if item.get("pResourceTypeCode"):
-            rtype, _ = ResourceTypeCode.objects.get_or_create(
-                code=item["pResourceTypeCode"],
-                defaults={"description": item["pResourceTypeCode"]},
+def _create_missing_codes(model, codes):
+    """Add lookup rows that do not exist yet, with the code as description; existing rows are left alone."""
+    if codes:
+        model.objects.bulk_create([model(code=code, description=code) for code in sorted(codes)], ignore_conflicts=True)
+
+
+def sync_vectors(items=None):
+    """
+    Link the resourcesoff vectors to vehicles.
+
+    Vehicles are loaded once and every record is matched in memory. The synced
+    fields of all vectors are read in one query and compared with the records,
+    so admin edits and cleared vehicle links are repaired too; only changed
+    fields are written, together with the lookup codes they need. Vectors that are no
+    longer reported are deleted in one query. Only the touched vectors are
+    announced to the RoIP caches and push.
+    Returns the number of vectors linked to a vehicle.
+    """
+    with sync_run(SyncRun.Kind.VECTORS) as run:
+        if items is None:
+            items = _fetch_resourcesoff_items()
+        items = run.fetching(items)
+
+        index = VehicleIndex(Vehicle.objects.all())
+
+        # --------------------------- RECORDS PER VOERTUIG ---------------------------
+        # Verzamel alle records *eerder*, zodat we duplicates per voertuig kunnen samenvoegen
+        per_name = {}
+        for item in items:
+            name = item.get("Name")
+            # skip als geen pResourceCode → dit voertuig heeft GEEN vector
+            if not name or not item.get("pResourceCode"):
+                continue
+            per_name.setdefault(name, []).append(item)
+
+        new_vehicles = {}
+        for name, records in per_name.items():
+            if index.find(name) is None:
+                new_vehicles[name] = Vehicle(**_vehicle_defaults_from_vector_item(records[0]))
+                new_vehicles[name].call_sign = _call_sign(name)
+
+        with transaction.atomic():
+            Vehicle.objects.bulk_create(list(new_vehicles.values()), batch_size=500)
+
+            # --------------------------- BESTE RECORD SELECTEREN ---------------------------
+            per_vehicle = {}
+            for name, records in per_name.items():
+                vehicle = new_vehicles.get(name) or index.find(name)
+                per_vehicle.setdefault(vehicle.pk, []).extend(records)
+
+            wanted = {}
+            for vehicle_id, records in per_vehicle.items():
+                # kies record met hoogste status
+                best = max(records, key=lambda item: _status_priority(item.get("StatusCode")))
+                wanted[best["pResourceCode"]] = _vector_values(best, vehicle_id)
+
+            # --------------------------- DIFF ---------------------------
+            # Compared with the stored values, not with what the previous run wrote
+            existing = {
+                pcode: dict(zip(VECTOR_SYNC_FIELDS, values))
+                for pcode, *values in Vector.objects.values_list("resourceCode", *VECTOR_SYNC_FIELDS)
+            }
+            stale = sorted(set(existing) - set(wanted))
+
+            created = [
+                Vector(resourceCode=pcode, **values)
+                for pcode, values in wanted.items()
+                if pcode not in existing
+            ]
+            changed = {}
+            for pcode, values in wanted.items():
+                current = existing.get(pcode)
+                if current is not None and current != values:
+                    fields = tuple(field for field in VECTOR_SYNC_FIELDS if current[field] != values[field])
+                    changed[Vector(resourceCode=pcode, **values)] = (fields, current["vehicle_id"])
+
+            # --------------------------- LOOKUP TABLES ---------------------------
+            touched = [*created, *changed]
+            _create_missing_codes(StatusCode, {vector.statusCode_id for vector in touched if vector.statusCode_id})
+            _create_missing_codes(Service, {vector.service_id for vector in touched if vector.service_id})
+            _create_missing_codes(ResourceTypeCode, {vector.resourceTypeCode_id for vector in touched if vector.resourceTypeCode_id})
+
+            # --------------------------- SAVE ---------------------------
+            # Vehicle links are unique: release them before they are handed out again
+            if stale:
+                Vector.objects.filter(pk__in=stale).delete()
+            moving = [vector.pk for vector, (fields, old) in changed.items() if "vehicle_id" in fields and old]
+            if moving:
+                Vector.objects.filter(pk__in=moving).update(vehicle=None)
+
+            by_fields = {}
+            for vector, (fields, _) in changed.items():
+                by_fields.setdefault(fields, []).append(vector)
+            for fields, vectors in by_fields.items():
+                Vector.objects.bulk_update(vectors, [field.removesuffix("_id") for field in fields], batch_size=500)
+            Vector.objects.bulk_create(created, batch_size=500)
+
+            # Bulk writes skip the model signals (the deletes send their own)
+            vehicle_ids = {vector.vehicle_id for vector in created} | {
+                vehicle_id
+                for vector, (_, old) in changed.items()
+                for vehicle_id in (vector.vehicle_id, old)
+            } | {existing[pcode]["vehicle_id"] for pcode in stale}
+            vehicle_ids.discard(None)
+            directory_changed(
+                vectors=[vector.pk for vector in created] + [vector.pk for vector in changed],
+                vehicles=vehicle_ids,
             )
-
-        st = None
-        if item.get("StatusCode"):
-            st, _ = StatusCode.objects.get_or_create(
-                code=item["StatusCode"],
-                defaults={"description": item["StatusCode"]},
+            enqueue_roip_sync_for_tei(
+                vehicle.radio_id
+                for vehicle in list(index.vehicles.values()) + list(new_vehicles.values())
+                if vehicle.pk in vehicle_ids and vehicle.radio_id
             )
 
-        Vector.objects.filter(vehicle_id=vehicle_id).exclude(resourceCode=pcode).update(vehicle=None)
-
-        # -------- save --------
-        Vector.objects.update_or_create(
-            resourceCode=pcode,  # PRIMARY KEY
-            defaults={
-                "vehicle_id": vehicle_id,
-                "name": item.get("pName") or "",
-                "abbreviation": item.get("pAbbreviation") or "",
-                "service": svc,
-                "resourceTypeCode": rtype,
-                "statusCode": st,
-                "orderServiceAbbreviation": item.get("orderServiceAbbreviation"),
-            },
+        run.created, run.updated, run.deleted = len(created), len(changed), len(stale)
+        logger.info(
+            "Vector sync: %s vectors, %s unchanged, %s created, %s updated, %s deleted, %s vehicles created",
+            len(wanted), len(wanted) - len(created) - len(changed), len(created), len(changed), len(stale), len(new_vehicles),
         )
+    return len(wanted)
 
-    # --------------------------- DELETE old ---------------------------
-    Vector.objects.exclude(resourceCode__in=seen_pcodes).delete()
-
-    return len(seen_pcodes)
 
 
 
+QR_RADIO_NAMES = (
+    "Radio mobile Astrid",
+    "Radio portable Astrid",
+    "Portable ATEX",
+)
 
-def sync_fireplan_id():
-    fp = FireplanClient()
-
-    url = f"{fp.BASE}/fr/api/inventory/qr-codes"
-
-    headers = {
-        "Accept": "application/json, text/plain, */*",
-        "X-Requested-With": "XMLHttpRequest",
-        "Referer": f"{fp.BASE}/fr/inventory/qr-codes",
-    }
-
-    pattern = re.compile(
-        r"https://infoscan\.firebru\.brussels\?data[=-](?P<arg1>\d+),(?P<arg2>\d+),(?P<fireplan_id>\d+),(?P<arg4>\d+)$"
-    )
-
-    radio_names = [
-        "Radio mobile Astrid",
-        "Radio portable Astrid",
-        "Portable ATEX",
-    ]
-
-    result = []
-
-    for radio_name in radio_names:
-        filters = {
-            "id": {
-                "operator": "and",
-                "constraints": [{"value": None, "matchMode": "contains"}],
-            },
-            "name": {
-                "value": [radio_name],
-                "matchMode": "in",
-            },
-            "serialNumber": {
-                "value": None,
-                "matchMode": "in",
-            },
-            "type": {
-                "value": None,
-                "matchMode": "in",
-            },
-            "qrCode": {
-                "operator": "and",
-                "constraints": [{"value": None, "matchMode": "contains"}],
-            },
-            "createdAt": {
-                "operator": "and",
-                "constraints": [{"value": None, "matchMode": "dateIs"}],
-            },
-        }
-
-        params = {
-            "first": 0,
-            "rows": 5000,
-            "filters": json.dumps(filters, separators=(",", ":")),
-            "multiSortMeta": "[]",
-        }
-
-        r = fp.session.get(url, params=params, headers=headers)
-
-        if r.status_code >= 500:
-            logger.warning(
-                "Fireplan API error for %s: %s - %s",
-                radio_name,
-                r.status_code,
-                r.text[:500],
-            )
-            continue
-
-        r.raise_for_status()
 
-        data = r.json()
-        records = data.get("records", [])
-
-        for rec in records:
-            qr_code = rec.get("qrCode") or ""
-            match = pattern.match(qr_code)
-
-            if not match:
-                continue
-
-            serial_number = rec.get("serialNumber")
-            if not serial_number:
-                continue
+def _fetch_qr_codes(fp, radio_name):
+    """Every QR code of one radio category, or None when Fireplan fails on it."""
+    try:
+        return list(fp.iter_qr_code_records(radio_name))
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code < 500:
+            raise
+        logger.warning(
+            "Fireplan API error for %s: %s - %s",
+            radio_name,
+            e.response.status_code,
+            e.response.text[:500],
+        )
+        return None
 
-            fireplan_id = int(match.group("fireplan_id"))
 
-            try:
-                radio, created = Radio.objects.get_or_create(
-                    TEI=serial_number,
-                    defaults={"fireplan_id": fireplan_id},
-                )
-            except ValueError:
+def sync_fireplan_id():
+    """
+    Copy the Fireplan ID in the radio QR codes to the radios.
+
+    The three radio categories are fetched at the same time, page by page, and
+    merged into one TEI → Fireplan ID map (a later category wins, as before).
+    Existing radios are loaded in one query; changed IDs are written with
+    bulk_update and unknown radios with a TEI range are created in bulk.
+    """
+    with sync_run(SyncRun.Kind.FIREPLAN_ID) as run, fireplan_client() as fp:
+        with run.http(), ThreadPoolExecutor(len(QR_RADIO_NAMES), thread_name_prefix="fireplan-qr") as pool:
+            fetched = list(pool.map(lambda radio_name: _fetch_qr_codes(fp, radio_name), QR_RADIO_NAMES))
+
+        wanted = {}  # TEI → (serial number, Fireplan ID, category)
+        for radio_name, records in zip(QR_RADIO_NAMES, fetched):
+            if records is None:
                 continue
+            run.fetched += len(records)
 
-            if not created and radio.fireplan_id != fireplan_id:
+            for rec in records:
+                match = fp.QR_CODE_PATTERN.match(rec.get("qrCode") or "")
+                serial_number = rec.get("serialNumber")
+                if not match or not serial_number:
+                    continue
+                try:
+                    tei = int(serial_number)
+                except (TypeError, ValueError):
+                    continue
+                wanted[tei] = (serial_number, int(match.group("fireplan_id")), radio_name)
+
+            run.checkpoint(radio_name)
+
+        existing = Radio.objects.only("TEI", "fireplan_id").in_bulk(list(wanted))
+        created = []
+        changed = []
+        result = []
+
+        for tei, (serial_number, fireplan_id, radio_name) in wanted.items():
+            radio = existing.get(tei)
+            if radio is None:
+                model_id = tei_range_index.lookup(tei)
+                if model_id is None:
+                    continue  # no RadioModel for this TEI, not one of ours
+                created.append(Radio(TEI=tei, fireplan_id=fireplan_id, model_id=model_id))
+            elif radio.fireplan_id != fireplan_id:
                 radio.fireplan_id = fireplan_id
-                radio.save(update_fields=["fireplan_id"])
+                changed.append(radio)
 
             result.append({
                 "TEI": serial_number,
@@ -404,6 +525,21 @@ def sync_fireplan_id():
                 "name": radio_name,
             })
 
+        with transaction.atomic():
+            Radio.objects.bulk_update(changed, ["fireplan_id"], batch_size=500)
+            Radio.objects.bulk_create(created, batch_size=500)
+
+            # Bulk writes skip the model signals
+            teis = [radio.TEI for radio in changed + created]
+            directory_changed(radios=teis)
+            enqueue_roip_sync_for_tei(teis)
+
+        run.created, run.updated = len(created), len(changed)
+        logger.info(
+            "Fireplan ID sync: %s radios, %s created, %s updated",
+            len(result), len(created), len(changed),
+        )
+
     return result
 
 
@@ -3,7 +3,9 @@
 from __future__ import annotations
 
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
+from uuid import UUID
 
 from dateutil import parser
 from datetime import timedelta
@@ -15,8 +17,9 @@ import logging
 logger = logging.getLogger(__name__)
 
 from radio.models import Radio
-from .client import FireplanClient
-from .models import FireplanInventory, FireplanInventoryRadio, Vehicle
+from .client import FireplanClient, fireplan_client
+from .models import FireplanInventory, FireplanInventoryRadio, SyncRun, Vehicle
+from .sync_runs import sync_run
 
 
 ROOT_UUID_RE = re.compile(
@@ -24,21 +27,46 @@ ROOT_UUID_RE = re.compile(
 )
 
 
-def find_radio_for_fireplan_tei(raw_tei) -> Radio | None:
+def _tei_candidates(raw_tei) -> list[int]:
+    # Fireplan sometimes drops the trailing 0 of a 15-digit TEI
     tei = str(raw_tei or "").strip()
     if not tei.isdigit():
-        return None
-
-    radio = Radio.objects.filter(TEI=int(tei)).first()
-    if radio:
-        return radio
-
+        return []
     if len(tei) < 15:
-        return Radio.objects.filter(TEI=int(f"{tei}0")).first()
+        return [int(tei), int(f"{tei}0")]
+    return [int(tei)]
+
 
+def find_radio_for_fireplan_tei(raw_tei) -> Radio | None:
+    for tei in _tei_candidates(raw_tei):
+        radio = Radio.objects.filter(TEI=tei).first()
+        if radio:
+            return radio
     return None
 
 
+def _radios_by_tei(raw_teis) -> dict[str, Radio]:
+    """Same matching as find_radio_for_fireplan_tei, for a whole page in one query."""
+    candidates = {raw: _tei_candidates(raw) for raw in set(raw_teis)}
+    radios = Radio.objects.only("TEI", "fireplan_id").in_bulk(
+        {tei for teis in candidates.values() for tei in teis}
+    )
+    found = {}
+    for raw, teis in candidates.items():
+        radio = next((radios[tei] for tei in teis if tei in radios), None)
+        if radio:
+            found[raw] = radio
+    return found
+
+
+def _vehicles_by_number(numbers) -> dict[str, Vehicle]:
+    vehicles = {}
+    # Lowest pk wins when a number is used twice, like filter(number=...).first()
+    for vehicle in Vehicle.objects.filter(number__in=set(numbers)).select_related("vector").order_by("-pk"):
+        vehicles[vehicle.number] = vehicle
+    return vehicles
+
+
 def extract_root_container_uuid(html: str) -> str:
     m = ROOT_UUID_RE.search(html)
     if not m:
@@ -55,6 +83,32 @@ def parse_fireplan_datetime(value: Optional[str]):
     return dt
 
 
+def fetch_inventory_detail(fp: FireplanClient, inventory_uuid: str, container_name_fr: str):
+    """
+    Root container and items of one closed inventory: (root_uuid, container_uuid, item_records).
+    container_uuid is None (and there are no items) when the inventory has no such container.
+    Runs in the fetch threads, so it only talks HTTP.
+    """
+    container_records = fp.get_json(
+        f"/fr/api/inventory/inventories-type/close/{inventory_uuid}/inventoried-container/tree"
+    ).get("records", [])
+    container = next(
+        (c for c in container_records if c.get("nameFr") == container_name_fr),
+        None,
+    )
+
+    root_uuid = container_records[0]["id"]
+
+    if not container:
+        return root_uuid, None, []
+
+    container_uuid = container["id"]
+    item_records = fp.get_json(
+        f"/fr/api/inventory/inventories-type/close/inventoried-container/{container_uuid}/inventoried-item/list"
+    ).get("records", [])
+    return root_uuid, container_uuid, item_records
+
+
 def sync_closed_inventories_portable_radio_teis(
     *,
     container_name_fr: str = "Cabine de conduite",
@@ -62,143 +116,152 @@ def sync_closed_inventories_portable_radio_teis(
     page_size: int = 200,
     max_pages: int = 10000,
     full_sync: bool = False,
+    concurrency: int = 8,
 ) -> int:
     """
     If full_sync=False: incremental sync, stop when records are older/equal than latest closed_at in DB.
     If full_sync=True: scan all pages, only insert missing UUIDs (no stop on date).
-    """
-    fp = FireplanClient()
 
-    last_closed_at = (
-        FireplanInventory.objects.exclude(closed_at__isnull=True)
-        .order_by("-closed_at")
-        .values_list("closed_at", flat=True)
-        .first()
-    )
-
-    inserted = 0
-    first = 0
-
-    for _ in range(max_pages):
-        filters = quote(json.dumps({}))
-        sort = quote(json.dumps([{"field": "closedAt", "order": -1}]))
-        list_path = (
-            f"/fr/api/inventory/inventories-type/close"
-            f"?first={first}&rows={page_size}"
-            f"&filters={filters}"
-            f"&multiSortMeta={sort}"
-        )
-        r = fp.get(list_path)
-        r.raise_for_status()
-
-        records = (r.json() or {}).get("records", [])
-
-        if not records:
-            break
+    The container tree and item list of up to `concurrency` inventories are
+    fetched at the same time; this thread is the only one writing to the
+    database, one transaction per page.
+    """
+    with sync_run(SyncRun.Kind.INVENTORY) as run, fireplan_client() as fp:
 
-        page_uuids = [rec.get("uuid") for rec in records if rec.get("uuid")]
-        existing = set(
-            FireplanInventory.objects.filter(uuid__in=page_uuids).values_list("uuid", flat=True)
+        last_closed_at = (
+            FireplanInventory.objects.exclude(closed_at__isnull=True)
+            .order_by("-closed_at")
+            .values_list("closed_at", flat=True)
+            .first()
         )
 
-        should_stop = False
-
-        for rec in records:
-
-            inventory_uuid = rec["uuid"]
-            if not inventory_uuid:
-                continue
-
-            # always skip existing inventories, but NEVER stop because of that
-            if FireplanInventory.objects.filter(uuid=inventory_uuid).exists():
-                continue
-
-            closed_at = parse_fireplan_datetime(rec.get("closedAt"))
-
-            # incremental stop condition: we reached already-processed time range
-            if (not full_sync) and last_closed_at and closed_at and closed_at <= last_closed_at:
-                should_stop = True
-                break   # sorted desc → everything after this is older
+        inserted = 0
+        first = 0
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fireplan-inventory") as pool:
+            for _ in range(max_pages):
+                filters = quote(json.dumps({}))
+                sort = quote(json.dumps([{"field": "closedAt", "order": -1}]))
+                list_path = (
+                    f"/fr/api/inventory/inventories-type/close"
+                    f"?first={first}&rows={page_size}"
+                    f"&filters={filters}"
+                    f"&multiSortMeta={sort}"
+                )
+                with run.http():
+                    r = fp.get(list_path)
+                    r.raise_for_status()
+                    records = (r.json() or {}).get("records", [])
+                run.fetched += len(records)
+
+                if not records:
+                    break
+
+                page_uuids = [UUID(rec["uuid"]) for rec in records if rec.get("uuid")]
+                existing = set(
+                    FireplanInventory.objects.filter(uuid__in=page_uuids).values_list("uuid", flat=True)
+                )
 
-            vehicle_alpha_code = rec.get("vehicleAlphaCode") or ""
-            done_by_full_name = rec.get("doneByFullName") or ""
-            overseen_by_full_name = rec.get("overseenByFullName") or ""
+                should_stop = False
+                to_fetch = []
 
-            vehicle_obj = None
-            vector_obj = None
+                for rec in records:
 
-            if vehicle_alpha_code:
-                vehicle_obj = Vehicle.objects.filter(number=vehicle_alpha_code).first()
+                    if not rec.get("uuid"):
+                        continue
+                    inventory_uuid = UUID(rec["uuid"])
 
-            if (
-                closed_at
-                and closed_at >= timezone.now() - timedelta(hours=12)
-                and vehicle_obj is not None
-            ):
-                vector_obj = getattr(vehicle_obj, "vector", None)
+                    # always skip existing inventories, but NEVER stop because of that
+                    if inventory_uuid in existing:
+                        continue
+                    existing.add(inventory_uuid)
 
-            html_path = f"/fr/api/inventory/inventories-type/close/{inventory_uuid}/inventoried-container/tree"
-            r2 = fp.get(html_path)
-            r2.raise_for_status()
+                    closed_at = parse_fireplan_datetime(rec.get("closedAt"))
 
-            container_records = (r2.json() or {}).get("records", [])
-            container = next(
-                (c for c in container_records if c.get("nameFr") == container_name_fr),
-                None,
-            )
+                    # incremental stop condition: we reached already-processed time range
+                    if (not full_sync) and last_closed_at and closed_at and closed_at <= last_closed_at:
+                        should_stop = True
+                        break   # sorted desc → everything after this is older
 
-            root_uuid = container_records[0]["id"]
+                    to_fetch.append((rec, closed_at))
 
-            with transaction.atomic():
-                inv_obj = FireplanInventory.objects.create(
-                    uuid=inventory_uuid,
-                    vehicle_alpha_code=vehicle_alpha_code,
-                    vehicle=vehicle_obj,
-                    vector=vector_obj,
-                    closed_at=closed_at,
-                    done_by_full_name=done_by_full_name,
-                    overseen_by_full_name=overseen_by_full_name,
-                    root_inventoried_container_uuid=root_uuid,
+                # Fetch stage: details in parallel, handed back in page order
+                details = pool.map(
+                    lambda entry: fetch_inventory_detail(fp, entry[0]["uuid"], container_name_fr),
+                    to_fetch,
                 )
 
-                if container:
-                    container_uuid = container["id"]
-
-                    items_path = f"/fr/api/inventory/inventories-type/close/inventoried-container/{container_uuid}/inventoried-item/list"
-                    r3 = fp.get(items_path)
-                    r3.raise_for_status()
-                    item_records = (r3.json() or {}).get("records", [])
-
-                    for item in item_records:
-                        if item.get("nameFr") != item_type_name_fr:
-                            continue
+                with run.http():
+                    entries = [(rec, closed_at, *detail) for (rec, closed_at), detail in zip(to_fetch, details)]
 
-                        tei = item.get("trackedItemSerialNumber")
-                        if not tei:
-                            continue
+                # Writer stage
+                inserted += _store_page(entries, item_type_name_fr)
+                run.created = inserted
+                run.checkpoint(f"first={first}")
 
-                        radio_obj = None
-                        if tei is not None:
-                            radio_obj = find_radio_for_fireplan_tei(tei)
+                if should_stop:
+                    break
 
-                        tracked_item_id = None
-                        if radio_obj:
-                            tracked_item_id = radio_obj.fireplan_id
+                first += page_size
 
-                        FireplanInventoryRadio.objects.create(
-                            inventory=inv_obj,
-                            container_uuid=container_uuid,
-                            item_uuid=item["id"],
-                            tracked_item_id=tracked_item_id,
-                            tei=str(tei),
-                            radio=radio_obj,
-                        )
-
-            inserted += 1
-            
-        if should_stop:
-            break
+    return inserted
 
-        first += page_size
 
-    return inserted
+def _store_page(entries, item_type_name_fr) -> int:
+    """
+    Insert the inventories of one page with their radios: two lookups and two
+    inserts, however many inventories and items the page holds.
+    entries: (rec, closed_at, root_uuid, container_uuid, item_records)
+    """
+    if not entries:
+        return 0
+
+    radio_items = [
+        [
+            item for item in item_records
+            if item.get("nameFr") == item_type_name_fr and item.get("trackedItemSerialNumber")
+        ]
+        for *_, item_records in entries
+    ]
+    vehicles = _vehicles_by_number(rec.get("vehicleAlphaCode") for rec, *_ in entries if rec.get("vehicleAlphaCode"))
+    radios = _radios_by_tei(item["trackedItemSerialNumber"] for items in radio_items for item in items)
+    recent = timezone.now() - timedelta(hours=12)
+
+    inventories = []
+    for rec, closed_at, root_uuid, container_uuid, item_records in entries:
+        vehicle_alpha_code = rec.get("vehicleAlphaCode") or ""
+        vehicle_obj = vehicles.get(vehicle_alpha_code)
+        vector_obj = None
+        if closed_at and closed_at >= recent and vehicle_obj is not None:
+            vector_obj = getattr(vehicle_obj, "vector", None)
+
+        inventories.append(FireplanInventory(
+            uuid=rec["uuid"],
+            vehicle_alpha_code=vehicle_alpha_code,
+            vehicle=vehicle_obj,
+            vector=vector_obj,
+            closed_at=closed_at,
+            done_by_full_name=rec.get("doneByFullName") or "",
+            overseen_by_full_name=rec.get("overseenByFullName") or "",
+            root_inventoried_container_uuid=root_uuid,
+        ))
+
+    with transaction.atomic():
+        FireplanInventory.objects.bulk_create(inventories)
+
+        inventory_radios = []
+        for inv_obj, (_, _, _, container_uuid, _), items in zip(inventories, entries, radio_items):
+            for item in items:
+                tei = item["trackedItemSerialNumber"]
+                radio_obj = radios.get(tei)
+                inventory_radios.append(FireplanInventoryRadio(
+                    inventory=inv_obj,
+                    container_uuid=container_uuid,
+                    item_uuid=item["id"],
+                    tracked_item_id=radio_obj.fireplan_id if radio_obj else None,
+                    tei=str(tei),
+                    radio=radio_obj,
+                ))
+        FireplanInventoryRadio.objects.bulk_create(inventory_radios)
+
+    return len(inventories)
@@ -0,0 +1,169 @@
+# fireplan/sync_runs.py
+"""
+Ledger of the Fireplan syncs.
+
+Every sync runs inside `sync_run(kind)`, which stores a SyncRun row when the
+run starts and fills in the timings, counts and checkpoint when it ends, also
+when it fails. Database time is measured with a query wrapper on the syncing
+thread's connection; HTTP time is whatever the sync spends inside
+`run.http()` or pulling records through `run.fetching()`.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Iterable, Iterator
+
+from django.db import connection
+from django.db.models import Avg, Count, Q
+from django.utils import timezone
+
+from .models import SyncRun
+
+logger = logging.getLogger(__name__)
+
+TREND_DAYS = 7
+# Average duration this much above the previous period is flagged as a regression
+REGRESSION_FACTOR = 1.5
+TREND_RUNS = 30
+
+
+class SyncRunRecorder:
+    """Counters of a running sync; written to its SyncRun when the run ends."""
+
+    def __init__(self, run: SyncRun):
+        self.run = run
+        self.fetched = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.http_s = 0.0
+        self.db_s = 0.0
+        self.db_queries = 0
+        self.cursor = ""
+
+    @contextmanager
+    def http(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.http_s += time.perf_counter() - start
+
+    def fetching(self, records: Iterable) -> Iterator:
+        """Yield from `records`, counting them and timing every fetch as HTTP."""
+        records = iter(records)
+        while True:
+            with self.http():
+                try:
+                    record = next(records)
+                except StopIteration:
+                    return
+            self.fetched += 1
+            yield record
+
+    def checkpoint(self, cursor) -> None:
+        self.cursor = str(cursor)
+
+    def _time_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_s += time.perf_counter() - start
+            self.db_queries += 1
+
+    def _finish(self, status: str, error: str = "") -> None:
+        run = self.run
+        run.status = status
+        run.error = error
+        run.finished_at = timezone.now()
+        run.duration_s = (run.finished_at - run.started_at).total_seconds()
+        run.http_s = self.http_s
+        run.db_s = self.db_s
+        run.db_queries = self.db_queries
+        run.fetched = self.fetched
+        run.created = self.created
+        run.updated = self.updated
+        run.deleted = self.deleted
+        run.checkpoint = self.cursor[:200]
+        run.save()
+
+
+@contextmanager
+def sync_run(kind: str) -> Iterator[SyncRunRecorder]:
+    recorder = SyncRunRecorder(SyncRun.objects.create(kind=kind, started_at=timezone.now()))
+    try:
+        with connection.execute_wrapper(recorder._time_query):
+            yield recorder
+    except BaseException:
+        recorder._finish(SyncRun.Status.FAILED, traceback.format_exc())
+        raise
+
+    recorder._finish(SyncRun.Status.SUCCESS)
+    run = recorder.run
+    logger.info(
+        "Sync %s: %.1fs (http %.1fs, db %.1fs in %s queries), %s fetched, %s created, %s updated, %s deleted",
+        kind, run.duration_s, run.http_s, run.db_s, run.db_queries,
+        run.fetched, run.created, run.updated, run.deleted,
+    )
+
+
+def sync_run_trends(now=None) -> list[dict]:
+    """
+    Per sync kind: the last run, averages of the last TREND_DAYS days next to
+    the period before, and the durations of the last TREND_RUNS runs.
+    """
+    now = now or timezone.now()
+    recent = Q(started_at__gte=now - timedelta(days=TREND_DAYS))
+    previous = Q(started_at__gte=now - timedelta(days=2 * TREND_DAYS), started_at__lt=now - timedelta(days=TREND_DAYS))
+    success = Q(status=SyncRun.Status.SUCCESS)
+
+    stats = {
+        row["kind"]: row
+        for row in SyncRun.objects.filter(started_at__gte=now - timedelta(days=2 * TREND_DAYS))
+        .values("kind")
+        .annotate(
+            runs=Count("id", filter=recent),
+            failures=Count("id", filter=recent & Q(status=SyncRun.Status.FAILED)),
+            duration=Avg("duration_s", filter=recent & success),
+            previous_duration=Avg("duration_s", filter=previous & success),
+            http=Avg("http_s", filter=recent & success),
+            previous_http=Avg("http_s", filter=previous & success),
+            db=Avg("db_s", filter=recent & success),
+            previous_db=Avg("db_s", filter=previous & success),
+        )
+    }
+
+    trends = []
+    for kind, label in SyncRun.Kind.choices:
+        runs = list(SyncRun.objects.filter(kind=kind)[:TREND_RUNS])
+        if not runs:
+            continue
+        row = stats.get(kind, {})
+        duration, previous_duration = row.get("duration"), row.get("previous_duration")
+        longest = max((run.duration_s or 0 for run in runs), default=0) or 1
+        trends.append({
+            "kind": kind,
+            "label": label,
+            "last": runs[0],
+            "runs": row.get("runs", 0),
+            "failures": row.get("failures", 0),
+            "duration": duration,
+            "previous_duration": previous_duration,
+            "http": row.get("http"),
+            "previous_http": row.get("previous_http"),
+            "db": row.get("db"),
+            "previous_db": row.get("previous_db"),
+            "regressed": bool(duration and previous_duration and duration > previous_duration * REGRESSION_FACTOR),
+            # Oldest first, bar height relative to the longest run shown
+            "history": [
+                {"run": run, "height": round(100 * (run.duration_s or 0) / longest)}
+                for run in reversed(runs)
+            ],
+        })
+    return trends
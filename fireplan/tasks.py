@@ -1,8 +1,27 @@
 # fireplan/tasks.py
+import logging
+from datetime import timedelta
+from typing import Optional
+
 from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from .models import SyncRun
 from .sync_inventory import sync_closed_inventories_portable_radio_teis
 
+log = logging.getLogger(__name__)
+
 
 @shared_task
 def sync_inventories():
-    sync_closed_inventories_portable_radio_teis()
\ No newline at end of file
+    sync_closed_inventories_portable_radio_teis()
+
+
+@shared_task
+def purge_sync_runs(days: Optional[int] = None) -> int:
+    """Forget sync runs older than FIREPLAN_SYNC_RUN_RETENTION_DAYS."""
+    cutoff = timezone.now() - timedelta(days=days or settings.FIREPLAN_SYNC_RUN_RETENTION_DAYS)
+    deleted, _ = SyncRun.objects.filter(started_at__lt=cutoff).delete()
+    log.info("Purged %s Fireplan sync runs older than %s", deleted, cutoff)
+    return deleted
@@ -1,18 +1,28 @@
+from contextlib import nullcontext
 from datetime import timedelta
 from uuid import uuid4
 from unittest.mock import Mock, patch
 
+import requests
+
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import override
 
 from radio.models import ISSI, Radio, RadioModel, Subscription, TEIRange
+from roip.models import DirectoryChange
 
-from .models import FireplanInventory, FireplanInventoryRadio, Vector, Vehicle, VehicleStatus
-from .sync import _match_or_create_vehicle_from_vector_item, sync_fireplan_fleet
-from .sync_inventory import find_radio_for_fireplan_tei
+from .client import FireplanClient, FireplanClientPool, FireplanPageError
+from .models import FireplanInventory, FireplanInventoryRadio, Service, StatusCode, SyncRun, Vector, Vehicle, VehicleStatus
+from .sync import _match_or_create_vehicle_from_vector_item, sync_fireplan_fleet, sync_fireplan_id, sync_vectors
+from .sync_inventory import find_radio_for_fireplan_tei, sync_closed_inventories_portable_radio_teis
+from .sync_runs import sync_run, sync_run_trends
+from .tasks import purge_sync_runs
 
 
 class FireplanInventoryTEIMatchingTests(TestCase):
@@ -83,26 +93,21 @@ class VehicleSyncTests(TestCase):
         self.assertEqual(vehicle.status, VehicleStatus.ACTIF)
         self.assertIn("PIT ANDERLECHT 1 BRA", vehicle.utilisation)
 
-    @patch("fireplan.sync.FireplanClient")
-    def test_fleet_sync_preserves_vehicle_without_fireplan_id(self, client_cls):
+    @patch("fireplan.sync.fireplan_client")
+    def test_fleet_sync_preserves_vehicle_without_fireplan_id(self, fireplan_client):
         manual_vehicle = Vehicle.objects.create(number="LOCAL01")
-        response = Mock()
-        response.json.return_value = {
-            "records": [
-                {
-                    "id": 123,
-                    "alphacode": "F123",
-                    "numLettre": "F",
-                    "num": 123,
-                    "plate": "",
-                    "utilisation": "Fireplan",
-                    "chassis": "",
-                    "statut": VehicleStatus.ACTIF,
-                }
-            ]
-        }
-        response.raise_for_status.return_value = None
-        client_cls.return_value.post.return_value = response
+        fireplan_client.return_value.__enter__.return_value.iter_records.return_value = iter([
+            {
+                "id": 123,
+                "alphacode": "F123",
+                "numLettre": "F",
+                "num": 123,
+                "plate": "",
+                "utilisation": "Fireplan",
+                "chassis": "",
+                "statut": VehicleStatus.ACTIF,
+            }
+        ])
 
         count = sync_fireplan_fleet()
 
@@ -111,6 +116,33 @@ class VehicleSyncTests(TestCase):
         self.assertIsNone(manual_vehicle.fireplan_id)
         self.assertTrue(Vehicle.objects.filter(fireplan_id=123, number="F123").exists())
 
+    @patch("fireplan.sync.fireplan_client")
+    def test_fleet_sync_matches_in_memory_and_writes_changed_fields(self, fireplan_client):
+        by_id = Vehicle.objects.create(fireplan_id=1, number="P101 - Autopomp", plate="1-ABC-123", status=VehicleStatus.ACTIF)
+        by_prefix = Vehicle.objects.create(number="A106 - Ambulance", plate="2-DEF-456")
+        unchanged = Vehicle.objects.create(fireplan_id=3, number="L201", num_letter="L", num_value=201, status=VehicleStatus.ACTIF)
+        records = [
+            {"id": 1, "alphacode": "P101 - Autopomp", "plate": "1-XYZ-999", "statut": VehicleStatus.ACTIF},
+            {"id": 2, "alphacode": "A106", "plate": "2-DEF-456"},
+            {"id": 3, "alphacode": "L201", "numLettre": "L", "num": 201, "statut": VehicleStatus.ACTIF},
+            {"id": 4, "alphacode": "F123 - Nieuw", "numLettre": "F", "num": 123},
+        ]
+        fireplan_client.return_value.__enter__.return_value.iter_records.return_value = iter(records)
+
+        # Load, two updates (plate; fireplan_id, number and call sign), one insert, the savepoint,
+        # the directory change log, and the SyncRun row written at the start and the end
+        with self.assertNumQueries(9):
+            count = sync_fireplan_fleet()
+
+        self.assertEqual(count, 4)
+        by_id.refresh_from_db()
+        by_prefix.refresh_from_db()
+        self.assertEqual(by_id.plate, "1-XYZ-999")
+        self.assertEqual((by_prefix.fireplan_id, by_prefix.number, by_prefix.call_sign), (2, "A106", "A106"))
+        self.assertEqual(Vehicle.objects.get(fireplan_id=4).call_sign, "F123")
+        self.assertEqual(Vehicle.objects.count(), 4)
+        self.assertTrue(Vehicle.objects.filter(pk=unchanged.pk, fireplan_id=3).exists())
+
     def test_vehicle_cannot_have_radio_and_direct_issi(self):
         radio_model = RadioModel.objects.create(name="Mobile")
         TEIRange.objects.create(model=radio_model, min_tei=75000000000, max_tei=75999999999)
@@ -122,6 +154,467 @@ class VehicleSyncTests(TestCase):
             vehicle.full_clean()
 
 
+def vector_item(name, pcode, status="1", service="H1", **extra):
+    return {
+        "Name": name,
+        "pResourceCode": pcode,
+        "pName": f"Vector {pcode}",
+        "pAbbreviation": pcode,
+        "pServiceAbbreviation": service,
+        "pResourceTypeCode": "AP",
+        "StatusCode": status,
+        "IsActive": 1,
+        **extra,
+    }
+
+
+class VectorSyncTests(TestCase):
+    def test_links_best_vector_per_vehicle_and_removes_stale_ones(self):
+        vehicle = Vehicle.objects.create(number="P101 - Autopomp")
+        StatusCode.objects.update_or_create(code="5", defaults={"description": "Beschikbaar"})
+        Vector.objects.create(resourceCode="OLD", vehicle=vehicle, name="Oud")
+
+        count = sync_vectors([
+            vector_item("P101", "P101-A", status="2"),
+            vector_item("P101", "P101-B", status="5"),
+            vector_item("A106", "A106", service="Z9"),
+            vector_item("", "NONAME"),
+            vector_item("L201", None),
+        ])
+
+        self.assertEqual(count, 2)
+        self.assertEqual(Vector.objects.get(vehicle=vehicle).resourceCode, "P101-B")
+        self.assertFalse(Vector.objects.filter(resourceCode__in=["OLD", "P101-A"]).exists())
+        a106 = Vector.objects.select_related("vehicle").get(resourceCode="A106")
+        self.assertEqual((a106.vehicle.number, a106.vehicle.call_sign), ("A106", "A106"))
+        self.assertEqual(a106.service.description, "Z9")
+        # Existing lookup rows are not overwritten
+        self.assertEqual(StatusCode.objects.get(code="5").description, "Beschikbaar")
+
+    def test_query_count_does_not_grow_with_records(self):
+        def items(n):
+            return [vector_item(f"P{i}", f"V{i}", status=str(i % 4)) for i in range(n)]
+
+        def queries_for_fresh_sync(n):
+            Vector.objects.all().delete()
+            Vehicle.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                sync_vectors(items(n))
+            return len(queries)
+
+        self.assertEqual(queries_for_fresh_sync(40), queries_for_fresh_sync(3))
+        self.assertEqual(Vector.objects.count(), 3)
+
+    def test_unchanged_vectors_are_not_written(self):
+        sync_vectors([vector_item("P101", "P101"), vector_item("A106", "A106")])
+        Service.objects.create(code="H2", description="H2")
+
+        with CaptureQueriesContext(connection) as queries:
+            sync_vectors([vector_item("P101", "P101", service="H2"), vector_item("A106", "A106")])
+
+        updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "fireplan_vector"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"service_id"', updates[0])
+        self.assertNotIn('"name"', updates[0])
+        self.assertEqual(Vector.objects.get(pk="P101").service_id, "H2")
+
+    def test_rows_changed_outside_the_sync_are_repaired(self):
+        items = [vector_item("P101", "P101"), vector_item("A106", "A106")]
+        sync_vectors(items)
+        vehicle_id = Vector.objects.get(pk="A106").vehicle_id
+        # An admin edit, and a vehicle link cleared by a SET_NULL cascade
+        Vector.objects.filter(pk="P101").update(name="Handmatig")
+        Vector.objects.filter(pk="A106").update(vehicle=None)
+
+        sync_vectors(items)
+
+        self.assertEqual(Vector.objects.get(pk="P101").name, "Vector P101")
+        self.assertEqual(Vector.objects.get(pk="A106").vehicle_id, vehicle_id)
+
+    @patch("roip.enrichment.redis_client")
+    def test_rerun_only_touches_changed_vectors(self, redis_client):
+        items = [vector_item("P101", "P101"), vector_item("A106", "A106")]
+        sync_vectors(items)
+        items[1]["pName"] = "Ambulance 106"
+        before = DirectoryChange.objects.latest("id").id
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            sync_vectors(items)
+
+        vector_writes = [
+            q["sql"] for q in queries
+            if q["sql"].startswith(("INSERT", "UPDATE", "DELETE")) and '"fireplan_vector"' in q["sql"].split("(")[0]
+        ]
+        self.assertEqual(len(vector_writes), 1)
+        self.assertTrue(vector_writes[0].startswith('UPDATE "fireplan_vector" SET "name"'))
+        # Only the changed vector (and its vehicle) is announced
+        self.assertEqual(
+            set(DirectoryChange.objects.filter(id__gt=before).values_list("kind", "key")),
+            {("vectors", "A106"), ("vehicles", str(Vector.objects.get(pk="A106").vehicle_id))},
+        )
+
+
+class FakeInventoryFireplan:
+    """Closed inventories with one cab container and a radio each, as the Fireplan API returns them."""
+
+    def __init__(self, count, page_size):
+        self.page_size = page_size
+        self.inventories = [
+            {
+                "uuid": str(uuid4()),
+                "closedAt": (timezone.now() - timedelta(days=n + 1)).isoformat(),
+                "vehicleAlphaCode": "P101",
+            }
+            for n in range(count)
+        ]
+        self.detail_calls = 0
+
+    def get(self, path):
+        first = int(path.split("first=")[1].split("&")[0])
+        response = Mock()
+        response.json.return_value = {"records": self.inventories[first:first + self.page_size]}
+        return response
+
+    def get_json(self, path):
+        self.detail_calls += 1
+        if path.endswith("/tree"):
+            inventory_uuid = path.split("/close/")[1].split("/")[0]
+            return {"records": [
+                {"id": str(uuid4()), "nameFr": "Véhicule"},
+                {"id": inventory_uuid, "nameFr": "Cabine de conduite"},
+            ]}
+        container_uuid = path.split("/inventoried-container/")[1].split("/")[0]
+        index = next(n for n, inv in enumerate(self.inventories) if inv["uuid"] == container_uuid)
+        return {"records": [
+            {"id": str(uuid4()), "nameFr": "Radio portable Astrid", "trackedItemSerialNumber": f"{75190060000 + index:015d}"},
+            {"id": str(uuid4()), "nameFr": "Extincteur", "trackedItemSerialNumber": "1"},
+        ]}
+
+
+class InventorySyncTests(TestCase):
+    def setUp(self):
+        radio_model = RadioModel.objects.create(name="Portable")
+        TEIRange.objects.create(model=radio_model, min_tei=75190000000, max_tei=75199999999)
+        self.radio = Radio.objects.create(TEI=75190060001, fireplan_id=77)
+        self.vehicle = Vehicle.objects.create(number="P101")
+
+    def sync(self, fake, **kwargs):
+        with patch("fireplan.sync_inventory.fireplan_client", return_value=nullcontext(fake)):
+            return sync_closed_inventories_portable_radio_teis(page_size=fake.page_size, concurrency=4, **kwargs)
+
+    def test_fetches_details_concurrently_and_stores_every_inventory(self):
+        fake = FakeInventoryFireplan(count=7, page_size=3)
+
+        self.assertEqual(self.sync(fake), 7)
+
+        self.assertEqual(fake.detail_calls, 14)
+        self.assertEqual(FireplanInventory.objects.filter(vehicle=self.vehicle).count(), 7)
+        radios = FireplanInventoryRadio.objects.all()
+        self.assertEqual(radios.count(), 7)
+        linked = radios.get(radio=self.radio)
+        self.assertEqual((linked.tracked_item_id, linked.inventory.uuid.hex), (77, fake.inventories[1]["uuid"].replace("-", "")))
+
+    def test_page_costs_a_constant_number_of_queries(self):
+        def queries_for_page(count):
+            FireplanInventory.objects.all().delete()
+            fake = FakeInventoryFireplan(count=count, page_size=count)
+            with CaptureQueriesContext(connection) as ctx:
+                self.sync(fake, full_sync=True)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(queries_for_page(2), queries_for_page(9))
+
+    def test_matches_radio_when_fireplan_drops_trailing_zero(self):
+        radio = Radio.objects.create(TEI=75190060010, fireplan_id=88)
+        fake = FakeInventoryFireplan(count=1, page_size=1)
+        fake.get_json = Mock(side_effect=[
+            {"records": [{"id": str(uuid4()), "nameFr": "Cabine de conduite"}]},
+            {"records": [{"id": str(uuid4()), "nameFr": "Radio portable Astrid", "trackedItemSerialNumber": "7519006001"}]},
+        ])
+
+        self.sync(fake)
+
+        linked = FireplanInventoryRadio.objects.get()
+        self.assertEqual((linked.radio, linked.tracked_item_id, linked.tei), (radio, 88, "7519006001"))
+
+    def test_incremental_sync_stops_at_known_inventories(self):
+        fake = FakeInventoryFireplan(count=5, page_size=2)
+        self.sync(fake)
+        fake.inventories.insert(0, {"uuid": str(uuid4()), "closedAt": timezone.now().isoformat(), "vehicleAlphaCode": "X1"})
+        fake.detail_calls = 0
+
+        self.assertEqual(self.sync(fake), 1)
+        self.assertEqual(fake.detail_calls, 2)
+
+
+class SyncRunTests(TestCase):
+    def test_records_counts_timings_and_checkpoint(self):
+        with sync_run(SyncRun.Kind.FLEET) as run:
+            self.assertEqual(list(run.fetching([1, 2, 3])), [1, 2, 3])
+            Vehicle.objects.count()
+            run.created, run.updated = 2, 1
+            run.checkpoint("page=3")
+
+        sync = SyncRun.objects.get()
+        self.assertEqual(sync.status, SyncRun.Status.SUCCESS)
+        self.assertEqual((sync.fetched, sync.created, sync.updated, sync.checkpoint), (3, 2, 1, "page=3"))
+        self.assertEqual(sync.db_queries, 1)
+        self.assertIsNotNone(sync.duration_s)
+
+    def test_failed_run_keeps_error_and_progress(self):
+        with self.assertRaises(RuntimeError):
+            with sync_run(SyncRun.Kind.INVENTORY) as run:
+                run.checkpoint("first=400")
+                raise RuntimeError("Fireplan down")
+
+        sync = SyncRun.objects.get()
+        self.assertEqual((sync.status, sync.checkpoint), (SyncRun.Status.FAILED, "first=400"))
+        self.assertIn("Fireplan down", sync.error)
+
+    def test_syncs_record_their_run(self):
+        sync_vectors(items=[])
+        with patch("fireplan.sync_inventory.fireplan_client", return_value=nullcontext(FakeInventoryFireplan(count=3, page_size=2))):
+            sync_closed_inventories_portable_radio_teis(page_size=2, concurrency=2)
+
+        runs = {run.kind: run for run in SyncRun.objects.all()}
+        self.assertEqual(set(runs), {SyncRun.Kind.VECTORS, SyncRun.Kind.INVENTORY})
+        self.assertEqual((runs["inventory"].fetched, runs["inventory"].created), (3, 3))
+        self.assertEqual(runs["inventory"].checkpoint, "first=2")
+
+    def test_trends_flag_regressed_sync(self):
+        now = timezone.now()
+        for days, duration in ((10, 10.0), (9, 12.0), (2, 30.0), (1, 32.0)):
+            SyncRun.objects.create(
+                kind=SyncRun.Kind.FLEET, status=SyncRun.Status.SUCCESS,
+                started_at=now - timedelta(days=days), duration_s=duration,
+            )
+
+        [trend] = sync_run_trends(now)
+        self.assertEqual((trend["kind"], trend["runs"]), ("fleet", 2))
+        self.assertEqual((trend["duration"], trend["previous_duration"]), (31.0, 11.0))
+        self.assertTrue(trend["regressed"])
+        self.assertEqual([point["height"] for point in trend["history"]], [31, 38, 94, 100])
+
+    def test_purge_keeps_recent_runs(self):
+        now = timezone.now()
+        SyncRun.objects.create(kind=SyncRun.Kind.VECTORS, started_at=now - timedelta(days=100))
+        recent = SyncRun.objects.create(kind=SyncRun.Kind.VECTORS, started_at=now - timedelta(days=10))
+
+        self.assertEqual(purge_sync_runs.apply(kwargs={"days": 90}).get(), 1)
+        self.assertEqual(list(SyncRun.objects.all()), [recent])
+
+    def test_admin_dashboard(self):
+        SyncRun.objects.create(kind=SyncRun.Kind.VECTORS, status=SyncRun.Status.SUCCESS, started_at=timezone.now(), duration_s=4)
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "secret"))
+
+        with override("nl"):
+            response = self.client.get(reverse("admin:fireplan_syncrun_changelist"))
+
+        self.assertContains(response, "Vectoren")
+        self.assertEqual(len(response.context["sync_trends"]), 1)
+
+
+def qr_record(serial_number, fireplan_id):
+    return {"serialNumber": serial_number, "qrCode": f"https://infoscan.firebru.brussels?data=1,2,{fireplan_id},3"}
+
+
+class FireplanIdSyncTests(TestCase):
+    def setUp(self):
+        radio_model = RadioModel.objects.create(name="Portable")
+        TEIRange.objects.create(model=radio_model, min_tei=75190000000, max_tei=75199999999)
+        self.moved = Radio.objects.create(TEI=75190000001, fireplan_id=1)
+        self.unchanged = Radio.objects.create(TEI=75190000002, fireplan_id=2)
+
+    def sync(self, qr_codes):
+        fp = Mock(QR_CODE_PATTERN=FireplanClient.QR_CODE_PATTERN)
+        fp.iter_qr_code_records.side_effect = lambda name: qr_codes[name]()
+        with patch("fireplan.sync.fireplan_client", return_value=nullcontext(fp)):
+            return sync_fireplan_id()
+
+    def test_reconciles_all_categories_in_bulk(self):
+        error = requests.HTTPError(response=Mock(status_code=502, text="Bad gateway"))
+
+        def failing():
+            raise error
+
+        qr_codes = {
+            "Radio mobile Astrid": lambda: iter([
+                qr_record("75190000001", 10),
+                qr_record("75190000003", 30),
+                qr_record("123", 40),                                      # no TEI range
+                {"serialNumber": "75190000004", "qrCode": "geen qr"},
+            ]),
+            "Radio portable Astrid": failing,
+            "Portable ATEX": lambda: iter([
+                qr_record("75190000001", 11),                              # later category wins
+                qr_record("75190000002", 2),
+            ]),
+        }
+
+        # Sync run start and end, existing radios, one update and one insert in a savepoint,
+        # and the directory change log
+        with self.assertNumQueries(8):
+            result = self.sync(qr_codes)
+
+        self.assertEqual(
+            sorted((row["TEI"], row["fireplan_id"], row["name"]) for row in result),
+            [
+                ("75190000001", 11, "Portable ATEX"),
+                ("75190000002", 2, "Portable ATEX"),
+                ("75190000003", 30, "Radio mobile Astrid"),
+            ],
+        )
+        self.moved.refresh_from_db()
+        self.assertEqual(self.moved.fireplan_id, 11)
+        created = Radio.objects.get(TEI=75190000003)
+        self.assertEqual((created.fireplan_id, created.model.name), (30, "Portable"))
+        self.assertFalse(Radio.objects.filter(TEI__in=[123, 75190000004]).exists())
+
+        run = SyncRun.objects.get()
+        self.assertEqual((run.fetched, run.created, run.updated), (6, 1, 1))
+
+    def test_client_error_fails_the_sync(self):
+        def forbidden():
+            raise requests.HTTPError(response=Mock(status_code=403, text="Forbidden"))
+
+        with self.assertRaises(requests.HTTPError):
+            self.sync({name: forbidden for name in ("Radio mobile Astrid", "Radio portable Astrid", "Portable ATEX")})
+
+        self.assertEqual(SyncRun.objects.get().status, SyncRun.Status.FAILED)
+
+
+class FireplanClientPoolTests(TestCase):
+    def test_reuses_logged_in_clients(self):
+        pool = FireplanClientPool(max_idle=1)
+        with patch.object(FireplanClient, "login") as login:
+            with pool.client() as first:
+                pass
+            with pool.client() as second:
+                # All lent out: a second one is logged in instead of waiting
+                with pool.client() as third:
+                    pass
+
+        self.assertIs(first, second)
+        self.assertIsNot(second, third)
+        self.assertEqual(login.call_count, 2)
+        # Only max_idle clients are kept: the one returned first
+        self.assertEqual(pool._idle, [third])
+
+    def test_forked_process_starts_with_empty_pool(self):
+        pool = FireplanClientPool(max_idle=2)
+        with patch.object(FireplanClient, "login"):
+            with pool.client() as parent_client:
+                pass
+            with patch("fireplan.client.os.getpid", return_value=-1), pool.client() as child_client:
+                pass
+
+        self.assertIsNot(parent_client, child_client)
+
+    def test_logs_in_again_once_when_session_expired(self):
+        with patch.object(FireplanClient, "login"):
+            fp = FireplanClient()
+        expired = Mock(status_code=200, url=FireplanClient.LOGIN_URL)
+        ok = Mock(status_code=200, url=FireplanClient.BASE + "/fr/api/x")
+
+        with patch.object(fp.session, "request", side_effect=[expired, ok]) as request, \
+                patch.object(FireplanClient, "login") as login:
+            response = fp.get("/fr/api/x")
+
+        self.assertIs(response, ok)
+        login.assert_called_once_with()
+        self.assertEqual(request.call_count, 2)
+
+    def test_worker_threads_pick_up_new_login_cookies(self):
+        with patch.object(FireplanClient, "login"):
+            fp = FireplanClient()
+        fp.session.cookies.set("PHPSESSID", "old")
+        session = fp._thread_session()
+        self.assertEqual(session.cookies.get("PHPSESSID"), "old")
+
+        fp.session.cookies.set("PHPSESSID", "new")
+        fp._login_generation += 1
+
+        self.assertIs(fp._thread_session(), session)
+        self.assertEqual(session.cookies.get("PHPSESSID"), "new")
+
+
+class QrCodePaginationTests(TestCase):
+    def setUp(self):
+        with patch.object(FireplanClient, "login"):
+            self.fp = FireplanClient()
+        self.requested = []
+
+    def serve(self, total, cap=None, send_total=True):
+        def request(method, url, params=None, **kwargs):
+            first, rows = params["first"], min(params["rows"], cap or params["rows"])
+            self.requested.append(first)
+            body = {"records": [{"id": n} for n in range(first, min(first + rows, total))]}
+            if send_total:
+                body["totalRecords"] = total
+            return Mock(status_code=200, url=url, **{"json.return_value": body})
+
+        return patch.object(self.fp._thread_session(), "request", side_effect=request)
+
+    def test_pages_past_the_first_page_until_total(self):
+        with self.serve(total=12000):
+            records = list(self.fp.iter_qr_code_records("Portable ATEX", page_size=5000))
+
+        self.assertEqual(len(records), 12000)
+        self.assertEqual(self.requested, [0, 5000, 10000])
+
+    def test_continues_from_capped_page_without_total(self):
+        with self.serve(total=2500, cap=1000, send_total=False):
+            records = list(self.fp.iter_qr_code_records("Portable ATEX", page_size=5000))
+
+        self.assertEqual([record["id"] for record in records], list(range(2500)))
+        self.assertEqual(self.requested, [0, 1000, 2000, 2500])
+
+
+class FireplanPaginationTests(TestCase):
+    def setUp(self):
+        with patch.object(FireplanClient, "login"):
+            self.client_ = FireplanClient()
+        self.requested = []
+
+    def fake_pages(self, total, fail_once=()):
+        failing = set(fail_once)
+
+        def fetch(path, payload, page, page_size):
+            self.requested.append(page)
+            if page in failing:
+                failing.discard(page)
+                raise requests.ConnectionError("boom")
+            first = (page - 1) * page_size
+            return [{"id": n} for n in range(first, min(first + page_size, total))]
+
+        return patch.object(self.client_, "_fetch_page", side_effect=fetch)
+
+    def test_yields_pages_in_order_until_an_empty_page(self):
+        with self.fake_pages(total=23):
+            pages = list(self.client_.iter_pages("/x", page_size=5, max_in_flight=3))
+
+        self.assertEqual([page for page, _ in pages], [1, 2, 3, 4, 5])
+        self.assertEqual([r["id"] for _, records in pages for r in records], list(range(23)))
+        # Never more than max_in_flight pages past the last one handed out
+        self.assertLessEqual(max(self.requested), 5 + 3)
+
+    def test_reports_failed_page_and_resumes_there(self):
+        with self.fake_pages(total=23, fail_once=[3]):
+            with self.assertRaises(FireplanPageError) as ctx:
+                list(self.client_.iter_pages("/x", page_size=5, max_in_flight=2))
+            self.assertEqual(ctx.exception.page, 3)
+
+            records = list(self.client_.iter_records("/x", page_size=5, start_page=3, max_in_flight=2))
+
+        self.assertEqual([r["id"] for r in records], list(range(10, 23)))
+
+    def test_iter_records_retries_from_the_failed_page(self):
+        with self.fake_pages(total=12, fail_once=[2]):
+            records = list(self.client_.iter_records("/x", page_size=5, max_in_flight=2))
+
+        self.assertEqual([r["id"] for r in records], list(range(12)))
+
+
 class FireplanInventoryHistoryViewTests(TestCase):
     def setUp(self):
         self.vehicle = Vehicle.objects.create(
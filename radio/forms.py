@@ -1,7 +1,10 @@
+import re
+
 from django import forms
 from django.utils.translation import gettext as _
 
-from .models import ISSI, Radio, TEIRange
+from .models import ISSI, Radio
+from .services.range_index import tei_range_index
 
 
 class RadioForm(forms.ModelForm):
@@ -21,7 +24,7 @@ class RadioForm(forms.ModelForm):
 	    tei_int = int(raw_input)
 
 	    # check if TEI integer falls in any known range
-	    if not TEIRange.objects.filter(min_tei__lte=tei_int, max_tei__gte=tei_int).exists():
+	    if tei_int not in tei_range_index:
 	        raise forms.ValidationError(_("TEI is not within known TEI ranges."))
 
 	    # keep original raw TEI value for further use if needed
@@ -31,6 +34,42 @@ class RadioForm(forms.ModelForm):
 	    return tei_int
 
 
+class RadioBulkCreateForm(forms.Form):
+    teis = forms.CharField(
+        label=_("Gescande TEI's"),
+        widget=forms.Textarea(
+            attrs={
+                "class": "form-control font-monospace",
+                "rows": 12,
+                "placeholder": _("Eén TEI per lijn"),
+                "autofocus": True,
+            }
+        ),
+    )
+
+    def clean_teis(self):
+        """Same checks as RadioForm.clean_TEI, for every scanned line; duplicates are dropped."""
+        teis = []
+        errors = []
+        for raw_input in re.split(r"[\s,;]+", self.cleaned_data["teis"].strip()):
+            if not raw_input or raw_input in teis:
+                continue
+            if not raw_input.isdigit():
+                errors.append(_("{tei}: TEI must contain only digits.").format(tei=raw_input))
+            elif len(raw_input) != 15:
+                errors.append(_("{tei}: TEI must be 15 digits long.").format(tei=raw_input))
+            elif int(raw_input) not in tei_range_index:
+                errors.append(_("{tei}: TEI is not within known TEI ranges.").format(tei=raw_input))
+            else:
+                teis.append(raw_input)
+
+        if errors:
+            raise forms.ValidationError(errors)
+        if not teis:
+            raise forms.ValidationError(_("Geef minstens één TEI op."))
+        return teis
+
+
 class DecommissioningRequestForm(forms.Form):
     description = forms.CharField(
         label=_("Reden"),
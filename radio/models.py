@@ -3,6 +3,7 @@ from django.db import models
 from helpdesk.models import Ticket, TicketType
 from django.utils.translation import gettext_lazy as _
 
+from .services.range_index import issi_range_resolver, tei_range_index
 
 
 class Radio(models.Model):
@@ -36,10 +37,10 @@ class Radio(models.Model):
         return self.subscription.DMO_only and not self.decommissioned if hasattr(self, 'subscription') else False
 
     def save(self, *args, **kwargs):
-        matching_range = TEIRange.objects.filter(min_tei__lte=self.TEI, max_tei__gte=self.TEI).first()
-        if not matching_range:
+        model_id = tei_range_index.lookup(self.TEI)
+        if model_id is None:
             raise ValueError(f"Geen RadioModel gevonden voor TEI {self.TEI}")
-        self.model = matching_range.model
+        self.model_id = model_id
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -83,18 +84,7 @@ class ISSI(models.Model):
     discipline = models.ForeignKey('Discipline', null=True, blank=True, on_delete=models.CASCADE)
 
     def save(self, *args, **kwargs):
-        matching_range = ISSICustomerRange.objects.filter(min_issi__lte=self.number, max_issi__gte=self.number).first()
-        if matching_range:
-            self.customer = matching_range.customer
-        else:
-            self.customer = None
-
-        matching_range = ISSIDisciplineRange.objects.filter(min_issi__lte=self.number, max_issi__gte=self.number).first()
-        if matching_range:
-            self.discipline = matching_range.discipline
-        else:
-            self.discipline = None
-
+        self.customer_id, self.discipline_id = issi_range_resolver.resolve(self.number)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -0,0 +1,66 @@
+# radio/services/onboarding.py
+from __future__ import annotations
+
+from typing import Callable, Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from fireplan.client import get_or_create_radio_fireplan_ids
+from roip.signals import directory_changed
+
+from ..models import Radio
+from .range_index import tei_range_index
+
+
+def onboard_radios(
+    serial_numbers: Iterable[str],
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> dict:
+    """
+    Add a delivery of scanned radios: resolve or create their Fireplan tracked
+    items in one batch (see fireplan.client.get_or_create_radio_fireplan_ids)
+    and insert the Radio rows with one bulk_create.
+
+    `serial_numbers` are the scanned 15-digit TEIs; like RadioCreateView, the
+    scanned string goes to Fireplan and its integer value becomes the TEI.
+    Radios that already exist are left alone, radios Fireplan failed on are
+    reported and not created.
+    """
+    serial_numbers = list(dict.fromkeys(serial_numbers))
+    existing = set(
+        Radio.objects.filter(TEI__in=[int(serial) for serial in serial_numbers]).values_list("TEI", flat=True)
+    )
+    todo = [serial for serial in serial_numbers if int(serial) not in existing]
+
+    resolved = get_or_create_radio_fireplan_ids(
+        todo, concurrency=settings.RADIO_ONBOARDING_CONCURRENCY, progress=progress,
+    )
+
+    radios = []
+    fireplan_created = []
+    errors = []
+    for serial in todo:
+        fireplan_id, created, error = resolved[serial]
+        if error:
+            errors.append(f"{serial}: {error}")
+            continue
+        model_id = tei_range_index.lookup(int(serial))
+        if model_id is None:
+            errors.append(f"{serial}: Geen RadioModel gevonden voor TEI {int(serial)}")
+            continue
+        radios.append(Radio(TEI=int(serial), fireplan_id=fireplan_id, model_id=model_id))
+        if created:
+            fireplan_created.append(serial)
+
+    with transaction.atomic():
+        Radio.objects.bulk_create(radios, batch_size=500)
+        # Bulk writes skip the model signals
+        directory_changed(radios=[radio.TEI for radio in radios])
+
+    return {
+        "created": [[radio.tei_str, radio.fireplan_id] for radio in radios],
+        "fireplan_created": fireplan_created,
+        "existing": [serial for serial in serial_numbers if int(serial) in existing],
+        "errors": errors,
+    }
@@ -0,0 +1,219 @@
+# radio/services/range_index.py
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from typing import Any, Iterable, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class RangeIndex:
+    """
+    Immutable index over inclusive (low, high, value) ranges, searched by bisection.
+
+    Overlapping ranges are flattened into disjoint segments. Where ranges overlap,
+    the range that comes first in the input wins, just like `.first()` on the
+    queryset the ranges were loaded from.
+    """
+
+    def __init__(self, ranges: Iterable[tuple[int, int, Any]]):
+        ranges = [(low, high, value) for low, high, value in ranges if low <= high]
+
+        boundaries = sorted({low for low, _, _ in ranges} | {high + 1 for _, high, _ in ranges})
+        by_low = sorted(range(len(ranges)), key=lambda position: ranges[position][0])
+
+        starts: list[int] = []
+        ends: list[int] = []
+        values: list[Any] = []
+
+        # One sweep over the boundaries; the ranges covering the current one are
+        # kept in a heap by input position, ended ones are dropped once on top
+        active: list[tuple[int, int]] = []  # (input position, high)
+        next_range = 0
+        for start, next_start in zip(boundaries, boundaries[1:]):
+            while next_range < len(by_low) and ranges[by_low[next_range]][0] <= start:
+                position = by_low[next_range]
+                heapq.heappush(active, (position, ranges[position][1]))
+                next_range += 1
+            while active and active[0][1] < start:
+                heapq.heappop(active)
+            if not active:
+                continue
+            winner = ranges[active[0][0]][2]
+
+            # Merge with the previous segment when it is contiguous and equal
+            if ends and ends[-1] == start - 1 and values[-1] == winner:
+                ends[-1] = next_start - 1
+                continue
+
+            starts.append(start)
+            ends.append(next_start - 1)
+            values.append(winner)
+
+        self._starts = tuple(starts)
+        self._ends = tuple(ends)
+        self._values = tuple(values)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def lookup(self, number: int) -> Optional[Any]:
+        pos = bisect_right(self._starts, number) - 1
+        if pos < 0 or number > self._ends[pos]:
+            return None
+        return self._values[pos]
+
+    def __contains__(self, number: int) -> bool:
+        return self.lookup(number) is not None
+
+
+class CachedRangeIndex:
+    """
+    Process-wide, lazily loaded RangeIndex.
+
+    Signal handlers call `invalidate_on_commit()` when a range changes. That
+    drops the index in this process and gives the shared cache key
+    `version_key` a new value, which other processes compare with the version
+    their index was loaded at, at most every `version_check_interval` seconds.
+    `max_age` bounds the age of an index when the cache is not shared.
+    """
+
+    max_age = 300
+    version_check_interval = 1.0
+    version_key = ""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Optional[RangeIndex] = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._version: Optional[str] = None
+
+    def load_ranges(self) -> Iterable[tuple[int, int, Any]]:
+        raise NotImplementedError
+
+    def invalidate(self) -> None:
+        self._index = None
+
+    def invalidate_on_commit(self) -> None:
+        """
+        Drop the index now and again once the current transaction commits, so an
+        index loaded by another thread before the commit is not kept around, and
+        tell the other processes once committed.
+        """
+        self.invalidate()
+        transaction.on_commit(self._changed)
+
+    def _changed(self) -> None:
+        cache.set(self.version_key, uuid.uuid4().hex, None)
+        self.invalidate()
+
+    def _shared_version(self) -> str:
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid.uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def _is_fresh(self) -> bool:
+        now = time.monotonic()
+        if now - self._loaded_at >= self.max_age:
+            return False
+        if now - self._checked_at < self.version_check_interval:
+            return True
+        self._checked_at = now
+        if self._shared_version() != self._version:
+            self._index = None
+            return False
+        return True
+
+    def get_index(self) -> RangeIndex:
+        index = self._index
+        if index is not None and self._is_fresh():
+            return index
+
+        with self._lock:
+            index = self._index
+            if index is None or not self._is_fresh():
+                # Read before loading: a change committed during the load triggers another one
+                version = self._shared_version()
+                index = RangeIndex(self.load_ranges())
+                self._index = index
+                self._version = version
+                self._loaded_at = self._checked_at = time.monotonic()
+        return index
+
+    def lookup(self, number: int) -> Optional[Any]:
+        return self.get_index().lookup(number)
+
+    def __contains__(self, number: int) -> bool:
+        return self.lookup(number) is not None
+
+
+class TEIRangeIndex(CachedRangeIndex):
+    """TEI → RadioModel id."""
+
+    version_key = "radio:range-index:tei"
+
+    def load_ranges(self):
+        from radio.models import TEIRange
+
+        return TEIRange.objects.order_by("pk").values_list("min_tei", "max_tei", "model_id")
+
+
+class ISSICustomerRangeIndex(CachedRangeIndex):
+    """ISSI → Customer id."""
+
+    version_key = "radio:range-index:issi-customer"
+
+    def load_ranges(self):
+        from radio.models import ISSICustomerRange
+
+        return ISSICustomerRange.objects.order_by("pk").values_list("min_issi", "max_issi", "customer_id")
+
+
+class ISSIDisciplineRangeIndex(CachedRangeIndex):
+    """ISSI → Discipline id."""
+
+    version_key = "radio:range-index:issi-discipline"
+
+    def load_ranges(self):
+        from radio.models import ISSIDisciplineRange
+
+        return ISSIDisciplineRange.objects.order_by("pk").values_list("min_issi", "max_issi", "discipline_id")
+
+
+class ISSIRangeResolver:
+    """
+    Resolves the customer and discipline of ISSI numbers from the cached range tables.
+    """
+
+    def __init__(self):
+        self.customers = ISSICustomerRangeIndex()
+        self.disciplines = ISSIDisciplineRangeIndex()
+
+    def invalidate(self) -> None:
+        self.customers.invalidate()
+        self.disciplines.invalidate()
+
+    def resolve(self, number: int) -> tuple[Optional[int], Optional[int]]:
+        """Return (customer_id, discipline_id) for one ISSI number."""
+        return self.customers.lookup(number), self.disciplines.lookup(number)
+
+    def resolve_many(self, numbers: Iterable[int]) -> dict[int, tuple[Optional[int], Optional[int]]]:
+        """Return {number: (customer_id, discipline_id)} without per-number queries."""
+        customers = self.customers.get_index()
+        disciplines = self.disciplines.get_index()
+        return {
+            number: (customers.lookup(number), disciplines.lookup(number))
+            for number in numbers
+        }
+
+
+tei_range_index = TEIRangeIndex()
+issi_range_resolver = ISSIRangeResolver()
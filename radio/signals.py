@@ -1,11 +1,30 @@
 # radio/signals.py
 from __future__ import annotations
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from RadioAssetManagement.tasks import enqueue_roip_sync_for_tei
-from radio.models import ISSI, Subscription
+from radio.models import ISSI, ISSICustomerRange, ISSIDisciplineRange, Subscription, TEIRange
+from radio.services.range_index import issi_range_resolver, tei_range_index
+
+
+@receiver(post_save, sender=TEIRange)
+@receiver(post_delete, sender=TEIRange)
+def on_tei_range_changed(sender, instance: TEIRange, **kwargs) -> None:
+    tei_range_index.invalidate_on_commit()
+
+
+@receiver(post_save, sender=ISSICustomerRange)
+@receiver(post_delete, sender=ISSICustomerRange)
+def on_issi_customer_range_changed(sender, instance: ISSICustomerRange, **kwargs) -> None:
+    issi_range_resolver.customers.invalidate_on_commit()
+
+
+@receiver(post_save, sender=ISSIDisciplineRange)
+@receiver(post_delete, sender=ISSIDisciplineRange)
+def on_issi_discipline_range_changed(sender, instance: ISSIDisciplineRange, **kwargs) -> None:
+    issi_range_resolver.disciplines.invalidate_on_commit()
 
 
 @receiver(post_save, sender=ISSI)
@@ -17,5 +36,4 @@ def on_issi_saved(sender, instance: ISSI, **kwargs) -> None:
         .first()
     )
     if sub and sub.radio_id:
-        pass
-        # enqueue_roip_sync_for_tei(sub.radio_id)
\ No newline at end of file
+        enqueue_roip_sync_for_tei(sub.radio_id)
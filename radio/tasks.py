@@ -0,0 +1,20 @@
+# radio/tasks.py
+from __future__ import annotations
+
+from celery import shared_task
+
+from .services.onboarding import onboard_radios
+
+
+@shared_task(bind=True)
+def onboard_radios_task(self, serial_numbers: list[str]) -> dict:
+    """
+    Add a batch of scanned radios, see radio.services.onboarding.onboard_radios.
+
+    Progress is reported as a PROGRESS state with the number of serial numbers
+    resolved in Fireplan.
+    """
+    def progress(done, total):
+        self.update_state(state="PROGRESS", meta={"done": done, "total": total})
+
+    return onboard_radios(serial_numbers, progress=progress)
@@ -1,6 +1,11 @@
-from unittest.mock import patch
+from contextlib import nullcontext
+from unittest.mock import Mock, patch
 import json
+import random
 
+import requests
+
+from django.core.cache import cache
 from django.test import TestCase
 from django.contrib.auth.models import Permission, User
 from django.urls import reverse
@@ -8,7 +13,24 @@ from django.utils.translation import override
 
 from helpdesk.models import Ticket, TicketStatus, TicketType
 
-from .models import ISSI, Radio, RadioDecommissioningTicket, RadioModel, Subscription, TEIRange
+from .models import (
+    ISSI,
+    Customer,
+    Discipline,
+    ISSICustomerRange,
+    ISSIDisciplineRange,
+    Radio,
+    RadioDecommissioningTicket,
+    RadioModel,
+    Subscription,
+    TEIRange,
+)
+from fireplan.client import FireplanClient
+
+from .forms import RadioBulkCreateForm
+from .services.onboarding import onboard_radios
+from .services.range_index import RangeIndex, TEIRangeIndex, issi_range_resolver, tei_range_index
+from .tasks import onboard_radios_task
 
 
 class RadioCreateViewTests(TestCase):
@@ -20,9 +42,9 @@ class RadioCreateViewTests(TestCase):
             max_tei=75060300009,
         )
 
-    @patch("radio.views.FireplanClient")
+    @patch("radio.views.fireplan_client")
     def test_creates_missing_fireplan_radio_with_padded_tei(self, fireplan_client):
-        fireplan_client.return_value.get_or_create_radio_fireplan_id.return_value = (
+        fireplan_client.return_value.__enter__.return_value.get_or_create_radio_fireplan_id.return_value = (
             1234,
             True,
         )
@@ -36,21 +58,21 @@ class RadioCreateViewTests(TestCase):
             )
 
         self.assertEqual(response.status_code, 302)
-        fireplan_client.return_value.get_or_create_radio_fireplan_id.assert_called_once_with(
+        fireplan_client.return_value.__enter__.return_value.get_or_create_radio_fireplan_id.assert_called_once_with(
             "000075060235950"
         )
 
         radio = Radio.objects.get(TEI=75060235950)
         self.assertEqual(radio.fireplan_id, 1234)
 
-    @patch("radio.views.FireplanClient")
+    @patch("radio.views.fireplan_client")
     def test_uses_full_scanned_tei_for_fireplan_when_check_digit_is_not_zero(self, fireplan_client):
         TEIRange.objects.create(
             model=self.radio_model,
             min_tei=75190000000,
             max_tei=75199999999,
         )
-        fireplan_client.return_value.get_or_create_radio_fireplan_id.return_value = (
+        fireplan_client.return_value.__enter__.return_value.get_or_create_radio_fireplan_id.return_value = (
             1287,
             False,
         )
@@ -64,7 +86,7 @@ class RadioCreateViewTests(TestCase):
             )
 
         self.assertEqual(response.status_code, 302)
-        fireplan_client.return_value.get_or_create_radio_fireplan_id.assert_called_once_with(
+        fireplan_client.return_value.__enter__.return_value.get_or_create_radio_fireplan_id.assert_called_once_with(
             "000075190060667"
         )
 
@@ -72,6 +94,104 @@ class RadioCreateViewTests(TestCase):
         self.assertEqual(radio.fireplan_id, 1287)
 
 
+class FakeFireplanRadios:
+    """Knows the QR codes in `known`; create_radio hands out new IDs, except for the serials in `failing`."""
+
+    RADIO_QR_NAME = FireplanClient.RADIO_QR_NAME
+    QR_CODE_PATTERN = FireplanClient.QR_CODE_PATTERN
+    fireplan_id_from_qr_record = FireplanClient.fireplan_id_from_qr_record
+
+    def __init__(self, known, failing=()):
+        self.known = known
+        self.failing = set(failing)
+        self.created = []
+
+    def iter_qr_code_records(self, name):
+        for serial, fireplan_id in self.known.items():
+            yield {"serialNumber": serial, "qrCode": f"https://infoscan.firebru.brussels?data=1,2,{fireplan_id},3"}
+
+    def create_radio(self, serial_number):
+        if serial_number in self.failing:
+            raise requests.HTTPError("500 Server Error")
+        self.created.append(serial_number)
+        return 9000 + len(self.created)
+
+
+class RadioBulkCreateTests(TestCase):
+    def setUp(self):
+        self.radio_model = RadioModel.objects.create(name="Portable")
+        TEIRange.objects.create(model=self.radio_model, min_tei=75060200000, max_tei=75060300009)
+        self.user = User.objects.create_user(username="onboarder", password="secret")
+
+    def test_form_checks_every_scanned_tei(self):
+        form = RadioBulkCreateForm({"teis": "000075060235950\n000075060235950, 000075060235960\nabc\n000099999999999"})
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(len(form.errors["teis"]), 2)
+
+        form = RadioBulkCreateForm({"teis": "000075060235950\n000075060235950\n 000075060235960 "})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["teis"], ["000075060235950", "000075060235960"])
+
+    def test_view_queues_onboarding_job(self):
+        self.client.force_login(self.user)
+
+        with override("nl"), patch("radio.views.onboard_radios_task.delay", return_value=Mock(id="abc")) as delay:
+            url = reverse("radio:bulk_create")
+            response = self.client.post(url, {"teis": "000075060235950\n000075060235960"})
+
+        self.assertRedirects(response, url + "?task=abc", fetch_redirect_response=False)
+        delay.assert_called_once_with(["000075060235950", "000075060235960"])
+
+        with override("nl"):
+            page = self.client.get(url + "?task=abc")
+            self.assertContains(page, reverse("radio:bulk_create_status", args=["abc"]))
+
+            with patch("RadioAssetManagement.task_status.AsyncResult") as result:
+                result.return_value.configure_mock(**{
+                    "state": "PROGRESS", "info": {"done": 1, "total": 2}, "failed.return_value": False,
+                })
+                own = self.client.get(reverse("radio:bulk_create_status", args=["abc"]))
+                other = self.client.get(reverse("radio:bulk_create_status", args=["astrid-import"]))
+
+        self.assertEqual(own.json(), {"state": "PROGRESS", "progress": {"done": 1, "total": 2}})
+        self.assertEqual(other.status_code, 404)
+
+    def test_resolves_fireplan_ids_and_creates_radios_in_bulk(self):
+        Radio.objects.create(TEI=75060235900, fireplan_id=1)
+        fake = FakeFireplanRadios(known={"000075060235950": 501}, failing={"000075060235970"})
+        progress = []
+
+        with patch("fireplan.client.fireplan_client", return_value=nullcontext(fake)):
+            result = onboard_radios(
+                ["000075060235900", "000075060235950", "000075060235960", "000075060235970"],
+                progress=lambda done, total: progress.append((done, total)),
+            )
+
+        self.assertEqual(fake.created, ["000075060235960"])
+        self.assertEqual(result["created"], [["000075060235950", 501], ["000075060235960", 9001]])
+        self.assertEqual(result["fireplan_created"], ["000075060235960"])
+        self.assertEqual(result["existing"], ["000075060235900"])
+        self.assertEqual(len(result["errors"]), 1)
+        self.assertTrue(result["errors"][0].startswith("000075060235970: "))
+        self.assertEqual(progress[0], (1, 3))
+        self.assertEqual(progress[-1], (3, 3))
+
+        radio = Radio.objects.get(TEI=75060235960)
+        self.assertEqual((radio.fireplan_id, radio.model), (9001, self.radio_model))
+        self.assertFalse(Radio.objects.filter(TEI=75060235970).exists())
+
+    def test_task_reports_progress(self):
+        fake = FakeFireplanRadios(known={})
+
+        with patch("fireplan.client.fireplan_client", return_value=nullcontext(fake)), \
+                patch.object(onboard_radios_task, "update_state") as update_state:
+            result = onboard_radios_task.apply(args=[["000075060235950"]]).get()
+
+        self.assertEqual(result["created"], [["000075060235950", 9001]])
+        update_state.assert_called_with(state="PROGRESS", meta={"done": 1, "total": 1})
+
+
 class DecommissioningRequestTests(TestCase):
     def setUp(self):
         self.radio_model = RadioModel.objects.create(name="Portable")
@@ -401,3 +521,120 @@ class RadioSelectorLookupTests(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()["TEI"], self.reported_radio.TEI)
+
+
+class TEIRangeIndexTests(TestCase):
+    def setUp(self):
+        self.addCleanup(tei_range_index.invalidate)
+        self.portable = RadioModel.objects.create(name="Portable")
+        self.mobile = RadioModel.objects.create(name="Mobile")
+        self.portable_range = TEIRange.objects.create(
+            model=self.portable,
+            min_tei=75000000000,
+            max_tei=75000000999,
+        )
+        TEIRange.objects.create(model=self.mobile, min_tei=75000001000, max_tei=75000001999)
+
+    def test_overlapping_ranges_resolve_to_first_range(self):
+        index = RangeIndex([(10, 20, "a"), (15, 30, "b"), (40, 40, "c")])
+
+        self.assertEqual(index.lookup(15), "a")
+        self.assertEqual(index.lookup(21), "b")
+        self.assertEqual(index.lookup(40), "c")
+        self.assertIsNone(index.lookup(9))
+        self.assertIsNone(index.lookup(31))
+
+    def test_index_matches_first_covering_range(self):
+        rng = random.Random(7)
+        ranges = []
+        for value in range(200):
+            low = rng.randrange(1000)
+            ranges.append((low, low + rng.randrange(60), value % 5))
+
+        index = RangeIndex(ranges)
+
+        for number in range(-1, 1070):
+            expected = next((value for low, high, value in ranges if low <= number <= high), None)
+            self.assertEqual(index.lookup(number), expected, number)
+
+    def test_radio_save_resolves_model_without_range_query(self):
+        tei_range_index.get_index()
+
+        # The insert and the RoIP directory change log
+        with self.assertNumQueries(2):
+            radio = Radio.objects.create(TEI=75000001001)
+
+        self.assertEqual(radio.model, self.mobile)
+
+    def test_radio_save_rejects_tei_outside_ranges(self):
+        with self.assertRaises(ValueError):
+            Radio.objects.create(TEI=76000000000)
+
+    def test_range_changes_invalidate_index(self):
+        self.assertEqual(tei_range_index.lookup(75000000001), self.portable.pk)
+
+        self.portable_range.model = self.mobile
+        self.portable_range.save()
+        self.assertEqual(tei_range_index.lookup(75000000001), self.mobile.pk)
+
+        self.portable_range.delete()
+        self.assertIsNone(tei_range_index.lookup(75000000001))
+
+    def test_committed_range_change_reaches_other_processes(self):
+        self.addCleanup(cache.clear)
+        other_process = TEIRangeIndex()
+        other_process.version_check_interval = 0
+        self.assertEqual(other_process.lookup(75000000001), self.portable.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.portable_range.model = self.mobile
+            self.portable_range.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(other_process.lookup(75000000001), self.mobile.pk)
+        with self.assertNumQueries(0):
+            other_process.lookup(75000000001)
+
+
+class ISSIRangeResolverTests(TestCase):
+    def setUp(self):
+        # The resolver is process-wide; don't leak rolled back ranges into other tests
+        self.addCleanup(issi_range_resolver.invalidate)
+        self.customer = Customer.objects.create(name="Brandweer", owner=True)
+        self.discipline = Discipline.objects.create(
+            name="Fire",
+            discipline_type=Discipline.DisciplineType.FIRE,
+        )
+        self.customer_range = ISSICustomerRange.objects.create(
+            customer=self.customer,
+            min_issi=6920000,
+            max_issi=6929999,
+        )
+        ISSIDisciplineRange.objects.create(
+            discipline=self.discipline,
+            min_issi=6900000,
+            max_issi=6999999,
+        )
+
+    def test_issi_save_assigns_customer_and_discipline(self):
+        issi = ISSI.objects.create(number=6922111)
+
+        self.assertEqual(issi.customer, self.customer)
+        self.assertEqual(issi.discipline, self.discipline)
+
+    def test_resolve_many_runs_no_queries_once_loaded(self):
+        issi_range_resolver.resolve(0)
+
+        with self.assertNumQueries(0):
+            resolved = issi_range_resolver.resolve_many([6922111, 6930000, 1234567])
+
+        self.assertEqual(resolved[6922111], (self.customer.pk, self.discipline.pk))
+        self.assertEqual(resolved[6930000], (None, self.discipline.pk))
+        self.assertEqual(resolved[1234567], (None, None))
+
+    def test_customer_range_delete_invalidates_resolver(self):
+        self.assertEqual(issi_range_resolver.resolve(6922111)[0], self.customer.pk)
+
+        self.customer_range.delete()
+
+        self.assertIsNone(issi_range_resolver.resolve(6922111)[0])
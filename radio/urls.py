@@ -13,6 +13,8 @@ urlpatterns = [
     path('issi/<int:pk>/edit/', ISSIAliasUpdateView.as_view(), name='issi_alias_edit'),
     path('<int:pk>/', RadioDetailView.as_view(), name='detail'),
     path('create/', RadioCreateView.as_view(), name='create'),
+    path('create/bulk/', RadioBulkCreateView.as_view(), name='bulk_create'),
+    path('create/bulk/<str:task_id>/', RadioBulkCreateStatusView.as_view(), name='bulk_create_status'),
     path('<int:tei>/card/', RadioCardView.as_view(), name='card'),
     path('example/card/', RadioCardExampleView.as_view(), name='example_card'),
     path('scan/', ScanQRCodeView.as_view(), name='scan'),
@@ -3,7 +3,7 @@ from django.views.generic import ListView, TemplateView
 from django.http import JsonResponse, Http404, HttpResponseBadRequest, HttpResponse
 from django.template.loader import render_to_string
 from django.shortcuts import render, redirect, get_object_or_404
-from django.views.generic.edit import CreateView, UpdateView
+from django.views.generic.edit import CreateView, FormView, UpdateView
 from django.views.generic.detail import DetailView
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -14,7 +14,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMix
 from django.utils.translation import gettext as _
 from django.core.exceptions import PermissionDenied
 from django.db.models import Case, Count, IntegerField, Q, Value, When
-from django.utils.http import url_has_allowed_host_and_scheme
+from django.utils.http import url_has_allowed_host_and_scheme, urlencode
 from itertools import chain
 
 
@@ -28,8 +28,10 @@ logger = logging.getLogger(__name__)
 
 from .models import *
 from astrid.models import Request
-from fireplan.client import FireplanClient
+from fireplan.client import fireplan_client
 from .forms import *
+from .tasks import onboard_radios_task
+from RadioAssetManagement.task_status import remember_task, task_status_response
 from printer.models import *
 from .services.printing import RadioPrintingService
 from .services.image_service import ImageGenerator
@@ -237,9 +239,10 @@ class RadioCreateView(CreateView):
 
     def form_valid(self, form):
         try:
-            fireplan_id, created = FireplanClient().get_or_create_radio_fireplan_id(
-                form.cleaned_data["fireplan_serial_number"]
-            )
+            with fireplan_client() as fp:
+                fireplan_id, created = fp.get_or_create_radio_fireplan_id(
+                    form.cleaned_data["fireplan_serial_number"]
+                )
             form.instance.fireplan_id = fireplan_id
             if created:
                 messages.info(
@@ -262,6 +265,27 @@ class RadioCreateView(CreateView):
         return response
 
 
+class RadioBulkCreateView(LoginRequiredMixin, FormView):
+    form_class = RadioBulkCreateForm
+    template_name = 'radio/radio_bulk_create.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["task_id"] = self.request.GET.get("task", "")
+        return context
+
+    def form_valid(self, form):
+        # Fireplan is called from the Celery worker, the page polls the task for progress
+        task = onboard_radios_task.delay(form.cleaned_data["teis"])
+        remember_task(self.request, onboard_radios_task, task)
+        return redirect(f"{self.request.path}?{urlencode({'task': task.id})}")
+
+
+class RadioBulkCreateStatusView(LoginRequiredMixin, View):
+    def get(self, request, task_id):
+        return task_status_response(request, task_id, [onboard_radios_task])
+
+
 class RadioListView(LoginRequiredMixin, ListView):
     model = Radio
     template_name = "radio/radio_list.html"
@@ -1,3 +1,19 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import TxEvent
+
+
+@admin.register(TxEvent)
+class TxEventAdmin(admin.ModelAdmin):
+    list_display = ("ts", "event_type", "issi", "alias", "call_sign", "vector", "talkgroup", "node_id", "duration_s")
+    list_filter = ("event_type", "node_id")
+    search_fields = ("=issi", "alias", "call_sign", "vector", "talkgroup")
+    date_hierarchy = "ts"
+    # Large, append-only table: skip the full COUNT(*) on every page
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
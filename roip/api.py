@@ -1,10 +1,30 @@
+import base64
 import hmac
+import json
+import re
 
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
-from radio.models import ISSI
+from .enrichment import enrichment_queryset
+from .lookup_cache import NOT_FOUND, get_issi_payload
+from .models import TxEvent
+from .snapshot import current_version, is_version_available, iter_gzip, iter_json, iter_ndjson, iter_snapshot
+
+ISSI_BULK_MAX = 500
+
+SNAPSHOT_FORMATS = {"ndjson": "application/x-ndjson", "json": "application/json"}
+ACCEPTS_GZIP_RE = re.compile(r"\bgzip\b")
+
+TX_EVENTS_DEFAULT_LIMIT = 100
+TX_EVENTS_MAX_LIMIT = 1000
 
 
 def _configured_api_keys():
@@ -78,6 +98,67 @@ def _vector_payload(vector):
     }
 
 
+def _issi_payload(issi_obj):
+    """Lookup payload for an ISSI loaded with roip.enrichment.enrichment_queryset()."""
+    subscription = getattr(issi_obj, "subscription", None)
+    radio = subscription.radio if subscription else None
+    vehicle = getattr(radio, "vehicle", None) if radio else getattr(issi_obj, "vehicle", None)
+    vector = getattr(vehicle, "vector", None) if vehicle else None
+
+    return {
+        "issi": {
+            "number": issi_obj.number,
+            "alias": issi_obj.alias,
+            "customer": _object_payload(issi_obj.customer, ["id", "name", "owner"]),
+            "discipline": (
+                {
+                    "id": issi_obj.discipline.id,
+                    "name": issi_obj.discipline.name,
+                    "type": issi_obj.discipline.discipline_type,
+                }
+                if issi_obj.discipline
+                else None
+            ),
+        },
+        "subscription": (
+            {
+                "active": subscription.active,
+                "dmo_only": subscription.DMO_only,
+                "astrid_alias": subscription.astrid_alias,
+            }
+            if subscription
+            else None
+        ),
+        "radio": (
+            {
+                "tei": radio.TEI,
+                "tei_15": radio.tei_15_str,
+                "model": radio.model.name if radio.model else None,
+                "model_type": radio.model.radio_type if radio.model else None,
+                "decommissioned": radio.decommissioned,
+                "is_active": radio.is_active,
+                "is_dmo_only": radio.is_DMO_only,
+            }
+            if radio
+            else None
+        ),
+        "vehicle": _vehicle_payload(vehicle),
+        "vector": _vector_payload(vector),
+    }
+
+
+def _render_issi_payload(issi_number):
+    issi_obj = enrichment_queryset().filter(number=issi_number).first()
+    if issi_obj is None:
+        return None
+    return json.dumps(_issi_payload(issi_obj), cls=DjangoJSONEncoder).encode()
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get("If-None-Match", "")
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+
 class IssiLookupApiView(View):
     http_method_names = ["get", "head", "options"]
 
@@ -92,69 +173,201 @@ class IssiLookupApiView(View):
         except (TypeError, ValueError):
             return _json_response({"detail": "ISSI must be numeric"}, status=400)
 
-        issi_obj = (
-            ISSI.objects.select_related(
-                "customer",
-                "discipline",
-                "subscription__radio__model",
-                "subscription__radio__vehicle__vector__service",
-                "subscription__radio__vehicle__vector__resourceTypeCode",
-                "subscription__radio__vehicle__vector__statusCode",
-                "vehicle__vector__service",
-                "vehicle__vector__resourceTypeCode",
-                "vehicle__vector__statusCode",
-            )
-            .filter(number=issi_number)
-            .first()
-        )
+        body, etag = get_issi_payload(issi_number, _render_issi_payload)
 
-        if issi_obj is None:
+        if body == NOT_FOUND:
             return _json_response({"detail": "ISSI not found"}, status=404)
 
-        subscription = getattr(issi_obj, "subscription", None)
-        radio = subscription.radio if subscription else None
-        vehicle = getattr(radio, "vehicle", None) if radio else getattr(issi_obj, "vehicle", None)
-        vector = getattr(vehicle, "vector", None) if vehicle else None
-
-        data = {
-            "issi": {
-                "number": issi_obj.number,
-                "alias": issi_obj.alias,
-                "customer": _object_payload(issi_obj.customer, ["id", "name", "owner"]),
-                "discipline": (
-                    {
-                        "id": issi_obj.discipline.id,
-                        "name": issi_obj.discipline.name,
-                        "type": issi_obj.discipline.discipline_type,
-                    }
-                    if issi_obj.discipline
-                    else None
-                ),
-            },
-            "subscription": (
-                {
-                    "active": subscription.active,
-                    "dmo_only": subscription.DMO_only,
-                    "astrid_alias": subscription.astrid_alias,
-                }
-                if subscription
-                else None
-            ),
-            "radio": (
-                {
-                    "tei": radio.TEI,
-                    "tei_15": radio.tei_15_str,
-                    "model": radio.model.name if radio.model else None,
-                    "model_type": radio.model.radio_type if radio.model else None,
-                    "decommissioned": radio.decommissioned,
-                    "is_active": radio.is_active,
-                    "is_dmo_only": radio.is_DMO_only,
-                }
-                if radio
-                else None
-            ),
-            "vehicle": _vehicle_payload(vehicle),
-            "vector": _vector_payload(vector),
-        }
+        if _etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        # Clients may keep the response, but must revalidate it with If-None-Match
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class IssiBulkLookupApiView(View):
+    """
+    Resolve up to ISSI_BULK_MAX ISSIs in one request and one query.
+
+    POST {"issis": [1234567, 2345678]} or GET ?issi=1234567,2345678
+    """
+
+    http_method_names = ["get", "post", "head", "options"]
+
+    def dispatch(self, request, *args, **kwargs):
+        if not _is_authorized(request):
+            return _json_response({"detail": "Unauthorized"}, status=401)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        values = [value for param in request.GET.getlist("issi") for value in param.split(",") if value.strip()]
+        return self.lookup(values)
+
+    def post(self, request):
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            return _json_response({"detail": "Invalid JSON"}, status=400)
+
+        values = body.get("issis") if isinstance(body, dict) else None
+        if not isinstance(values, list):
+            return _json_response({"detail": "Expected {\"issis\": [...]}"}, status=400)
+        return self.lookup(values)
+
+    def lookup(self, values):
+        try:
+            numbers = list(dict.fromkeys(int(value) for value in values))
+        except (TypeError, ValueError):
+            return _json_response({"detail": "ISSI must be numeric"}, status=400)
+
+        if len(numbers) > ISSI_BULK_MAX:
+            return _json_response({"detail": f"At most {ISSI_BULK_MAX} ISSIs per request"}, status=400)
+
+        found = {issi_obj.number: issi_obj for issi_obj in enrichment_queryset().filter(number__in=numbers)}
+
+        return _json_response({
+            "results": {str(number): _issi_payload(found[number]) for number in numbers if number in found},
+            "not_found": [number for number in numbers if number not in found],
+        })
+
+
+class DirectorySnapshotApiView(View):
+    """
+    The whole ISSI directory as a stream, one row per ISSI.
+
+    ?format=ndjson (default) or json, ?since=<version> for the rows changed
+    after an earlier snapshot. The version of this snapshot is returned in the
+    X-Directory-Version header. Gzipped when the client accepts it.
+    """
+
+    http_method_names = ["get", "head", "options"]
+
+    def dispatch(self, request, *args, **kwargs):
+        if not _is_authorized(request):
+            return _json_response({"detail": "Unauthorized"}, status=401)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        output = request.GET.get("format") or "ndjson"
+        if output not in SNAPSHOT_FORMATS:
+            return _json_response({"detail": "format must be ndjson or json"}, status=400)
+
+        since = None
+        if request.GET.get("since"):
+            try:
+                since = int(request.GET["since"])
+            except ValueError:
+                return _json_response({"detail": "since must be numeric"}, status=400)
+            if since < 0:
+                return _json_response({"detail": "since must be numeric"}, status=400)
+            if not is_version_available(since):
+                return _json_response({"detail": "since is too old, fetch a full snapshot"}, status=410)
+
+        # Taken before the rows are read: a change made while streaming may be sent
+        # again on the next sync, but is never skipped
+        version = current_version()
+        rows = iter_snapshot(since=since, version=version)
+        content = iter_json(rows, version, since) if output == "json" else iter_ndjson(rows)
+
+        gzipped = bool(ACCEPTS_GZIP_RE.search(request.headers.get("Accept-Encoding", "")))
+        response = StreamingHttpResponse(
+            iter_gzip(content) if gzipped else content,
+            content_type=SNAPSHOT_FORMATS[output],
+        )
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        response["Vary"] = "Accept-Encoding"
+        response["Cache-Control"] = "no-store"
+        response["X-Directory-Version"] = str(version)
+        return response
+
+
+def _parse_time(value):
+    dt = parse_datetime(value)
+    if dt is None:
+        raise ValueError(value)
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def _encode_cursor(event):
+    raw = json.dumps([event.ts.isoformat(), event.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    ts, event_id = json.loads(raw)
+    return _parse_time(ts), int(event_id)
+
+
+def _tx_event_payload(event):
+    return {
+        "id": event.id,
+        "ts": event.ts.isoformat(),
+        "type": event.event_type,
+        "node_id": event.node_id,
+        "talkgroup": event.talkgroup,
+        "issi": event.issi,
+        "alias": event.alias,
+        "tei": event.tei,
+        "call_sign": event.call_sign,
+        "vector": event.vector,
+        "duration_s": event.duration_s,
+        "filename": event.filename,
+    }
+
+
+class TxEventListApiView(View):
+    """
+    Stored TX events, newest first, with keyset pagination.
+
+    Filters: issi, talkgroup, vector, node_id, type, from, to (ISO 8601).
+    """
+
+    http_method_names = ["get", "head", "options"]
+
+    def dispatch(self, request, *args, **kwargs):
+        if not _is_authorized(request):
+            return _json_response({"detail": "Unauthorized"}, status=401)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        params = request.GET
+        qs = TxEvent.objects.order_by("-ts", "-id")
+
+        try:
+            if params.get("issi"):
+                qs = qs.filter(issi=int(params["issi"]))
+            if params.get("from"):
+                qs = qs.filter(ts__gte=_parse_time(params["from"]))
+            if params.get("to"):
+                qs = qs.filter(ts__lt=_parse_time(params["to"]))
+            limit = max(1, min(int(params.get("limit") or TX_EVENTS_DEFAULT_LIMIT), TX_EVENTS_MAX_LIMIT))
+        except ValueError:
+            return _json_response({"detail": "Invalid issi, from, to or limit"}, status=400)
+
+        for param, field in (("talkgroup", "talkgroup"), ("vector", "vector"), ("node_id", "node_id"), ("type", "event_type")):
+            if params.get(param):
+                qs = qs.filter(**{field: params[param]})
+
+        if params.get("cursor"):
+            try:
+                ts, event_id = _decode_cursor(params["cursor"])
+            except (ValueError, TypeError):
+                return _json_response({"detail": "Invalid cursor"}, status=400)
+            qs = qs.filter(Q(ts__lt=ts) | Q(ts=ts, id__lt=event_id))
+
+        events = list(qs[: limit + 1])
+        has_more = len(events) > limit
+        events = events[:limit]
 
-        return _json_response(data)
+        return _json_response({
+            "results": [_tx_event_payload(event) for event in events],
+            "next": _encode_cursor(events[-1]) if has_more and events else None,
+        })
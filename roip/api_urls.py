@@ -1,9 +1,12 @@
 from django.urls import path
 
-from .api import IssiLookupApiView
+from .api import DirectorySnapshotApiView, IssiBulkLookupApiView, IssiLookupApiView, TxEventListApiView
 
 app_name = "roip_api"
 
 urlpatterns = [
+    path("issi/bulk/", IssiBulkLookupApiView.as_view(), name="issi_bulk_lookup"),
     path("issi/<str:issi>/", IssiLookupApiView.as_view(), name="issi_lookup"),
+    path("snapshot/", DirectorySnapshotApiView.as_view(), name="snapshot"),
+    path("tx-events/", TxEventListApiView.as_view(), name="tx_events"),
 ]
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RoipConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'roip'
+
+    def ready(self):
+        import roip.signals
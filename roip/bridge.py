@@ -0,0 +1,203 @@
+# roip/bridge.py
+"""
+Asyncio pipeline between the MQTT client and the channel layer.
+
+The MQTT network thread only puts raw payloads on a bounded queue. One task
+drains the queue in batches and enriches them (in a thread pool when the
+database is needed), a second task sends every batch to the channel layer as
+a single `tx_events` group message. Batches are handled in order, so events
+reach the browsers in the order they were received.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from django.db import close_old_connections
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class BridgeMetrics:
+    received: int = 0
+    sent: int = 0
+    dropped: int = 0
+    batches: int = 0
+    max_queue_depth: int = 0
+    # Seconds between MQTT receipt and channel-layer send of the most recent events
+    lags: deque = field(default_factory=lambda: deque(maxlen=5000))
+
+    def lag_percentile(self, pct: float) -> Optional[float]:
+        if not self.lags:
+            return None
+        lags = sorted(self.lags)
+        return lags[min(len(lags) - 1, int(len(lags) * pct / 100))]
+
+    def snapshot(self, queue_depth: int) -> dict[str, Any]:
+        p50, p99 = self.lag_percentile(50), self.lag_percentile(99)
+        return {
+            "received": self.received,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "queue_depth": queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "lag_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "lag_p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+        }
+
+
+class AsyncBridge:
+    """
+    Bounded queue → batch enrichment → batched group_send.
+
+    `submit()` may be called from any thread. When the queue is full it waits
+    up to `put_timeout` seconds, which slows down the MQTT client (and so the
+    broker) instead of growing memory; after that the oldest queued event is
+    dropped, since a live view prefers recent events over old ones.
+    """
+
+    def __init__(
+        self,
+        channel_layer,
+        group_name: str,
+        enrich: Callable[[dict[str, Any]], dict[str, Any]],
+        *,
+        queue_size: int = 10000,
+        batch_size: int = 100,
+        batch_window: float = 0.02,
+        workers: int = 4,
+        put_timeout: float = 1.0,
+        metrics_interval: float = 60.0,
+        history=None,
+        store=None,
+    ):
+        self.channel_layer = channel_layer
+        self.group_name = group_name
+        self.enrich = enrich
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.metrics_interval = metrics_interval
+        self.history = history
+        self.store = store
+        self.metrics = BridgeMetrics()
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    # ------------------------------------------------------------ intake
+
+    def submit(self, payload: dict[str, Any]) -> None:
+        """Queue a raw payload; thread-safe, blocks briefly when the queue is full."""
+        future = asyncio.run_coroutine_threadsafe(self.put((time.monotonic(), payload)), self.loop)
+        try:
+            future.result(self.put_timeout + 1)
+        except Exception:
+            log.exception("Could not queue RoIP event")
+
+    async def put(self, item: tuple[float, dict[str, Any]]) -> None:
+        self.metrics.received += 1
+        try:
+            await asyncio.wait_for(self.queue.put(item), self.put_timeout)
+        except asyncio.TimeoutError:
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.metrics.dropped += 1
+            self.queue.put_nowait(item)
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.queue.qsize())
+
+    # ------------------------------------------------------------ pipeline
+
+    async def _next_batch(self) -> list[tuple[float, dict[str, Any]]]:
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _enrich_in_thread(self, payload: dict[str, Any]) -> dict[str, Any]:
+        close_old_connections()
+        return self.enrich(payload)
+
+    async def _enrich_batch(self, payloads: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        if self._pool is None:
+            return [self.enrich(payload) for payload in payloads]
+        return await asyncio.gather(
+            *(self.loop.run_in_executor(self._pool, self._enrich_in_thread, payload) for payload in payloads)
+        )
+
+    async def _enrich_loop(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                events = await self._enrich_batch([payload for _, payload in batch])
+            except Exception:
+                log.exception("Enrichment failed; forwarding %s events unenriched", len(batch))
+                events = [payload for _, payload in batch]
+            # Bounded as well: a slow channel layer holds up enrichment too
+            await self._outbox.put(([received for received, _ in batch], events))
+
+    async def _send_loop(self) -> None:
+        while True:
+            received, events = await self._outbox.get()
+            if self.history is not None:
+                # One pipelined write per batch, sets each event's "seq"
+                await self.history.aappend(events)
+            try:
+                await self.channel_layer.group_send(self.group_name, {"type": "tx_events", "events": events})
+            except Exception:
+                log.exception("group_send of %s events failed", len(events))
+                continue
+
+            if self.store is not None:
+                self.store.add(events)
+
+            now = time.monotonic()
+            self.metrics.lags.extend(now - t for t in received)
+            self.metrics.sent += len(events)
+            self.metrics.batches += 1
+
+    async def _metrics_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            log.info("RoIP bridge %s", self.metrics.snapshot(self.queue.qsize()))
+
+    async def run(self, started: Optional[Callable[[], None]] = None) -> None:
+        """Run the pipeline until cancelled. `started` is called once the queue exists."""
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self._outbox = asyncio.Queue(2)
+        if self.workers > 1:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="roip-enrich")
+
+        tasks = [asyncio.create_task(self._enrich_loop()), asyncio.create_task(self._send_loop())]
+        if self.metrics_interval:
+            tasks.append(asyncio.create_task(self._metrics_loop()))
+
+        if started is not None:
+            started()
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
@@ -2,19 +2,68 @@
 
 from __future__ import annotations
 
+import re
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
+from .filters import TxEventFilter
+from .history import tx_history
+
+SEQ_RE = re.compile(r"^\d+-\d+$")
+# The filter in the URL is invalid; the browser must not reconnect with it
+INVALID_FILTER_CLOSE_CODE = 4400
+
 
 class LiveTxConsumer(AsyncJsonWebsocketConsumer):
     group_name = "live_tx"
+    history = tx_history
 
     async def connect(self) -> None:
+        query_string = self.scope.get("query_string", b"")
+
+        # The filter can be given in the URL, and replaced later with a "filter" message
+        try:
+            self.filter = TxEventFilter.from_query_string(query_string)
+        except ValueError:
+            # Accepted first: a refused handshake reaches the browser as 1006, not as 4400
+            await self.accept()
+            await self.close(code=INVALID_FILTER_CLOSE_CODE)
+            return
+
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
 
+        # Recent events, or the ones missed since ?since=<seq> after a reconnect.
+        # Joining the group first means an event may arrive twice, never not at all.
+        if self.history is not None:
+            since = parse_qs(query_string.decode("latin-1")).get("since", [None])[-1]
+            backlog = await self.history.abacklog(since if since and SEQ_RE.match(since) else None)
+            events = [event for event in backlog if self.filter.matches(event)]
+            if events:
+                await self.send_json({"type": "backlog", "events": events})
+
     async def disconnect(self, close_code: int) -> None:
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
+    async def receive_json(self, content, **kwargs) -> None:
+        if not isinstance(content, dict) or content.get("action") != "filter":
+            return
+
+        try:
+            self.filter = TxEventFilter.from_dict(content)
+        except ValueError as e:
+            await self.send_json({"type": "error", "error": str(e)})
+            return
+        await self.send_json({"type": "filter", "filter": self.filter.as_dict()})
+
     async def tx_event(self, event) -> None:
         # event = {"type": "tx.event", "data": {...}}
-        await self.send_json(event["data"])
\ No newline at end of file
+        if self.filter.matches(event["data"]):
+            await self.send_json(event["data"])
+
+    async def tx_events(self, event) -> None:
+        # Batch from the asyncio bridge: event = {"type": "tx.events", "events": [...]}
+        for data in event["events"]:
+            if self.filter.matches(data):
+                await self.send_json(data)
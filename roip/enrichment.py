@@ -0,0 +1,318 @@
+# roip/enrichment.py
+"""
+ISSI → enrichment data for live TX events.
+
+The MQTT bridge keeps an EnrichmentCache in memory: it is warmed in one query
+at startup and refreshed incrementally when ISSIs, subscriptions, radios,
+vehicles or vectors change. Changes are published on a Redis channel by the
+signal handlers in roip/signals.py, so saves in the web or Celery processes
+reach the bridge process.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+import redis
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from radio.models import ISSI
+
+log = logging.getLogger(__name__)
+
+
+ENRICHMENT_SELECT_RELATED = (
+    "customer",
+    "discipline",
+    "subscription__radio__model",
+    "subscription__radio__vehicle__vector__service",
+    "subscription__radio__vehicle__vector__resourceTypeCode",
+    "subscription__radio__vehicle__vector__statusCode",
+    "vehicle__vector__service",
+    "vehicle__vector__resourceTypeCode",
+    "vehicle__vector__statusCode",
+)
+
+# Keys of a change message and the reference type they point to
+REF_TYPES = ("issis", "radios", "vehicles", "vectors", "customers", "disciplines")
+
+
+def enrichment_queryset():
+    return ISSI.objects.select_related(*ENRICHMENT_SELECT_RELATED)
+
+
+def build_enrichment(issi: ISSI) -> dict[str, Any]:
+    """Enrichment fields for one ISSI loaded with ENRICHMENT_SELECT_RELATED."""
+    data: dict[str, Any] = {
+        "issi": {
+            "number": issi.number,
+            "alias": issi.alias,
+            "customer": getattr(issi.customer, "name", None),
+            "discipline": getattr(issi.discipline, "name", None),
+        },
+        "alias": issi.alias,
+    }
+
+    sub = getattr(issi, "subscription", None)
+    radio = sub.radio if sub is not None else None
+
+    if radio is not None:
+        data["radio"] = {
+            "TEI": radio.TEI,
+            "tei_str": radio.tei_str,
+            "fireplan_id": radio.fireplan_id,
+            "model": getattr(radio.model, "name", None),
+            "decommissioned": radio.decommissioned,
+            "is_active": radio.is_active,
+            "is_dmo_only": radio.is_DMO_only,
+        }
+        data["TEI"] = radio.TEI
+        data["fireplan_id"] = radio.fireplan_id
+
+    v = (getattr(radio, "vehicle", None) if radio is not None else None) or getattr(issi, "vehicle", None)
+    if v is not None:
+        data["vehicle"] = {
+            "id": v.id,
+            "number": v.number,
+            "call_sign": v.call_sign,
+            "plate": v.plate,
+            "status": v.status,
+            "utilisation": v.utilisation,
+            "chassis": v.chassis,
+        }
+
+        vec = getattr(v, "vector", None)
+        if vec is not None:
+            sc = vec.statusCode
+            data["vector"] = {
+                "resourceCode": vec.resourceCode,
+                "name": vec.name,
+                "abbreviation": vec.abbreviation,
+                "orderServiceAbbreviation": vec.orderServiceAbbreviation,
+                "service": getattr(vec.service, "code", None),
+                "resourceTypeCode": getattr(vec.resourceTypeCode, "code", None),
+                "statusCode": getattr(sc, "code", None),
+                "statusDescription": getattr(sc, "description", None),
+                "statusColor": getattr(sc, "color", None),
+            }
+
+    return data
+
+
+def load_enrichments(issi_numbers: Optional[Iterable[int]] = None) -> dict[int, tuple[dict[str, Any], set[tuple[str, Any]]]]:
+    """Build enrichments and their refs in one query, for all ISSIs or only the given numbers."""
+    qs = enrichment_queryset()
+    if issi_numbers is not None:
+        qs = qs.filter(number__in=list(issi_numbers))
+    return {issi.number: _with_refs(issi) for issi in qs.iterator(chunk_size=2000)}
+
+
+def _with_refs(issi: ISSI) -> tuple[dict[str, Any], set[tuple[str, Any]]]:
+    data = build_enrichment(issi)
+    return data, enrichment_refs(issi, data)
+
+
+def enrichment_refs(issi: ISSI, data: dict[str, Any]) -> set[tuple[str, Any]]:
+    """References (other than the ISSI itself) the enrichment of an ISSI was built from."""
+    refs = set()
+    if issi.customer_id is not None:
+        refs.add(("customers", issi.customer_id))
+    if issi.discipline_id is not None:
+        refs.add(("disciplines", issi.discipline_id))
+    if "radio" in data:
+        refs.add(("radios", data["radio"]["TEI"]))
+    if "vehicle" in data:
+        refs.add(("vehicles", data["vehicle"]["id"]))
+    if "vector" in data:
+        refs.add(("vectors", data["vector"]["resourceCode"]))
+    return refs
+
+
+def referencing_condition(refs: dict[str, Iterable[Any]]) -> Q:
+    """ISSI filter matching the given ISSIs and every ISSI that references the given objects."""
+    condition = Q(number__in=list(refs.get("issis") or ()))
+    if refs.get("radios"):
+        condition |= Q(subscription__radio__in=list(refs["radios"]))
+    if refs.get("vehicles"):
+        vehicles = list(refs["vehicles"])
+        condition |= Q(vehicle__in=vehicles) | Q(subscription__radio__vehicle__in=vehicles)
+    if refs.get("vectors"):
+        vectors = list(refs["vectors"])
+        condition |= Q(vehicle__vector__in=vectors) | Q(subscription__radio__vehicle__vector__in=vectors)
+    if refs.get("customers"):
+        condition |= Q(customer__in=list(refs["customers"]))
+    if refs.get("disciplines"):
+        condition |= Q(discipline__in=list(refs["disciplines"]))
+    return condition
+
+
+class EnrichmentCache:
+    """
+    In-process ISSI → enrichment dict.
+
+    Lookups never hit the database. A reverse index from radios, vehicles and
+    vectors to ISSIs lets a change message refresh exactly the affected ISSIs,
+    including the ones a vehicle or radio was moved away from.
+    """
+
+    def __init__(self, rewarm_seconds: Optional[int] = None):
+        self.rewarm_seconds = (
+            rewarm_seconds if rewarm_seconds is not None else settings.ROIP_ENRICHMENT_REWARM_SECONDS
+        )
+        self._lock = threading.Lock()
+        self._data: dict[int, dict[str, Any]] = {}
+        self._refs_by_issi: dict[int, set[tuple[str, Any]]] = {}
+        self._issis_by_ref: dict[tuple[str, Any], set[int]] = {}
+        self._warmed_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, issi_number: int) -> Optional[dict[str, Any]]:
+        return self._data.get(issi_number)
+
+    def warm(self) -> None:
+        """(Re)load every ISSI in one pass."""
+        loaded = load_enrichments()
+
+        data = {number: item for number, (item, _) in loaded.items()}
+        refs_by_issi = {number: refs for number, (_, refs) in loaded.items()}
+        issis_by_ref: dict[tuple[str, Any], set[int]] = {}
+        for number, refs in refs_by_issi.items():
+            for ref in refs:
+                issis_by_ref.setdefault(ref, set()).add(number)
+
+        with self._lock:
+            self._data = data
+            self._refs_by_issi = refs_by_issi
+            self._issis_by_ref = issis_by_ref
+            self._warmed_at = time.monotonic()
+
+        log.info("Enrichment cache warmed with %s ISSIs", len(data))
+
+    def _set(self, number: int, loaded: Optional[tuple[dict[str, Any], set[tuple[str, Any]]]]) -> None:
+        for ref in self._refs_by_issi.pop(number, ()):
+            issis = self._issis_by_ref.get(ref)
+            if issis is not None:
+                issis.discard(number)
+                if not issis:
+                    del self._issis_by_ref[ref]
+
+        if loaded is None:
+            self._data.pop(number, None)
+            return
+
+        item, refs = loaded
+        self._refs_by_issi[number] = refs
+        for ref in refs:
+            self._issis_by_ref.setdefault(ref, set()).add(number)
+        self._data[number] = item
+
+    def refresh(self, **refs: Iterable[Any]) -> set[int]:
+        """
+        Refresh the ISSIs affected by changed objects, e.g.
+        refresh(vehicles=[12], radios=[75000000001], customers=[3]). Returns the refreshed ISSIs.
+        """
+        refs = {key: set(refs.get(key) or ()) for key in REF_TYPES}
+
+        # ISSIs that currently point at the changed objects
+        affected = set(refs["issis"])
+        for key in REF_TYPES[1:]:
+            for pk in refs[key]:
+                affected |= self._issis_by_ref.get((key, pk), set())
+
+        # ISSIs that point at them in the database now
+        fresh = {
+            issi.number: _with_refs(issi)
+            for issi in enrichment_queryset().filter(referencing_condition(refs))
+        }
+
+        # ISSIs that no longer point at the changed objects still need a fresh
+        # enrichment; the ones not found at all have been deleted.
+        missing = affected - set(fresh)
+        if missing:
+            fresh.update(load_enrichments(missing))
+
+        with self._lock:
+            for number in affected | set(fresh):
+                self._set(number, fresh.get(number))
+
+        return affected | set(fresh)
+
+    def handle_message(self, message: dict[str, Any]) -> None:
+        try:
+            refs = json.loads(message["data"])
+        except (KeyError, TypeError, ValueError):
+            log.warning("Invalid enrichment change message: %r", message)
+            return
+        self.refresh(**{key: refs.get(key) for key in REF_TYPES})
+
+    def listen(self) -> threading.Thread:
+        """Apply change messages from Redis in a daemon thread."""
+        self._thread = threading.Thread(target=self._listen_forever, name="roip-enrichment", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _listen_forever(self) -> None:
+        reconnecting = False
+        while True:
+            try:
+                pubsub = redis_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(settings.ROIP_ENRICHMENT_CHANNEL)
+                if reconnecting or not self._warmed_at:
+                    # Changes may have been missed while we were not subscribed
+                    self.warm()
+                reconnecting = False
+
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    close_old_connections()
+                    if message:
+                        self.handle_message(message)
+                    if self.rewarm_seconds and time.monotonic() - self._warmed_at >= self.rewarm_seconds:
+                        self.warm()
+            except Exception:
+                log.exception("Enrichment listener failed; reconnecting")
+                reconnecting = True
+                time.sleep(5)
+
+
+# ---------------------------------------------------------------- publishing
+
+_redis_client: Optional[redis.Redis] = None
+
+
+def redis_client() -> redis.Redis:
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.ROIP_ENRICHMENT_REDIS_URL,
+            socket_connect_timeout=1,
+            socket_timeout=5,
+        )
+    return _redis_client
+
+
+def _publish(refs: dict[str, list[Any]]) -> None:
+    try:
+        redis_client().publish(settings.ROIP_ENRICHMENT_CHANNEL, json.dumps(refs))
+    except redis.RedisError:
+        # The bridge rewarms periodically, a lost message is not fatal
+        log.warning("Could not publish enrichment change %s", refs)
+
+
+def publish_enrichment_change(**refs: Iterable[Any]) -> None:
+    """
+    Tell the MQTT bridge which objects changed, once the transaction commits.
+    Accepts issis, radios, vehicles, vectors, customers and disciplines.
+    """
+    refs = {key: sorted(set(values)) for key, values in refs.items() if key in REF_TYPES and values}
+    if refs:
+        transaction.on_commit(lambda: _publish(refs))
@@ -0,0 +1,149 @@
+# roip/event_store.py
+"""
+Append-only storage of live TX events.
+
+The bridge hands enriched events to a TxEventWriter, which only puts them on a
+queue. A background thread inserts them with bulk_create every `batch_size`
+events or `flush_interval` seconds, whichever comes first, so the database
+never sits in the path of live delivery.
+"""
+
+from __future__ import annotations
+
+import datetime
+import logging
+import queue
+import threading
+import time
+from typing import Any, Iterable, Mapping, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import TxEvent
+
+log = logging.getLogger(__name__)
+
+
+def _nested(event: Mapping[str, Any], key: str, field: str) -> Any:
+    value = event.get(key)
+    return value.get(field) if isinstance(value, Mapping) else None
+
+
+def _event_time(value: Any) -> datetime.datetime:
+    # RoIP nodes send the event time as epoch seconds
+    try:
+        return datetime.datetime.fromtimestamp(float(value), tz=datetime.timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return timezone.now()
+
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def tx_event_from_payload(event: Mapping[str, Any]) -> TxEvent:
+    issi = event.get("issi")
+    if isinstance(issi, Mapping):
+        issi = issi.get("number")
+
+    try:
+        duration = float(event["duration_s"]) if event.get("duration_s") is not None else None
+    except (TypeError, ValueError):
+        duration = None
+
+    return TxEvent(
+        ts=_event_time(event.get("ts")),
+        event_type=str(event.get("type") or "")[:20],
+        node_id=str(event.get("node_id") or "")[:100],
+        talkgroup=str(event.get("talkgroup") or event.get("gssi") or "")[:100],
+        issi=_int_or_none(issi),
+        alias=str(event.get("alias") or "")[:100],
+        tei=_int_or_none(event.get("TEI")),
+        call_sign=str(_nested(event, "vehicle", "call_sign") or "")[:100],
+        vector=str(_nested(event, "vector", "resourceCode") or "")[:50],
+        duration_s=duration,
+        filename=str(event.get("filename") or "")[:255],
+        data=dict(event),
+    )
+
+
+class TxEventWriter:
+    """
+    Buffers events in memory and writes them in batches from its own thread.
+
+    `add()` never blocks: when the database cannot keep up and `max_pending`
+    events are waiting, new events are counted as dropped instead.
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_pending: int = 50000,
+    ):
+        self.batch_size = batch_size or settings.ROIP_TX_STORE_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.ROIP_TX_STORE_FLUSH_MS / 1000
+        self._queue: queue.Queue = queue.Queue(max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.written = 0
+        self.dropped = 0
+
+    def add(self, events: Iterable[Mapping[str, Any]]) -> None:
+        for event in events:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    log.warning("TX event store is behind; %s events dropped", self.dropped)
+
+    def flush(self, events: list[Mapping[str, Any]]) -> None:
+        if not events:
+            return
+        try:
+            close_old_connections()
+            TxEvent.objects.bulk_create(
+                [tx_event_from_payload(event) for event in events],
+                batch_size=self.batch_size,
+            )
+            self.written += len(events)
+        except Exception:
+            log.exception("Could not store %s TX events", len(events))
+
+    def _next_batch(self) -> list[Mapping[str, Any]]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stopping.is_set() or not self._queue.empty():
+            self.flush(self._next_batch())
+
+    def start(self) -> "TxEventWriter":
+        self._thread = threading.Thread(target=self._run, name="roip-tx-store", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10) -> None:
+        """Write what is still queued and stop the thread."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,109 @@
+# roip/filters.py
+"""
+Server-side filters for the live TX websocket.
+
+A client only receives the events that match its filter, e.g.
+
+    {"action": "filter", "services": ["H1"], "issi_ranges": [[2000000, 2999999]]}
+
+Criteria are combined with AND, the values of one criterion with OR. An empty
+filter lets every event through.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Iterable, Mapping
+from urllib.parse import parse_qs
+
+
+@dataclass(frozen=True)
+class TxEventFilter:
+    disciplines: frozenset[str] = frozenset()
+    services: frozenset[str] = frozenset()
+    vectors: frozenset[str] = frozenset()
+    issi_ranges: tuple[tuple[int, int], ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.disciplines or self.services or self.vectors or self.issi_ranges)
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "TxEventFilter":
+        """Build a filter from a client message; raises ValueError on bad input."""
+        return cls(
+            disciplines=_strings(data.get("disciplines")),
+            services=_strings(data.get("services")),
+            vectors=_strings(data.get("vectors")),
+            issi_ranges=tuple(_issi_range(value) for value in data.get("issi_ranges") or ()),
+        )
+
+    @classmethod
+    def from_query_string(cls, query_string: bytes) -> "TxEventFilter":
+        """
+        Build a filter from the websocket URL, e.g.
+        ?service=H1&service=H2&discipline=Brandweer&issi=2000000-2999999&issi=1234567
+        """
+        params = parse_qs(query_string.decode("latin-1"))
+        return cls.from_dict({
+            "disciplines": params.get("discipline"),
+            "services": params.get("service"),
+            "vectors": params.get("vector"),
+            "issi_ranges": [value.split("-", 1) for value in params.get("issi", ())],
+        })
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "disciplines": sorted(self.disciplines),
+            "services": sorted(self.services),
+            "vectors": sorted(self.vectors),
+            "issi_ranges": [list(r) for r in self.issi_ranges],
+        }
+
+    def matches(self, event: Mapping[str, Any]) -> bool:
+        if self.disciplines and _get(event, "issi", "discipline") not in self.disciplines:
+            return False
+        if self.services and _get(event, "vector", "service") not in self.services:
+            return False
+        if self.vectors and _get(event, "vector", "resourceCode") not in self.vectors:
+            return False
+        if self.issi_ranges:
+            number = _issi_number(event)
+            if number is None or not any(low <= number <= high for low, high in self.issi_ranges):
+                return False
+        return True
+
+
+def _get(event: Mapping[str, Any], key: str, field: str) -> Any:
+    value = event.get(key)
+    return value.get(field) if isinstance(value, Mapping) else None
+
+
+def _issi_number(event: Mapping[str, Any]):
+    # Enriched events carry the ISSI as a dict, unknown ISSIs as the raw number
+    value = event.get("issi")
+    if isinstance(value, Mapping):
+        value = value.get("number")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _strings(values: Iterable[Any] | None) -> frozenset[str]:
+    if values is None:
+        return frozenset()
+    if isinstance(values, str) or not isinstance(values, Iterable):
+        raise ValueError("Expected a list of values")
+    return frozenset(str(value) for value in values)
+
+
+def _issi_range(value: Any) -> tuple[int, int]:
+    if isinstance(value, (list, tuple)) and len(value) == 1:
+        value = (value[0], value[0])
+    try:
+        low, high = (int(v) for v in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid ISSI range: {value!r}")
+    if low > high:
+        raise ValueError(f"Invalid ISSI range: {value!r}")
+    return low, high
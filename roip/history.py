@@ -0,0 +1,129 @@
+# roip/history.py
+"""
+Recent live TX events, kept in a capped Redis stream.
+
+The bridge appends every enriched event before broadcasting it, and the stream
+entry id becomes the event's "seq". An append that takes longer than
+ROIP_HISTORY_APPEND_TIMEOUT_MS is given up on, and the events go out without a
+seq, so a slow Redis never holds up the live stream. LiveTxConsumer sends the most recent
+events when a socket connects, or everything after `?since=<seq>` when a
+browser reconnects, so no events are lost in between.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Any, Iterable, Optional
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+EVENT_FIELD = b"e"
+
+
+def _decode(entries) -> list[dict[str, Any]]:
+    """Stream entries (newest first) → events with their "seq", oldest first."""
+    events = []
+    for seq, fields in reversed(entries):
+        event = json.loads(fields[EVENT_FIELD])
+        event["seq"] = seq.decode()
+        events.append(event)
+    return events
+
+
+class TxHistory:
+    """
+    Ring buffer of the last `maxlen` enriched events.
+
+    Redis errors are logged and otherwise ignored: the live stream keeps
+    flowing, only without sequence numbers or backlog.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        stream: Optional[str] = None,
+        maxlen: Optional[int] = None,
+        backlog: Optional[int] = None,
+        append_timeout: Optional[float] = None,
+    ):
+        self.url = url or settings.ROIP_HISTORY_REDIS_URL
+        self.stream = stream or settings.ROIP_HISTORY_STREAM
+        self.maxlen = maxlen or settings.ROIP_HISTORY_MAXLEN
+        self.backlog_size = backlog or settings.ROIP_HISTORY_BACKLOG
+        self.append_timeout = append_timeout or settings.ROIP_HISTORY_APPEND_TIMEOUT_MS / 1000
+        self._client: Optional[redis.Redis] = None
+        self._async_clients: dict[int, aioredis.Redis] = {}
+
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            # Only used to append, from the send path
+            self._client = redis.Redis.from_url(
+                self.url, socket_connect_timeout=self.append_timeout, socket_timeout=self.append_timeout
+            )
+        return self._client
+
+    def async_client(self) -> aioredis.Redis:
+        # asyncio connections belong to the event loop that opened them
+        loop_id = id(asyncio.get_running_loop())
+        client = self._async_clients.get(loop_id)
+        if client is None:
+            client = aioredis.Redis.from_url(self.url, socket_connect_timeout=1, socket_timeout=2)
+            self._async_clients[loop_id] = client
+        return client
+
+    def _add_all(self, pipe, events: list[dict[str, Any]]) -> None:
+        for event in events:
+            pipe.xadd(
+                self.stream,
+                {EVENT_FIELD: json.dumps(event, separators=(",", ":"))},
+                maxlen=self.maxlen,
+                approximate=True,
+            )
+
+    @staticmethod
+    def _stamp(events: list[dict[str, Any]], ids: Iterable[Any]) -> None:
+        for event, seq in zip(events, ids):
+            event["seq"] = seq.decode() if isinstance(seq, bytes) else seq
+
+    def append(self, events: list[dict[str, Any]]) -> None:
+        """Store events and set their "seq", in one round trip."""
+        try:
+            pipe = self.client().pipeline(transaction=False)
+            self._add_all(pipe, events)
+            self._stamp(events, pipe.execute())
+        except redis.RedisError as e:
+            log.warning("Could not store %s live TX events: %s", len(events), e)
+
+    async def aappend(self, events: list[dict[str, Any]]) -> None:
+        try:
+            pipe = self.async_client().pipeline(transaction=False)
+            self._add_all(pipe, events)
+            self._stamp(events, await asyncio.wait_for(pipe.execute(), self.append_timeout))
+        except asyncio.TimeoutError:
+            log.warning("Storing %s live TX events took over %ss, sent without seq", len(events), self.append_timeout)
+        except redis.RedisError as e:
+            log.warning("Could not store %s live TX events: %s", len(events), e)
+
+    async def abacklog(self, since: Optional[str] = None, limit: Optional[int] = None) -> list[dict[str, Any]]:
+        """
+        The last `limit` events, oldest first, or the events after `since`.
+        When more than `limit` events were missed, only the most recent ones are returned.
+        """
+        limit = limit or self.backlog_size
+        try:
+            entries = await self.async_client().xrevrange(
+                self.stream, max="+", min=f"({since}" if since else "-", count=limit
+            )
+        except redis.RedisError:
+            log.warning("Could not read the live TX history")
+            return []
+        return _decode(entries)
+
+
+tx_history = TxHistory()
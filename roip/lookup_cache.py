@@ -0,0 +1,93 @@
+# roip/lookup_cache.py
+"""
+Cache of rendered ISSI lookup responses.
+
+Entries are keyed by two version tokens: one per ISSI, and one shared by all
+ISSIs. A change to a model shown in the payload (see roip/signals.py) gives
+the ISSIs that reference it a new token once the transaction commits, so a
+sync run only retires the payloads it actually touched. Changes to the lookup
+tables (services, status codes, ...) can affect any ISSI and renew the shared
+token instead.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import uuid
+from typing import Any, Callable, Iterable, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+
+from radio.models import ISSI
+
+from .enrichment import referencing_condition
+
+VERSION_KEY = "roip:issi-payload:version"
+PAYLOAD_CACHE_TIMEOUT = 60 * 60
+
+# Cached for unknown ISSIs, so repeated lookups of a stranger stay cheap too
+NOT_FOUND = b""
+
+
+def _issi_version_key(issi_number: int) -> str:
+    return f"{VERSION_KEY}:{issi_number}"
+
+
+def _new_token() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def _versions(keys: list[str]) -> list[str]:
+    """The token stored under each key, creating the missing (or evicted) ones."""
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_token(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def invalidate_issi_payloads(**refs: Iterable[Any]) -> None:
+    """
+    Retire the cached payloads of the ISSIs referencing the given objects once
+    the current transaction commits, e.g. invalidate_issi_payloads(radios=[75000000001]).
+    """
+    refs = {kind: list(values) for kind, values in refs.items() if values}
+    if refs:
+        transaction.on_commit(lambda: _renew_issi_versions(refs))
+
+
+def invalidate_all_issi_payloads() -> None:
+    """Retire every cached payload once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, _new_token(), None))
+
+
+def _renew_issi_versions(refs: dict[str, list[Any]]) -> None:
+    numbers = set(refs.get("issis", ()))
+    if set(refs) - {"issis"}:
+        condition = referencing_condition({**refs, "issis": ()})
+        numbers.update(ISSI.objects.filter(condition).values_list("number", flat=True))
+
+    if numbers:
+        cache.set_many({_issi_version_key(number): _new_token() for number in numbers}, None)
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def get_issi_payload(issi_number: int, render: Callable[[int], Optional[bytes]]) -> tuple[bytes, str]:
+    """
+    Return (body, etag) for an ISSI, rendering it with `render` on a miss.
+    `render` returns the JSON body, or None for an unknown ISSI (cached as NOT_FOUND).
+    """
+    shared, own = _versions([VERSION_KEY, _issi_version_key(issi_number)])
+    key = f"roip:issi-payload:{shared}:{own}:{issi_number}"
+    entry = cache.get(key)
+    if entry is None:
+        body = render(issi_number)
+        body = NOT_FOUND if body is None else body
+        entry = (body, make_etag(body))
+        cache.set(key, entry, PAYLOAD_CACHE_TIMEOUT)
+    return entry
@@ -0,0 +1,211 @@
+# roip/management/commands/bench_live_tx.py
+"""
+Benchmark the live TX pipeline without a broker or Redis.
+
+Events are handed to the same code the MQTT bridge runs for incoming
+messages, at a fixed rate or as fast as possible, from a thread that stands in
+for the paho network thread. They travel through an in-memory channel layer
+to LiveTxConsumer websockets, and the latency from MQTT receipt to websocket
+send is measured per event.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from typing import Any, Optional
+
+import paho.mqtt.client as mqtt
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from radio.models import ISSI
+from roip.bridge import AsyncBridge
+from roip.consumers import LiveTxConsumer
+from roip.enrichment import EnrichmentCache
+from roip.management.commands.mqtt_to_channels import decode_message, enrich_event, forward_event
+
+BENCH_TOPIC = "roip/bench/events"
+SEQ_FIELD = "bench_seq"
+
+
+def percentile(values: list[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted values."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def synthetic_payloads(count: int) -> list[dict[str, Any]]:
+    """tx_start/tx_stop pairs for ISSIs that exist in the database."""
+    issis = list(ISSI.objects.values_list("number", flat=True)[:1000]) or [random.randint(1000000, 9999999)]
+    payloads = []
+    for i in range(count):
+        issi = issis[(i // 2) % len(issis)]
+        payload = {"type": "tx_start" if i % 2 == 0 else "tx_stop", "node_id": "bench", "issi": issi, "ts": time.time()}
+        if payload["type"] == "tx_stop":
+            payload.update(duration_s=3.2, filename=f"bench-{i}.wav")
+        payloads.append(payload)
+    return payloads
+
+
+def recorded_payloads(path: str) -> list[dict[str, Any]]:
+    """Events recorded from the broker, one JSON object per line."""
+    with open(path, encoding="utf-8") as f:
+        payloads = [json.loads(line) for line in f if line.strip()]
+    if not payloads:
+        raise CommandError(f"No events in {path}")
+    return payloads
+
+
+class Command(BaseCommand):
+    help = "Replay RoIP events through the MQTT bridge and LiveTxConsumer and report latency and throughput."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--events", type=int, default=5000, help="Number of events to publish.")
+        parser.add_argument("--rate", type=float, default=0, help="Events per second; 0 publishes as fast as possible.")
+        parser.add_argument("--payloads", help="JSON lines file with recorded events, replayed in a loop.")
+        parser.add_argument("--clients", type=int, default=1, help="Number of connected websockets.")
+        parser.add_argument("--asyncio", action="store_true", help="Use the asyncio bridge instead of the paho callback path.")
+        parser.add_argument("--no-cache", action="store_true", help="Enrich from the database instead of the enrichment cache.")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--batch-window-ms", type=int, default=20)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for the last deliveries.")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        templates = recorded_payloads(options["payloads"]) if options["payloads"] else synthetic_payloads(1000)
+
+        cache = None
+        if not options["no_cache"]:
+            cache = EnrichmentCache()
+            cache.warm()
+
+        layer = InMemoryChannelLayer(capacity=max(1000, options["events"] * 2))
+        previous = channel_layers.set(DEFAULT_CHANNEL_LAYER, layer)
+        try:
+            report = asyncio.run(self.run(layer, templates, cache, options))
+        finally:
+            if previous is None:
+                channel_layers.backends.pop(DEFAULT_CHANNEL_LAYER, None)
+            else:
+                channel_layers.set(DEFAULT_CHANNEL_LAYER, previous)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report))
+            return
+
+        self.stdout.write(
+            f"{report['mode']}: {report['published']} events to {report['clients']} client(s), "
+            f"{report['delivered']} frames delivered, {report['lost']} lost"
+        )
+        self.stdout.write(
+            f"publish rate {report['publish_rate']:.0f}/s, throughput {report['throughput']:.0f} events/s"
+        )
+        self.stdout.write(
+            "latency ms: p50 {p50_ms} p95 {p95_ms} p99 {p99_ms} max {max_ms}".format(**report)
+        )
+
+    async def run(self, layer, templates, cache, options) -> dict[str, Any]:
+        count = options["events"]
+        group_name = settings.ROIP_CHANNEL_GROUP
+        received_at: list[float] = [0.0] * count
+        sent_at: list[tuple[int, float]] = []
+
+        class BenchConsumer(LiveTxConsumer):
+            history = None
+
+            async def send_json(self, content, close=False):
+                if SEQ_FIELD in content:
+                    sent_at.append((content[SEQ_FIELD], time.perf_counter()))
+                await super().send_json(content, close)
+
+        communicators = []
+        for _ in range(options["clients"]):
+            communicator = ApplicationCommunicator(
+                BenchConsumer.as_asgi(),
+                {"type": "websocket", "path": "/ws/live/tx/", "headers": [], "subprotocols": []},
+            )
+            await communicator.send_input({"type": "websocket.connect"})
+            if (await communicator.receive_output(5))["type"] != "websocket.accept":
+                raise CommandError("LiveTxConsumer refused the websocket")
+            communicators.append(communicator)
+
+        bridge = None
+        bridge_task = None
+        if options["asyncio"]:
+            bridge = AsyncBridge(
+                layer,
+                group_name,
+                lambda payload: enrich_event(payload, cache),
+                queue_size=max(count, 1),
+                batch_size=options["batch_size"],
+                batch_window=options["batch_window_ms"] / 1000,
+                workers=options["workers"],
+                metrics_interval=0,
+            )
+            bridge_task = asyncio.create_task(bridge.run())
+            while bridge.queue is None:
+                await asyncio.sleep(0)
+
+        def on_message(msg: mqtt.MQTTMessage) -> None:
+            payload = decode_message(msg)
+            if bridge is not None:
+                bridge.submit(payload)
+            else:
+                forward_event(layer, group_name, payload, cache)
+
+        def publish() -> float:
+            # Stands in for the paho network thread delivering messages
+            rate = options["rate"]
+            start = time.perf_counter()
+            for seq in range(count):
+                if rate:
+                    delay = start + seq / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                msg = mqtt.MQTTMessage(topic=BENCH_TOPIC.encode())
+                msg.payload = json.dumps({**templates[seq % len(templates)], SEQ_FIELD: seq}).encode()
+                received_at[seq] = time.perf_counter()
+                on_message(msg)
+            return time.perf_counter() - start
+
+        publish_seconds = await sync_to_async(publish, thread_sensitive=False)()
+
+        expected = count * len(communicators)
+        deadline = time.perf_counter() + options["timeout"]
+        while len(sent_at) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+        if bridge_task is not None:
+            bridge_task.cancel()
+        for communicator in communicators:
+            await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+            await communicator.wait(5)
+
+        latencies = sorted(sent - received_at[seq] for seq, sent in sent_at)
+        elapsed = (max(sent for _, sent in sent_at) - received_at[0]) if sent_at else 0.0
+
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "mode": "asyncio" if bridge is not None else "callback",
+            "cache": cache is not None,
+            "clients": len(communicators),
+            "published": count,
+            "delivered": len(sent_at),
+            "lost": expected - len(sent_at),
+            "publish_rate": count / publish_seconds if publish_seconds else 0.0,
+            "throughput": len(sent_at) / len(communicators) / elapsed if elapsed else 0.0,
+            "p50_ms": ms(percentile(latencies, 50)),
+            "p95_ms": ms(percentile(latencies, 95)),
+            "p99_ms": ms(percentile(latencies, 99)),
+            "max_ms": ms(latencies[-1] if latencies else None),
+        }
@@ -2,11 +2,12 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import os
 import time
-from typing import Any
+from typing import Any, Optional
 
 import paho.mqtt.client as mqtt
 from asgiref.sync import async_to_sync
@@ -15,150 +16,92 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 
 
-from fireplan.models import Vehicle, Vector
-from radio.models import ISSI, Subscription
+from roip.bridge import AsyncBridge
+from roip.enrichment import EnrichmentCache, enrichment_queryset, build_enrichment
+from roip.event_store import TxEventWriter
+from roip.history import TxHistory, tx_history
 
 log = logging.getLogger(__name__)
 
 
-def enrich_event(payload: dict[str, Any]) -> dict[str, Any]:
+def enrich_event(payload: dict[str, Any], cache: Optional[EnrichmentCache] = None) -> dict[str, Any]:
+    """
+    Add ISSI, radio, vehicle and vector details to a RoIP event.
+
+    With a warmed EnrichmentCache this does not touch the database; without
+    one the details are loaded with a single query.
+    """
     enriched = dict(payload)
 
     issi_number = payload.get("issi")
     if not issi_number:
         return enriched
 
-    # Best path: subscription exists -> 1 query gets everything (ISSI + Radio + Vehicle + Vector)
-    sub = (
-        Subscription.objects.select_related(
-            "issi",
-            "issi__customer",
-            "issi__discipline",
-            "radio",
-            "radio__model",
-            "radio__vehicle",
-            "radio__vehicle__vector",
-            "radio__vehicle__vector__service",
-            "radio__vehicle__vector__resourceTypeCode",
-            "radio__vehicle__vector__statusCode",
-            "issi__vehicle",
-            "issi__vehicle__vector",
-            "issi__vehicle__vector__service",
-            "issi__vehicle__vector__resourceTypeCode",
-            "issi__vehicle__vector__statusCode",
-        )
-        .filter(issi_id=issi_number)
-        .first()
-    )
-
-    if sub is not None:
-        issi = sub.issi
-        enriched["issi"] = {
-            "number": issi.number,
-            "alias": issi.alias,
-            "customer": getattr(issi.customer, "name", None),
-            "discipline": getattr(issi.discipline, "name", None),
-        }
-        enriched["alias"] = issi.alias
-
-        radio = sub.radio
-        enriched["radio"] = {
-            "TEI": radio.TEI,
-            "tei_str": radio.tei_str,
-            "fireplan_id": radio.fireplan_id,
-            "model": getattr(radio.model, "name", None),
-            "decommissioned": radio.decommissioned,
-            "is_active": radio.is_active,
-            "is_dmo_only": radio.is_DMO_only,
-        }
-        enriched["TEI"] = radio.TEI
-        enriched["fireplan_id"] = radio.fireplan_id
-
-        v: Vehicle | None = getattr(radio, "vehicle", None) or getattr(issi, "vehicle", None)
-        if v is not None:
-            enriched["vehicle"] = {
-                "id": v.id,
-                "number": v.number,
-                "call_sign": v.call_sign,
-                "plate": v.plate,
-                "status": v.status,
-                "utilisation": v.utilisation,
-                "chassis": v.chassis,
-            }
-
-            vec: Vector | None = getattr(v, "vector", None)
-            if vec is not None:
-                sc = vec.statusCode
-                enriched["vector"] = {
-                    "resourceCode": vec.resourceCode,
-                    "name": vec.name,
-                    "abbreviation": vec.abbreviation,
-                    "orderServiceAbbreviation": vec.orderServiceAbbreviation,
-                    "service": getattr(vec.service, "code", None),
-                    "resourceTypeCode": getattr(vec.resourceTypeCode, "code", None),
-                    "statusCode": getattr(sc, "code", None),
-                    "statusDescription": getattr(sc, "description", None),
-                    "statusColor": getattr(sc, "color", None),
-                }
+    if cache is not None:
+        try:
+            data = cache.get(int(issi_number))
+        except (TypeError, ValueError):
+            data = None
+    else:
+        issi = enrichment_queryset().filter(number=issi_number).first()
+        data = build_enrichment(issi) if issi is not None else None
+
+    if data is not None:
+        enriched.update(data)
+    return enriched
 
-        return enriched
 
-    # Fallback: ISSI exists without subscription
-    issi = (
-        ISSI.objects.select_related(
-            "customer",
-            "discipline",
-            "vehicle",
-            "vehicle__vector",
-            "vehicle__vector__service",
-            "vehicle__vector__resourceTypeCode",
-            "vehicle__vector__statusCode",
-        )
-        .filter(number=issi_number)
-        .first()
+def decode_message(msg: mqtt.MQTTMessage) -> Optional[dict[str, Any]]:
+    try:
+        payload = json.loads(msg.payload.decode("utf-8"))
+    except Exception:
+        log.exception("Invalid JSON on %s", msg.topic)
+        return None
+
+    payload["mqtt_topic"] = msg.topic
+    return payload
+
+
+def forward_event(
+    channel_layer,
+    group_name: str,
+    payload: dict[str, Any],
+    cache: Optional[EnrichmentCache],
+    history: Optional[TxHistory] = None,
+    store: Optional[TxEventWriter] = None,
+) -> None:
+    """
+    Enrich one event and send it to the channel group (the non-asyncio path).
+    The event is added to the replay history first and queued for the event store after.
+    """
+    enriched = enrich_event(payload, cache)
+    if history is not None:
+        history.append([enriched])
+
+    async_to_sync(channel_layer.group_send)(
+        group_name,
+        {"type": "tx_event", "data": enriched},
     )
-    if issi is not None:
-        enriched["issi"] = {
-            "number": issi.number,
-            "alias": issi.alias,
-            "customer": getattr(issi.customer, "name", None),
-            "discipline": getattr(issi.discipline, "name", None),
-        }
-        enriched["alias"] = issi.alias
-
-        v: Vehicle | None = getattr(issi, "vehicle", None)
-        if v is not None:
-            enriched["vehicle"] = {
-                "id": v.id,
-                "number": v.number,
-                "call_sign": v.call_sign,
-                "plate": v.plate,
-                "status": v.status,
-                "utilisation": v.utilisation,
-                "chassis": v.chassis,
-            }
-
-            vec: Vector | None = getattr(v, "vector", None)
-            if vec is not None:
-                sc = vec.statusCode
-                enriched["vector"] = {
-                    "resourceCode": vec.resourceCode,
-                    "name": vec.name,
-                    "abbreviation": vec.abbreviation,
-                    "orderServiceAbbreviation": vec.orderServiceAbbreviation,
-                    "service": getattr(vec.service, "code", None),
-                    "resourceTypeCode": getattr(vec.resourceTypeCode, "code", None),
-                    "statusCode": getattr(sc, "code", None),
-                    "statusDescription": getattr(sc, "description", None),
-                    "statusColor": getattr(sc, "color", None),
-                }
-
-    return enriched
+    if store is not None:
+        store.add([enriched])
 
 
 class Command(BaseCommand):
     help = "Subscribe to MQTT RoIP events and forward enriched events to Django Channels."
 
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--asyncio",
+            action="store_true",
+            help="Queue events and send them to the channel layer in batches from an asyncio pipeline.",
+        )
+        parser.add_argument("--queue-size", type=int, default=10000, help="Maximum number of queued events.")
+        parser.add_argument("--batch-size", type=int, default=100, help="Maximum events per group_send.")
+        parser.add_argument(
+            "--batch-window-ms", type=int, default=20, help="How long to wait for more events before sending."
+        )
+        parser.add_argument("--workers", type=int, default=4, help="Enrichment threads.")
+
     def handle(self, *args: Any, **options: Any) -> None:
         mqtt_host = settings.MQTT_HOST
         mqtt_port = settings.MQTT_PORT
@@ -172,6 +115,14 @@ class Command(BaseCommand):
         if channel_layer is None:
             raise RuntimeError("CHANNEL_LAYERS not configured")
 
+        # Warm up front so the first events are enriched; the listener keeps
+        # the cache up to date with changes published by the other processes.
+        cache = EnrichmentCache()
+        cache.warm()
+        cache.listen()
+
+        store = TxEventWriter().start() if settings.ROIP_TX_STORE_ENABLED else None
+
         client = mqtt.Client(client_id=f"ram-mqtt-bridge-{int(time.time())}", clean_session=True)
         if mqtt_user:
             client.username_pw_set(mqtt_user, mqtt_pass)
@@ -185,24 +136,54 @@ class Command(BaseCommand):
             else:
                 log.error("MQTT connect failed rc=%s", rc)
 
-        def on_message(_client: mqtt.Client, _userdata: Any, msg: mqtt.MQTTMessage) -> None:
-            try:
-                payload = json.loads(msg.payload.decode("utf-8"))
-            except Exception:
-                log.exception("Invalid JSON on %s", msg.topic)
-                return
-
-            payload["mqtt_topic"] = msg.topic
-            enriched = enrich_event(payload)
+        client.on_connect = on_connect
 
-            async_to_sync(channel_layer.group_send)(
+        if options["asyncio"]:
+            bridge = AsyncBridge(
+                channel_layer,
                 group_name,
-                {"type": "tx_event", "data": enriched},
+                lambda payload: enrich_event(payload, cache),
+                queue_size=options["queue_size"],
+                batch_size=options["batch_size"],
+                batch_window=options["batch_window_ms"] / 1000,
+                workers=options["workers"],
+                history=tx_history,
+                store=store,
             )
 
-        client.on_connect = on_connect
+            def on_message(_client: mqtt.Client, _userdata: Any, msg: mqtt.MQTTMessage) -> None:
+                payload = decode_message(msg)
+                if payload is not None:
+                    bridge.submit(payload)
+
+            def start_mqtt() -> None:
+                log.info("Connecting to MQTT %s:%s", mqtt_host, mqtt_port)
+                client.connect(mqtt_host, mqtt_port, keepalive=30)
+                # The network thread hands messages over to the event loop
+                client.loop_start()
+
+            client.on_message = on_message
+            try:
+                asyncio.run(bridge.run(started=start_mqtt))
+            finally:
+                client.loop_stop()
+                if store is not None:
+                    store.stop()
+            return
+
+        def on_message(_client: mqtt.Client, _userdata: Any, msg: mqtt.MQTTMessage) -> None:
+            payload = decode_message(msg)
+            if payload is None:
+                return
+
+            forward_event(channel_layer, group_name, payload, cache, tx_history, store)
+
         client.on_message = on_message
 
         log.info("Connecting to MQTT %s:%s", mqtt_host, mqtt_port)
         client.connect(mqtt_host, mqtt_port, keepalive=30)
-        client.loop_forever()
+        try:
+            client.loop_forever()
+        finally:
+            if store is not None:
+                store.stop()
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ts', models.DateTimeField()),
+                ('event_type', models.CharField(blank=True, max_length=20)),
+                ('node_id', models.CharField(blank=True, max_length=100)),
+                ('talkgroup', models.CharField(blank=True, max_length=100)),
+                ('issi', models.BigIntegerField(blank=True, null=True)),
+                ('alias', models.CharField(blank=True, max_length=100)),
+                ('tei', models.BigIntegerField(blank=True, null=True)),
+                ('call_sign', models.CharField(blank=True, max_length=100)),
+                ('vector', models.CharField(blank=True, max_length=50)),
+                ('duration_s', models.FloatField(blank=True, null=True)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('data', models.JSONField(default=dict)),
+            ],
+            options={
+                'ordering': ['-ts', '-id'],
+                'indexes': [models.Index(fields=['ts', 'id'], name='roip_txevent_ts_idx'), models.Index(fields=['issi', 'ts'], name='roip_txevent_issi_ts_idx'), models.Index(fields=['vector', 'ts'], name='roip_txevent_vector_ts_idx'), models.Index(fields=['talkgroup', 'ts'], name='roip_txevent_tg_ts_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,58 @@
 from django.db import models
 
-# Create your models here.
+
+class TxEvent(models.Model):
+    """
+    One PTT event as forwarded by the MQTT bridge.
+
+    Rows are only inserted (in batches, see roip.event_store) and removed by
+    age; the enriched event as sent to the browsers is kept in `data`.
+    """
+
+    ts = models.DateTimeField()
+    event_type = models.CharField(max_length=20, blank=True)
+    node_id = models.CharField(max_length=100, blank=True)
+    talkgroup = models.CharField(max_length=100, blank=True)
+
+    issi = models.BigIntegerField(null=True, blank=True)
+    alias = models.CharField(max_length=100, blank=True)
+    tei = models.BigIntegerField(null=True, blank=True)
+    call_sign = models.CharField(max_length=100, blank=True)
+    vector = models.CharField(max_length=50, blank=True)
+
+    duration_s = models.FloatField(null=True, blank=True)
+    filename = models.CharField(max_length=255, blank=True)
+
+    data = models.JSONField(default=dict)
+
+    class Meta:
+        ordering = ["-ts", "-id"]
+        indexes = [
+            models.Index(fields=["ts", "id"], name="roip_txevent_ts_idx"),
+            models.Index(fields=["issi", "ts"], name="roip_txevent_issi_ts_idx"),
+            models.Index(fields=["vector", "ts"], name="roip_txevent_vector_ts_idx"),
+            models.Index(fields=["talkgroup", "ts"], name="roip_txevent_tg_ts_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.ts:%Y-%m-%d %H:%M:%S} {self.event_type} ISSI {self.issi}"
+
+
+class DirectoryChange(models.Model):
+    """
+    One changed object in the ISSI directory, recorded by roip.signals.
+
+    The id doubles as the directory version handed out by the snapshot export:
+    a client that last synced at version N asks for `since=N` and gets the
+    ISSIs that reference any object changed after it. See
+    roip.snapshot.current_version for why the version lags the newest id.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    # One of roip.snapshot.CHANGE_KINDS, and the primary key of the changed object
+    kind = models.CharField(max_length=20)
+    key = models.CharField(max_length=50)
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} {self.key}"
@@ -0,0 +1,110 @@
+# roip/signals.py
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from fireplan.models import ResourceTypeCode, Service, StatusCode, Vector, Vehicle
+from radio.models import ISSI, Customer, Discipline, Radio, Subscription
+from roip.enrichment import publish_enrichment_change
+from roip.lookup_cache import invalidate_all_issi_payloads, invalidate_issi_payloads
+from roip.snapshot import record_directory_change
+
+# Links that can move to another object; the old target changes too
+PREVIOUS_LINKS = {
+    Subscription: ("issi_id", "radio_id"),
+    Vehicle: ("radio_id", "issi_id"),
+    Vector: ("vehicle_id",),
+}
+
+
+def directory_changed(**refs: Iterable[Any]) -> None:
+    """
+    Tell the RoIP lookup cache, the MQTT bridge and the snapshot change log
+    which ISSIs, radios, vehicles, vectors, customers or disciplines changed.
+    Code that writes with bulk queries (and so skips these signals) calls this itself.
+    """
+    refs = {key: [value for value in values if value is not None] for key, values in refs.items()}
+    invalidate_issi_payloads(**refs)
+    publish_enrichment_change(**refs)
+    record_directory_change(**refs)
+
+
+def _previous(instance, field: str) -> list[Any]:
+    return [getattr(instance, "_roip_previous_links", {}).get(field)]
+
+
+@receiver(pre_save, sender=Subscription)
+@receiver(pre_save, sender=Vehicle)
+@receiver(pre_save, sender=Vector)
+def remember_previous_links(sender, instance, **kwargs) -> None:
+    if instance._state.adding:
+        return
+    instance._roip_previous_links = (
+        sender.objects.filter(pk=instance.pk).values(*PREVIOUS_LINKS[sender]).first() or {}
+    )
+
+
+@receiver(post_save, sender=ISSI)
+@receiver(post_delete, sender=ISSI)
+def on_issi_changed(sender, instance: ISSI, **kwargs) -> None:
+    directory_changed(issis=[instance.number])
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def on_subscription_changed(sender, instance: Subscription, **kwargs) -> None:
+    directory_changed(
+        issis=[instance.issi_id] + _previous(instance, "issi_id"),
+        radios=[instance.radio_id] + _previous(instance, "radio_id"),
+    )
+
+
+@receiver(post_save, sender=Radio)
+@receiver(post_delete, sender=Radio)
+def on_radio_changed(sender, instance: Radio, **kwargs) -> None:
+    directory_changed(radios=[instance.TEI])
+
+
+@receiver(post_save, sender=Vehicle)
+@receiver(post_delete, sender=Vehicle)
+def on_vehicle_changed(sender, instance: Vehicle, **kwargs) -> None:
+    directory_changed(
+        vehicles=[instance.pk],
+        radios=[instance.radio_id] + _previous(instance, "radio_id"),
+        issis=[instance.issi_id] + _previous(instance, "issi_id"),
+    )
+
+
+@receiver(post_save, sender=Vector)
+@receiver(post_delete, sender=Vector)
+def on_vector_changed(sender, instance: Vector, **kwargs) -> None:
+    directory_changed(
+        vectors=[instance.pk],
+        vehicles=[instance.vehicle_id] + _previous(instance, "vehicle_id"),
+    )
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def on_customer_changed(sender, instance: Customer, **kwargs) -> None:
+    directory_changed(customers=[instance.pk])
+
+
+@receiver(post_save, sender=Discipline)
+@receiver(post_delete, sender=Discipline)
+def on_discipline_changed(sender, instance: Discipline, **kwargs) -> None:
+    directory_changed(disciplines=[instance.pk])
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=ResourceTypeCode)
+@receiver(post_delete, sender=ResourceTypeCode)
+@receiver(post_save, sender=StatusCode)
+@receiver(post_delete, sender=StatusCode)
+def on_lookup_detail_changed(sender, instance, **kwargs) -> None:
+    # Shown in the ISSI lookup payload only; the bridge picks these up when it rewarms
+    invalidate_all_issi_payloads()
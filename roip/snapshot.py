@@ -0,0 +1,230 @@
+# roip/snapshot.py
+"""
+Streamed export of the whole ISSI directory for RoIP.
+
+Rows are built from a single values() query read with iterator(), which uses
+a server-side cursor on PostgreSQL, and are encoded and (optionally) gzipped
+one at a time, so memory stays flat however large the directory is.
+
+Every change to an object shown in a row is recorded as a DirectoryChange
+(see roip/signals.py). Its id is the directory version: `since=N` exports only
+the ISSIs that reference an object changed after version N, plus a
+`{"issi": ..., "deleted": true}` line for each ISSI that no longer exists.
+
+The changes are written in the same transaction as the data, so ids are handed
+out long before they commit and a lower id can become visible after a higher
+one. The version handed to clients therefore stops at the changes older than
+ROIP_DIRECTORY_VERSION_LAG_SECONDS, which have all committed; newer ones are
+picked up by the next sync. The lag must exceed the longest transaction that
+writes directory data.
+"""
+
+from __future__ import annotations
+
+import json
+import zlib
+from typing import Any, Iterable, Iterator, Optional
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from radio.models import ISSI
+
+from .enrichment import REF_TYPES, referencing_condition
+from .models import DirectoryChange
+
+SNAPSHOT_CHUNK_SIZE = 2000
+
+# Reference types a DirectoryChange can have
+CHANGE_KINDS = REF_TYPES
+INTEGER_KINDS = {"issis", "radios", "vehicles", "customers", "disciplines"}
+
+RADIO = "subscription__radio__"
+# A vehicle is linked through the radio, or straight to the ISSI
+VEHICLE_PREFIXES = ("subscription__radio__vehicle__", "vehicle__")
+VEHICLE_FIELDS = (
+    "id",
+    "number",
+    "call_sign",
+    "plate",
+    "status",
+    "vector__resourceCode",
+    "vector__name",
+    "vector__abbreviation",
+    "vector__statusCode",
+)
+
+SNAPSHOT_VALUES = (
+    "number",
+    "alias",
+    "customer__name",
+    "discipline__name",
+    "subscription__active",
+    "subscription__DMO_only",
+    RADIO + "TEI",
+    RADIO + "fireplan_id",
+    RADIO + "model__name",
+    RADIO + "decommissioned",
+) + tuple(prefix + field for prefix in VEHICLE_PREFIXES for field in VEHICLE_FIELDS)
+
+
+# ---------------------------------------------------------------- versions
+
+def record_directory_change(**refs: Iterable[Any]) -> None:
+    """
+    Record changed objects, e.g. record_directory_change(issis=[1234567], radios=[75000000001]).
+    Written in the caller's transaction, so the log commits or rolls back with the change itself.
+    """
+    changes = [
+        DirectoryChange(kind=kind, key=str(key))
+        for kind in CHANGE_KINDS
+        for key in sorted(set(refs.get(kind) or ()), key=str)
+    ]
+    if changes:
+        DirectoryChange.objects.bulk_create(changes)
+
+
+def current_version() -> int:
+    """The newest change id below which no change can still become visible."""
+    lag = settings.ROIP_DIRECTORY_VERSION_LAG_SECONDS
+    if not lag:
+        return DirectoryChange.objects.aggregate(version=Max("id"))["version"] or 0
+
+    cutoff = timezone.now() - timedelta(seconds=lag)
+    versions = DirectoryChange.objects.aggregate(
+        settled=Max("id", filter=Q(changed_at__lte=cutoff)),
+        oldest=Min("id"),
+    )
+    if versions["settled"] is not None:
+        return versions["settled"]
+    # Only recent changes: everything before the oldest one was purged
+    return versions["oldest"] - 1 if versions["oldest"] is not None else 0
+
+
+def is_version_available(since: int) -> bool:
+    """False when changes after `since` may have been purged already."""
+    oldest = DirectoryChange.objects.aggregate(oldest=Min("id"))["oldest"]
+    return oldest is None or since >= oldest - 1
+
+
+def changed_refs(since: int, version: int) -> dict[str, set[Any]]:
+    refs: dict[str, set[Any]] = {kind: set() for kind in CHANGE_KINDS}
+    changes = (
+        DirectoryChange.objects.filter(id__gt=since, id__lte=version)
+        .values_list("kind", "key")
+        .distinct()
+    )
+    for kind, key in changes.iterator(chunk_size=SNAPSHOT_CHUNK_SIZE):
+        if kind in refs:
+            refs[kind].add(int(key) if kind in INTEGER_KINDS else key)
+    return refs
+
+
+# ---------------------------------------------------------------- rows
+
+def snapshot_row(values: dict[str, Any]) -> dict[str, Any]:
+    """One export line from a SNAPSHOT_VALUES dict."""
+    tei = values[RADIO + "TEI"]
+    radio = None
+    if tei is not None:
+        active = values["subscription__active"]
+        dmo_only = values["subscription__DMO_only"]
+        decommissioned = values[RADIO + "decommissioned"]
+        radio = {
+            "tei": tei,
+            "tei_15": f"{tei:015d}",
+            "fireplan_id": values[RADIO + "fireplan_id"],
+            "model": values[RADIO + "model__name"],
+            "decommissioned": decommissioned,
+            # Same rules as Radio.is_active and Radio.is_DMO_only
+            "is_active": active and not dmo_only and not decommissioned,
+            "is_dmo_only": dmo_only and not decommissioned,
+        }
+
+    # Like the lookup API: the radio's vehicle when there is a radio, else the ISSI's
+    prefix = VEHICLE_PREFIXES[0] if tei is not None else VEHICLE_PREFIXES[1]
+    vehicle = vector = None
+    if values[prefix + "id"] is not None:
+        vehicle = {
+            "id": values[prefix + "id"],
+            "number": values[prefix + "number"],
+            "call_sign": values[prefix + "call_sign"],
+            "plate": values[prefix + "plate"],
+            "status": values[prefix + "status"],
+        }
+        if values[prefix + "vector__resourceCode"] is not None:
+            vector = {
+                "resource_code": values[prefix + "vector__resourceCode"],
+                "name": values[prefix + "vector__name"],
+                "abbreviation": values[prefix + "vector__abbreviation"],
+                "status": values[prefix + "vector__statusCode"],
+            }
+
+    return {
+        "issi": values["number"],
+        "alias": values["alias"],
+        "customer": values["customer__name"],
+        "discipline": values["discipline__name"],
+        "radio": radio,
+        "vehicle": vehicle,
+        "vector": vector,
+    }
+
+
+def iter_snapshot(since: Optional[int] = None, version: Optional[int] = None) -> Iterator[dict[str, Any]]:
+    """All directory rows, or only the ones changed after version `since`."""
+    qs = ISSI.objects.order_by("number")
+    deleted: list[int] = []
+
+    if since is not None:
+        refs = changed_refs(since, current_version() if version is None else version)
+        qs = qs.filter(referencing_condition(refs))
+
+        if refs["issis"]:
+            existing = set(ISSI.objects.filter(number__in=refs["issis"]).values_list("number", flat=True))
+            deleted = sorted(refs["issis"] - existing)
+
+    for values in qs.values(*SNAPSHOT_VALUES).iterator(chunk_size=SNAPSHOT_CHUNK_SIZE):
+        yield snapshot_row(values)
+    for number in deleted:
+        yield {"issi": number, "deleted": True}
+
+
+# ---------------------------------------------------------------- encoding
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"))
+
+
+def iter_ndjson(rows: Iterable[dict[str, Any]]) -> Iterator[bytes]:
+    for row in rows:
+        yield (_dumps(row) + "\n").encode()
+
+
+def iter_json(rows: Iterable[dict[str, Any]], version: int, since: Optional[int]) -> Iterator[bytes]:
+    """One JSON document, {"version": ..., "since": ..., "items": [...]}, written row by row."""
+    yield ('{"version":%d,"since":%s,"items":[' % (version, _dumps(since))).encode()
+    separator = ""
+    for row in rows:
+        yield (separator + _dumps(row)).encode()
+        separator = ","
+    yield b"]}"
+
+
+def iter_gzip(chunks: Iterable[bytes], flush_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Gzip a byte stream, yielding compressed data about every `flush_size` input bytes."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_size:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
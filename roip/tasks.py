@@ -0,0 +1,51 @@
+# roip/tasks.py
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DirectoryChange, TxEvent
+
+log = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 10000
+
+
+@shared_task
+def purge_tx_events(days: Optional[int] = None) -> int:
+    """Delete TX events older than ROIP_TX_RETENTION_DAYS, oldest first and in chunks."""
+    cutoff = timezone.now() - timedelta(days=days or settings.ROIP_TX_RETENTION_DAYS)
+
+    deleted = 0
+    while True:
+        ids = list(
+            TxEvent.objects.filter(ts__lt=cutoff).order_by("ts").values_list("id", flat=True)[:PURGE_BATCH_SIZE]
+        )
+        if not ids:
+            break
+        count, _ = TxEvent.objects.filter(id__in=ids).delete()
+        deleted += count
+
+    log.info("Purged %s TX events older than %s", deleted, cutoff)
+    return deleted
+
+
+@shared_task
+def purge_directory_changes(days: Optional[int] = None) -> int:
+    """
+    Forget directory changes older than ROIP_DIRECTORY_CHANGE_RETENTION_DAYS.
+    The newest change is always kept, it holds the current directory version.
+    """
+    cutoff = timezone.now() - timedelta(days=days or settings.ROIP_DIRECTORY_CHANGE_RETENTION_DAYS)
+    newest = DirectoryChange.objects.order_by("-id").values_list("id", flat=True).first()
+    if newest is None:
+        return 0
+
+    deleted, _ = DirectoryChange.objects.filter(changed_at__lt=cutoff, id__lt=newest).delete()
+    log.info("Purged %s directory changes older than %s", deleted, cutoff)
+    return deleted
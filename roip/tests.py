@@ -1,8 +1,41 @@
+import asyncio
+import datetime
+import gzip
+import json
+from io import StringIO
+from unittest import mock
+
+import redis
+import requests
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 from fireplan.models import ResourceTypeCode, Service, StatusCode, Vector, Vehicle, VehicleStatus
-from radio.models import ISSI, Radio, RadioModel, Subscription, TEIRange
+from radio.models import ISSI, Customer, Radio, RadioModel, Subscription, TEIRange
+from radio.services.range_index import issi_range_resolver, tei_range_index
+from RadioAssetManagement.tasks import (
+    FLUSH_LOCK_KEY,
+    OUTBOX_KEY,
+    PROCESSING_KEY,
+    enqueue_roip_sync_for_tei,
+    flush_roip_outbox,
+)
+from roip.bridge import AsyncBridge
+from roip.consumers import LiveTxConsumer
+from roip.enrichment import EnrichmentCache
+from roip.event_store import TxEventWriter, tx_event_from_payload
+from roip.history import TxHistory
+from roip.management.commands.mqtt_to_channels import enrich_event
+from roip.models import DirectoryChange, TxEvent
+from roip.signals import directory_changed
+from roip.snapshot import record_directory_change
+from roip.tasks import purge_directory_changes, purge_tx_events
 
 
 @override_settings(ROIP_API_KEYS=["test-key"])
@@ -102,6 +135,110 @@ class IssiLookupApiTests(TestCase):
 
         self.assertEqual(response.status_code, 401)
 
+    def test_repeated_lookup_is_served_from_cache(self):
+        self.addCleanup(cache.clear)
+        url = reverse("roip_api:issi_lookup", kwargs={"issi": "1234567"})
+
+        first = self.client.get(url, HTTP_X_API_KEY="test-key")
+        with self.assertNumQueries(0):
+            second = self.client.get(url, HTTP_X_API_KEY="test-key")
+
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(second["Cache-Control"], "no-cache")
+
+    def test_if_none_match_returns_not_modified(self):
+        self.addCleanup(cache.clear)
+        url = reverse("roip_api:issi_lookup", kwargs={"issi": "1234567"})
+        etag = self.client.get(url, HTTP_X_API_KEY="test-key")["ETag"]
+
+        response = self.client.get(url, HTTP_X_API_KEY="test-key", HTTP_IF_NONE_MATCH=f'"stale", {etag}')
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    def test_change_invalidates_cached_lookup(self):
+        self.addCleanup(cache.clear)
+        url = reverse("roip_api:issi_lookup", kwargs={"issi": "1234567"})
+        etag = self.client.get(url, HTTP_X_API_KEY="test-key")["ETag"]
+
+        with mock.patch("roip.enrichment.redis_client"), self.captureOnCommitCallbacks(execute=True):
+            self.issi.alias = "P102"
+            self.issi.save()
+        response = self.client.get(url, HTTP_X_API_KEY="test-key", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["issi"]["alias"], "P102")
+
+    def test_change_keeps_other_cached_lookups(self):
+        self.addCleanup(cache.clear)
+        ISSI.objects.create(number=2345678, alias="A106")
+        url = reverse("roip_api:issi_lookup", kwargs={"issi": "2345678"})
+        self.client.get(url, HTTP_X_API_KEY="test-key")
+        radio_url = reverse("roip_api:issi_lookup", kwargs={"issi": "1234567"})
+        self.client.get(radio_url, HTTP_X_API_KEY="test-key")
+
+        with mock.patch("roip.enrichment.redis_client"), self.captureOnCommitCallbacks(execute=True):
+            Radio.objects.filter(TEI=self.radio.TEI).update(decommissioned=True)
+            directory_changed(radios=[self.radio.TEI])
+
+        with self.assertNumQueries(0):
+            self.client.get(url, HTTP_X_API_KEY="test-key")
+        self.assertTrue(self.client.get(radio_url, HTTP_X_API_KEY="test-key").json()["radio"]["decommissioned"])
+
+    def test_unknown_issi_stays_not_found_when_cached(self):
+        self.addCleanup(cache.clear)
+        url = reverse("roip_api:issi_lookup", kwargs={"issi": "7654321"})
+
+        self.client.get(url, HTTP_X_API_KEY="test-key")
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_X_API_KEY="test-key")
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_bulk_lookup_resolves_many_issis_in_one_query(self):
+        ISSI.objects.create(number=2345678, alias="A106")
+
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                reverse("roip_api:issi_bulk_lookup"),
+                json.dumps({"issis": [1234567, "2345678", 7654321, 1234567]}),
+                content_type="application/json",
+                HTTP_X_API_KEY="test-key",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(list(data["results"]), ["1234567", "2345678"])
+        self.assertEqual(data["not_found"], [7654321])
+
+        single = self.client.get(
+            reverse("roip_api:issi_lookup", kwargs={"issi": "1234567"}),
+            HTTP_X_API_KEY="test-key",
+        )
+        self.assertEqual(data["results"]["1234567"], single.json())
+
+    def test_bulk_lookup_accepts_query_string(self):
+        response = self.client.get(
+            reverse("roip_api:issi_bulk_lookup"),
+            {"issi": "1234567,7654321"},
+            HTTP_X_API_KEY="test-key",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["not_found"], [7654321])
+
+    def test_bulk_lookup_rejects_bad_input(self):
+        url = reverse("roip_api:issi_bulk_lookup")
+        post = lambda body: self.client.post(url, body, content_type="application/json", HTTP_X_API_KEY="test-key")
+
+        self.assertEqual(post(json.dumps({"issis": ["abc"]})).status_code, 400)
+        self.assertEqual(post(json.dumps({"issis": list(range(501))})).status_code, 400)
+        self.assertEqual(post("not json").status_code, 400)
+        self.assertEqual(self.client.post(url, "{}", content_type="application/json").status_code, 401)
+
     def test_returns_404_for_unknown_issi(self):
         response = self.client.get(
             reverse("roip_api:issi_lookup", kwargs={"issi": "7654321"}),
@@ -109,3 +246,825 @@ class IssiLookupApiTests(TestCase):
         )
 
         self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ROIP_ENRICHMENT_CHANNEL="roip:enrichment")
+class EnrichmentCacheTests(TestCase):
+    def setUp(self):
+        self.addCleanup(tei_range_index.invalidate)
+        self.addCleanup(issi_range_resolver.invalidate)
+
+        model = RadioModel.objects.create(name="MTP850", radio_type=RadioModel.RadioType.MOBILE)
+        TEIRange.objects.create(model=model, min_tei=75000000000, max_tei=75999999999)
+
+        self.issi = ISSI.objects.create(number=1234567, alias="P101")
+        self.radio = Radio.objects.create(TEI=75000000001)
+        Subscription.objects.create(issi=self.issi, radio=self.radio, astrid_alias="ASTRID P101")
+
+        self.vehicle = Vehicle.objects.create(
+            number="P101 - Autopomp",
+            num_letter="P",
+            num_value=101,
+            status=VehicleStatus.ACTIF,
+            radio=self.radio,
+        )
+        status = StatusCode.objects.create(code="AVL", description="Available", color="#00AA00")
+        Vector.objects.create(resourceCode="P101", vehicle=self.vehicle, name="Autopomp 101", statusCode=status)
+
+        self.bare_issi = ISSI.objects.create(number=2345678, alias="A106")
+
+        self.cache = EnrichmentCache(rewarm_seconds=0)
+        self.cache.warm()
+
+    def test_cached_enrichment_matches_database_path(self):
+        for number in (1234567, 2345678, 9999999):
+            payload = {"issi": number, "mqtt_topic": "roip/gw1/events"}
+            self.assertEqual(enrich_event(payload, self.cache), enrich_event(payload))
+
+        enriched = enrich_event({"issi": 1234567}, self.cache)
+        self.assertEqual(enriched["TEI"], 75000000001)
+        self.assertEqual(enriched["vehicle"]["id"], self.vehicle.id)
+        self.assertEqual(enriched["vector"]["statusCode"], "AVL")
+
+    def test_cached_enrichment_does_not_query(self):
+        with self.assertNumQueries(0):
+            enrich_event({"issi": 1234567}, self.cache)
+            enrich_event({"issi": "2345678"}, self.cache)
+
+    def test_refresh_follows_vehicle_moved_to_other_issi(self):
+        self.vehicle.radio = None
+        self.vehicle.issi = self.bare_issi
+        self.vehicle.save()
+
+        refreshed = self.cache.refresh(vehicles=[self.vehicle.pk], issis=[self.bare_issi.number])
+
+        self.assertEqual(refreshed, {1234567, 2345678})
+        self.assertNotIn("vehicle", self.cache.get(1234567))
+        self.assertEqual(self.cache.get(2345678)["vector"]["resourceCode"], "P101")
+
+    def test_refresh_drops_deleted_issi(self):
+        self.bare_issi.delete()
+
+        self.cache.refresh(issis=[2345678])
+
+        self.assertIsNone(self.cache.get(2345678))
+
+    def test_handle_message_refreshes_cache(self):
+        Vector.objects.filter(pk="P101").update(name="Autopomp 102")
+
+        self.cache.handle_message({"data": json.dumps({"vectors": ["P101"]})})
+
+        self.assertEqual(self.cache.get(1234567)["vector"]["name"], "Autopomp 102")
+
+    def test_customer_rename_reaches_cached_enrichments(self):
+        customer = Customer.objects.create(name="Brandweer")
+        ISSI.objects.filter(number=1234567).update(customer=customer)
+        self.cache.warm()
+
+        with mock.patch("roip.enrichment.redis_client") as redis_client:
+            with self.captureOnCommitCallbacks(execute=True):
+                customer.name = "Brandweer Brussel"
+                customer.save()
+        redis_client.return_value.publish.assert_called_once_with(
+            "roip:enrichment", json.dumps({"customers": [customer.pk]}),
+        )
+
+        self.cache.handle_message({"data": redis_client.return_value.publish.call_args.args[1]})
+
+        self.assertEqual(self.cache.get(1234567)["issi"]["customer"], "Brandweer Brussel")
+
+    def test_save_publishes_change_after_commit(self):
+        with mock.patch("roip.enrichment.redis_client") as redis_client:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.vehicle.save()
+
+        redis_client.return_value.publish.assert_called_once_with(
+            "roip:enrichment",
+            json.dumps({"vehicles": [self.vehicle.pk], "radios": [75000000001]}),
+        )
+
+
+class AsyncBridgeTests(TestCase):
+    def run_bridge(self, bridge, scenario):
+        async def main():
+            runner = asyncio.create_task(bridge.run())
+            while bridge.queue is None:
+                await asyncio.sleep(0)
+            try:
+                return await scenario()
+            finally:
+                runner.cancel()
+
+        return asyncio.run(main())
+
+    def test_sends_events_in_order_in_batches(self):
+        layer = InMemoryChannelLayer()
+        bridge = AsyncBridge(
+            layer, "live_tx", lambda payload: {**payload, "enriched": True},
+            batch_size=50, batch_window=0.05, workers=2, metrics_interval=0,
+        )
+
+        async def scenario():
+            channel = await layer.new_channel()
+            await layer.group_add("live_tx", channel)
+
+            def mqtt_thread():
+                for n in range(120):
+                    bridge.submit({"issi": n})
+
+            # The MQTT network thread submits from outside the event loop
+            await asyncio.get_running_loop().run_in_executor(None, mqtt_thread)
+
+            events = []
+            messages = 0
+            while len(events) < 120:
+                message = await asyncio.wait_for(layer.receive(channel), 1)
+                self.assertEqual(message["type"], "tx_events")
+                events.extend(message["events"])
+                messages += 1
+            return events, messages
+
+        events, messages = self.run_bridge(bridge, scenario)
+
+        self.assertEqual([event["issi"] for event in events], list(range(120)))
+        self.assertTrue(all(event["enriched"] for event in events))
+        self.assertLess(messages, 120)
+        self.assertEqual(bridge.metrics.sent, 120)
+        self.assertEqual(bridge.metrics.snapshot(0)["received"], 120)
+
+    def test_batches_are_stored_in_history_before_sending(self):
+        layer = InMemoryChannelLayer()
+        history = FakeRedisStream(asynchronous=True)
+        tx_history = TxHistory(url="redis://unused", stream="test", maxlen=100, backlog=10)
+        bridge = AsyncBridge(layer, "live_tx", lambda payload: payload, workers=1, metrics_interval=0, history=tx_history)
+
+        async def scenario():
+            channel = await layer.new_channel()
+            await layer.group_add("live_tx", channel)
+            await bridge.put((0.0, {"issi": 1}))
+            return await asyncio.wait_for(layer.receive(channel), 1)
+
+        with mock.patch.object(tx_history, "async_client", return_value=history):
+            message = self.run_bridge(bridge, scenario)
+
+        self.assertEqual(message["events"], [{"issi": 1, "seq": "1700000000000-1"}])
+
+    def test_full_queue_drops_oldest_event(self):
+        bridge = AsyncBridge(
+            InMemoryChannelLayer(), "live_tx", lambda payload: payload,
+            queue_size=2, put_timeout=0.01, workers=1, metrics_interval=0,
+        )
+
+        async def scenario():
+            # Only the queue, no pipeline draining it
+            bridge.queue = asyncio.Queue(bridge.queue_size)
+            for n in range(4):
+                await bridge.put((0.0, {"issi": n}))
+            return [bridge.queue.get_nowait()[1]["issi"] for _ in range(bridge.queue.qsize())]
+
+        self.assertEqual(asyncio.run(scenario()), [2, 3])
+        self.assertEqual(bridge.metrics.dropped, 2)
+        self.assertEqual(bridge.metrics.max_queue_depth, 2)
+
+
+class FakeRedisStream:
+    """Just enough of a Redis stream for TxHistory, sync and asyncio."""
+
+    def __init__(self, asynchronous=False, delay=0):
+        self.entries = []
+        self.counter = 0
+        self.asynchronous = asynchronous
+        self.delay = delay
+
+    def pipeline(self, transaction=True):
+        stream = self
+        results = []
+
+        class Pipeline:
+            def xadd(self, name, fields, maxlen=None, approximate=True):
+                results.append(stream._xadd(fields, maxlen))
+
+            def execute(self):
+                if stream.asynchronous:
+                    async def done():
+                        await asyncio.sleep(stream.delay)
+                        return results
+                    return done()
+                return results
+
+        return Pipeline()
+
+    def _xadd(self, fields, maxlen):
+        self.counter += 1
+        seq = f"1700000000000-{self.counter}".encode()
+        self.entries.append((seq, dict(fields)))
+        if maxlen:
+            del self.entries[:-maxlen]
+        return seq
+
+    async def xrevrange(self, name, max="+", min="-", count=None):
+        def key(seq):
+            ms, n = seq.split("-")
+            return int(ms), int(n)
+
+        entries = self.entries
+        if min.startswith("("):
+            entries = [e for e in entries if key(e[0].decode()) > key(min[1:])]
+        return list(reversed(entries))[:count]
+
+
+class TxHistoryTests(TestCase):
+    def setUp(self):
+        self.history = TxHistory(url="redis://unused", stream="test", maxlen=5, backlog=3)
+        self.stream = FakeRedisStream()
+        self.history._client = self.stream
+
+    def backlog(self, since=None):
+        async def read():
+            self.stream.asynchronous = True
+            with mock.patch.object(self.history, "async_client", return_value=self.stream):
+                return await self.history.abacklog(since)
+        return asyncio.run(read())
+
+    def test_append_sets_seq_and_caps_stream(self):
+        events = [{"issi": n} for n in range(7)]
+
+        self.history.append(events)
+
+        self.assertEqual(events[0]["seq"], "1700000000000-1")
+        self.assertEqual(len(self.stream.entries), 5)
+
+    def test_backlog_returns_most_recent_events_oldest_first(self):
+        self.history.append([{"issi": n} for n in range(5)])
+
+        backlog = self.backlog()
+
+        self.assertEqual([event["issi"] for event in backlog], [2, 3, 4])
+        self.assertEqual(backlog[-1]["seq"], "1700000000000-5")
+
+    def test_backlog_resumes_after_seq(self):
+        self.history.append([{"issi": n} for n in range(5)])
+
+        self.assertEqual([event["issi"] for event in self.backlog("1700000000000-3")], [3, 4])
+        self.assertEqual(self.backlog("1700000000000-5"), [])
+
+    def test_redis_errors_do_not_break_the_stream(self):
+        self.history._client = mock.Mock(pipeline=mock.Mock(side_effect=redis.ConnectionError))
+        events = [{"issi": 1}]
+
+        self.history.append(events)
+
+        self.assertNotIn("seq", events[0])
+
+    def test_slow_append_is_given_up(self):
+        history = TxHistory(url="redis://unused", stream="test", append_timeout=0.01)
+        events = [{"issi": 1}]
+
+        with mock.patch.object(history, "async_client", return_value=FakeRedisStream(asynchronous=True, delay=1)):
+            with self.assertLogs("roip.history", "WARNING"):
+                asyncio.run(history.aappend(events))
+
+        self.assertNotIn("seq", events[0])
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class LiveTxConsumerTests(TestCase):
+    EVENTS = [
+        {"type": "tx_start", "issi": {"number": 2000001, "discipline": "Brandweer"}, "vector": {"service": "H1"}},
+        {"type": "tx_start", "issi": {"number": 3000001, "discipline": "Politie"}, "vector": {"service": "H2"}},
+        {"type": "tx_start", "issi": 2000002},
+    ]
+
+    def setUp(self):
+        self.history = mock.Mock(abacklog=mock.AsyncMock(return_value=[]))
+        patcher = mock.patch.object(LiveTxConsumer, "history", self.history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_socket(self, scenario, query_string=b""):
+        async def main():
+            communicator = ApplicationCommunicator(
+                LiveTxConsumer.as_asgi(),
+                {"type": "websocket", "path": "/ws/live/tx/", "query_string": query_string, "headers": []},
+            )
+            await communicator.send_input({"type": "websocket.connect"})
+            accepted = (await communicator.receive_output(1))["type"] == "websocket.accept"
+
+            async def send(message):
+                await communicator.send_input({"type": "websocket.receive", "text": json.dumps(message)})
+
+            async def received():
+                frames = []
+                while not await communicator.receive_nothing(0.05):
+                    frames.append(json.loads((await communicator.receive_output())["text"]))
+                return frames
+
+            try:
+                return accepted, await scenario(send, received) if accepted else None
+            finally:
+                await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+                await communicator.wait(1)
+
+        return asyncio.run(main())
+
+    async def broadcast(self, batched=False):
+        layer = get_channel_layer()
+        if batched:
+            await layer.group_send("live_tx", {"type": "tx_events", "events": self.EVENTS})
+        else:
+            for event in self.EVENTS:
+                await layer.group_send("live_tx", {"type": "tx_event", "data": event})
+
+    def test_without_filter_every_event_is_sent(self):
+        async def scenario(send, received):
+            await self.broadcast(batched=True)
+            return await received()
+
+        _, frames = self.run_socket(scenario)
+
+        self.assertEqual(frames, self.EVENTS)
+
+    def test_filter_message_narrows_events(self):
+        async def scenario(send, received):
+            await send({"action": "filter", "services": ["H1"], "issi_ranges": [[2000000, 2999999]]})
+            ack = await received()
+            await self.broadcast()
+            return ack, await received()
+
+        _, (ack, frames) = self.run_socket(scenario)
+
+        self.assertEqual(ack[0]["type"], "filter")
+        self.assertEqual(frames, [self.EVENTS[0]])
+
+    def test_filter_from_query_string(self):
+        async def scenario(send, received):
+            await self.broadcast(batched=True)
+            return await received()
+
+        _, frames = self.run_socket(scenario, b"issi=2000000-2999999")
+
+        self.assertEqual(frames, [self.EVENTS[0], self.EVENTS[2]])
+
+    def test_invalid_filter_is_reported(self):
+        async def scenario(send, received):
+            await send({"action": "filter", "issi_ranges": [[3, 1]]})
+            return await received()
+
+        _, frames = self.run_socket(scenario)
+
+        self.assertEqual(frames[0]["type"], "error")
+
+    def test_backlog_is_sent_on_connect_with_filter_applied(self):
+        self.history.abacklog.return_value = [dict(event, seq=f"1-{n}") for n, event in enumerate(self.EVENTS)]
+
+        async def scenario(send, received):
+            return await received()
+
+        _, frames = self.run_socket(scenario, b"service=H2&since=1-0")
+
+        self.history.abacklog.assert_awaited_once_with("1-0")
+        self.assertEqual(frames, [{"type": "backlog", "events": [dict(self.EVENTS[1], seq="1-1")]}])
+
+    def test_invalid_since_is_ignored(self):
+        self.run_socket(lambda send, received: received(), b"since=abc")
+
+        self.history.abacklog.assert_awaited_once_with(None)
+
+    def test_invalid_query_string_filter_is_refused(self):
+        async def main():
+            communicator = ApplicationCommunicator(
+                LiveTxConsumer.as_asgi(),
+                {"type": "websocket", "path": "/ws/live/tx/", "query_string": b"issi=abc", "headers": []},
+            )
+            await communicator.send_input({"type": "websocket.connect"})
+            return [await communicator.receive_output(1) for _ in range(2)]
+
+        accept, close = asyncio.run(main())
+
+        # Accepted and then closed, so the browser sees the code and stops reconnecting
+        self.assertEqual(accept["type"], "websocket.accept")
+        self.assertEqual(close, {"type": "websocket.close", "code": 4400})
+
+
+class BenchLiveTxCommandTests(TestCase):
+    def setUp(self):
+        self.addCleanup(issi_range_resolver.invalidate)
+        ISSI.objects.create(number=1234567, alias="P101")
+
+    def run_bench(self, *args):
+        out = StringIO()
+        call_command("bench_live_tx", "--events", "50", "--clients", "2", "--json", *args, stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_reports_latency_for_every_delivered_event(self):
+        report = self.run_bench()
+
+        self.assertEqual(report["mode"], "callback")
+        self.assertEqual(report["delivered"], 100)
+        self.assertEqual(report["lost"], 0)
+        self.assertLessEqual(report["p50_ms"], report["p99_ms"])
+
+    def test_asyncio_bridge(self):
+        report = self.run_bench("--asyncio", "--workers", "1")
+
+        self.assertEqual(report["mode"], "asyncio")
+        self.assertEqual(report["delivered"], 100)
+
+
+class TxEventStoreTests(TestCase):
+    def test_payload_is_mapped_to_columns(self):
+        event = tx_event_from_payload({
+            "type": "tx_stop",
+            "ts": 1791000000.5,
+            "node_id": "roip-1",
+            "talkgroup": "BXL-FIRE-1",
+            "issi": {"number": 1234567, "alias": "P101"},
+            "alias": "P101",
+            "TEI": 75000000001,
+            "vehicle": {"call_sign": "P101"},
+            "vector": {"resourceCode": "P101"},
+            "duration_s": 3.2,
+            "filename": "a.wav",
+        })
+
+        self.assertEqual(event.ts, datetime.datetime.fromtimestamp(1791000000.5, tz=datetime.timezone.utc))
+        self.assertEqual((event.issi, event.tei, event.call_sign, event.vector), (1234567, 75000000001, "P101", "P101"))
+        self.assertEqual(event.talkgroup, "BXL-FIRE-1")
+        self.assertEqual(event.data["filename"], "a.wav")
+
+    def test_unknown_issi_and_missing_time_are_accepted(self):
+        event = tx_event_from_payload({"type": "tx_start", "issi": 7654321, "ts": "garbage"})
+
+        self.assertEqual(event.issi, 7654321)
+        self.assertIsNotNone(event.ts)
+
+    def test_writer_flushes_in_batches(self):
+        writer = TxEventWriter(batch_size=3, flush_interval=0.01)
+        writer.add({"type": "tx_start", "issi": n, "ts": 1791000000 + n} for n in range(7))
+
+        with mock.patch.object(TxEvent.objects, "bulk_create", wraps=TxEvent.objects.bulk_create) as bulk_create:
+            writer._stopping.set()
+            writer._run()
+
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [3, 3, 1])
+        self.assertEqual(TxEvent.objects.count(), 7)
+        self.assertEqual(writer.written, 7)
+
+    def test_writer_drops_instead_of_blocking(self):
+        writer = TxEventWriter(batch_size=10, flush_interval=0.01, max_pending=2)
+
+        writer.add([{"issi": 1}, {"issi": 2}, {"issi": 3}])
+
+        self.assertEqual(writer.dropped, 1)
+
+    def test_purge_removes_old_events_only(self):
+        now = timezone.now()
+        TxEvent.objects.create(ts=now - datetime.timedelta(days=400))
+        recent = TxEvent.objects.create(ts=now - datetime.timedelta(days=10))
+
+        self.assertEqual(purge_tx_events.apply(args=[365]).get(), 1)
+        self.assertEqual(list(TxEvent.objects.values_list("id", flat=True)), [recent.id])
+
+
+@override_settings(ROIP_API_KEYS=["test-key"])
+class TxEventListApiTests(TestCase):
+    def setUp(self):
+        start = datetime.datetime(2026, 10, 1, 8, 0, tzinfo=datetime.timezone.utc)
+        TxEvent.objects.bulk_create([
+            TxEvent(
+                ts=start + datetime.timedelta(minutes=n),
+                event_type="tx_stop",
+                talkgroup="TG1" if n % 2 == 0 else "TG2",
+                issi=1000000 + n % 3,
+                vector="P101",
+            )
+            for n in range(10)
+        ])
+
+    def get(self, **params):
+        return self.client.get(reverse("roip_api:tx_events"), params, HTTP_X_API_KEY="test-key")
+
+    def test_filters_on_talkgroup_and_time(self):
+        response = self.get(talkgroup="TG1", **{"from": "2026-10-01T08:02:00+00:00", "to": "2026-10-01T08:08:00+00:00"})
+
+        self.assertEqual(response.status_code, 200)
+        minutes = [r["ts"][14:16] for r in response.json()["results"]]
+        self.assertEqual(minutes, ["06", "04", "02"])
+
+    def test_pages_with_cursor(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 4}
+            if cursor:
+                params["cursor"] = cursor
+            data = self.get(**params).json()
+            seen.extend(r["id"] for r in data["results"])
+            cursor = data["next"]
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, list(TxEvent.objects.order_by("-ts", "-id").values_list("id", flat=True)))
+
+    def test_rejects_invalid_parameters(self):
+        self.assertEqual(self.get(issi="abc").status_code, 400)
+        self.assertEqual(self.get(cursor="!!").status_code, 400)
+
+    def test_requires_api_key(self):
+        self.assertEqual(self.client.get(reverse("roip_api:tx_events")).status_code, 401)
+
+
+@override_settings(ROIP_API_KEYS=["test-key"])
+@override_settings(ROIP_DIRECTORY_VERSION_LAG_SECONDS=0)
+class DirectorySnapshotApiTests(TestCase):
+    def setUp(self):
+        model = RadioModel.objects.create(name="MTP850", radio_type=RadioModel.RadioType.MOBILE)
+        TEIRange.objects.create(model=model, min_tei=75000000000, max_tei=75999999999)
+        self.addCleanup(tei_range_index.invalidate)
+        patcher = mock.patch("roip.enrichment.redis_client")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.issi = ISSI.objects.create(number=1234567, alias="P101")
+            self.radio = Radio.objects.create(TEI=75000000001)
+            Subscription.objects.create(issi=self.issi, radio=self.radio, active=True, DMO_only=False)
+            self.vehicle = Vehicle.objects.create(number="P101 - Autopomp", status=VehicleStatus.ACTIF, radio=self.radio)
+            Vector.objects.create(resourceCode="P101", vehicle=self.vehicle, name="Autopomp 101")
+            ISSI.objects.create(number=2345678, alias="A106")
+            ISSI.objects.create(number=3456789, alias="B201")
+
+    def get(self, **params):
+        headers = params.pop("headers", {})
+        return self.client.get(reverse("roip_api:snapshot"), params, HTTP_X_API_KEY="test-key", **headers)
+
+    @staticmethod
+    def lines(response):
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_full_snapshot_streams_one_line_per_issi(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(int(response["X-Directory-Version"]), DirectoryChange.objects.latest("id").id)
+        rows = self.lines(response)
+        self.assertEqual([row["issi"] for row in rows], [1234567, 2345678, 3456789])
+        self.assertEqual(rows[0]["radio"]["tei_15"], "000075000000001")
+        self.assertTrue(rows[0]["radio"]["is_active"])
+        self.assertEqual(rows[0]["vehicle"]["call_sign"], "P101")
+        self.assertEqual(rows[0]["vector"]["resource_code"], "P101")
+        self.assertIsNone(rows[1]["radio"])
+
+    def test_full_snapshot_uses_one_row_query(self):
+        response = self.get()
+
+        # The view reads the version; streaming the rows is one query, nothing per ISSI
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.lines(response)), 3)
+
+    def test_gzipped_json_snapshot(self):
+        response = self.get(format="json", headers={"HTTP_ACCEPT_ENCODING": "gzip, deflate"})
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(b"".join(response.streaming_content)))
+        self.assertIsNone(data["since"])
+        self.assertEqual(data["version"], int(response["X-Directory-Version"]))
+        self.assertEqual(len(data["items"]), 3)
+
+    def test_since_returns_changed_and_deleted_issis(self):
+        version = int(self.get()["X-Directory-Version"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            # The vehicle moves from the radio to another ISSI: both ISSIs change
+            self.vehicle.radio = None
+            self.vehicle.issi_id = 2345678
+            self.vehicle.save()
+            ISSI.objects.filter(number=3456789).delete()
+
+        response = self.get(since=version)
+
+        rows = self.lines(response)
+        self.assertGreater(int(response["X-Directory-Version"]), version)
+        self.assertEqual([row["issi"] for row in rows], [1234567, 2345678, 3456789])
+        self.assertIsNone(rows[0]["vehicle"])
+        self.assertEqual(rows[1]["vector"]["resource_code"], "P101")
+        self.assertEqual(rows[2], {"issi": 3456789, "deleted": True})
+
+        unchanged = self.get(since=response["X-Directory-Version"])
+        self.assertEqual(self.lines(unchanged), [])
+
+    @override_settings(ROIP_DIRECTORY_VERSION_LAG_SECONDS=10)
+    def test_version_stops_before_changes_that_may_still_commit(self):
+        DirectoryChange.objects.update(changed_at=timezone.now() - datetime.timedelta(minutes=1))
+        settled = DirectoryChange.objects.latest("id").id
+        with self.captureOnCommitCallbacks(execute=True):
+            ISSI.objects.filter(number=2345678).update(alias="A107")
+            record_directory_change(issis=[2345678])
+
+        self.assertEqual(int(self.get()["X-Directory-Version"]), settled)
+        self.assertEqual(self.lines(self.get(since=settled)), [])
+
+        # Once settled, the next sync picks the change up
+        DirectoryChange.objects.update(changed_at=timezone.now() - datetime.timedelta(minutes=1))
+        response = self.get(since=settled)
+        self.assertGreater(int(response["X-Directory-Version"]), settled)
+        self.assertEqual([row["issi"] for row in self.lines(response)], [2345678])
+
+    def test_change_log_rolls_back_with_the_change(self):
+        before = DirectoryChange.objects.count()
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            ISSI.objects.create(number=4567890, alias="C301")
+            raise RuntimeError
+
+        self.assertEqual(DirectoryChange.objects.count(), before)
+        with transaction.atomic():
+            ISSI.objects.create(number=4567890, alias="C301")
+        self.assertTrue(DirectoryChange.objects.filter(kind="issis", key="4567890").exists())
+
+    def test_radio_vehicle_wins_over_issi_vehicle(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Vehicle.objects.create(number="P102 - Autopomp", status=VehicleStatus.ACTIF, issi=self.issi)
+            self.vehicle.radio = None
+            self.vehicle.save()
+
+        row = self.lines(self.get())[0]
+
+        # The radio has no vehicle any more, and the lookup API shows none either
+        self.assertIsNone(row["vehicle"])
+
+    def test_since_older_than_retained_changes_is_gone(self):
+        latest = DirectoryChange.objects.latest("id").id
+        DirectoryChange.objects.filter(id__lt=latest).delete()
+
+        self.assertEqual(self.get(since=0).status_code, 410)
+        self.assertEqual(self.get(since=latest - 1).status_code, 200)
+
+    def test_rejects_invalid_parameters(self):
+        self.assertEqual(self.get(since="abc").status_code, 400)
+        self.assertEqual(self.get(format="xml").status_code, 400)
+        self.assertEqual(self.client.get(reverse("roip_api:snapshot")).status_code, 401)
+
+    def test_purge_keeps_newest_change(self):
+        DirectoryChange.objects.update(changed_at=timezone.now() - datetime.timedelta(days=60))
+        latest = DirectoryChange.objects.latest("id").id
+
+        purge_directory_changes.apply(args=(30,)).get()
+
+        self.assertEqual(list(DirectoryChange.objects.values_list("id", flat=True)), [latest])
+
+
+class FakeRedisOutbox:
+    """Just enough of Redis sets, hashes and SET NX for the RoIP outbox."""
+
+    def __init__(self):
+        self.sets = {}
+        self.hashes = {}
+        self.keys = {}
+
+    def sadd(self, key, *values):
+        self.sets.setdefault(key, set()).update(
+            value if isinstance(value, bytes) else str(value).encode() for value in values
+        )
+
+    def srem(self, key, *values):
+        self.sets.get(key, set()).difference_update(values)
+
+    def srandmember(self, key, count):
+        return list(self.sets.get(key, set()))[:count]
+
+    def sunionstore(self, dest, keys):
+        self.sets[dest] = set().union(*(self.sets.get(key, set()) for key in keys))
+
+    def exists(self, key):
+        return int(bool(self.sets.get(key)) or key in self.keys)
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self)
+
+    def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(str(field)) for field in fields]
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update({str(field): value.encode() for field, value in mapping.items()})
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.keys:
+            return None
+        self.keys[key] = value
+        return True
+
+    def delete(self, key):
+        self.sets.pop(key, None)
+        self.keys.pop(key, None)
+
+    def eval(self, script, numkeys, key, token):
+        # Only the compare-and-delete lock release is used
+        if self.keys.get(key) == token:
+            del self.keys[key]
+            return 1
+        return 0
+
+
+class FakeRedisPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+@override_settings(ROIP_INGEST_URL="https://roip.example/ingest", ROIP_INGEST_TOKEN="token")
+class RoipOutboxTests(TestCase):
+    def setUp(self):
+        model = RadioModel.objects.create(name="MTP850", radio_type=RadioModel.RadioType.MOBILE)
+        TEIRange.objects.create(model=model, min_tei=75000000000, max_tei=75999999999)
+        self.addCleanup(tei_range_index.invalidate)
+
+        self.redis = FakeRedisOutbox()
+        for patcher in (
+            mock.patch("RadioAssetManagement.tasks.outbox_redis", return_value=self.redis),
+            mock.patch("roip.enrichment.redis_client"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        for n in range(3):
+            issi = ISSI.objects.create(number=1000000 + n, alias=f"P10{n}")
+            radio = Radio.objects.create(TEI=75000000000 + n)
+            Subscription.objects.create(issi=issi, radio=radio, active=True, DMO_only=False)
+
+    def flush(self, **kwargs):
+        with mock.patch("RadioAssetManagement.tasks.requests.post") as post:
+            result = flush_roip_outbox.apply(kwargs=kwargs).get()
+        return result, [call.kwargs["json"]["items"] for call in post.call_args_list]
+
+    def test_repeated_changes_are_pushed_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(5):
+                enqueue_roip_sync_for_tei([75000000000, 75000000001])
+
+        result, pushes = self.flush()
+
+        self.assertEqual(result, {"queued": 2, "pushed": 2})
+        self.assertEqual(len(pushes), 1)
+        self.assertEqual(sorted(line["tei"] for line in pushes[0]), [75000000000, 75000000001])
+        self.assertEqual(self.flush(), ({"queued": 0, "pushed": 0}, []))
+
+    def test_pushes_only_changed_fields(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_roip_sync_for_tei([75000000000, 75000000001, 75000000002])
+        self.flush()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ISSI.objects.filter(number=1000001).update(alias="A106")
+            Vehicle.objects.create(number="P100 - Autopomp", status=VehicleStatus.ACTIF, radio_id=75000000000)
+            enqueue_roip_sync_for_tei([75000000001, 75000000002])
+
+        result, pushes = self.flush(chunk_size=2)
+
+        self.assertEqual(result["queued"], 3)
+        lines = sorted((line for push in pushes for line in push), key=lambda line: line["tei"])
+        self.assertEqual(lines, [
+            {"tei": 75000000000, "vehicle_call_sign": "P100"},
+            {"tei": 75000000001, "issi_alias": "A106"},
+        ])
+
+    def test_failed_push_stays_in_outbox(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_roip_sync_for_tei(75000000000)
+
+        with mock.patch("RadioAssetManagement.tasks.requests.post", side_effect=requests.ConnectionError):
+            result = flush_roip_outbox.apply().get()
+
+        self.assertEqual(result["pushed"], 0)
+        self.assertEqual(self.redis.sets[OUTBOX_KEY], {b"75000000000"})
+        self.assertEqual(self.flush()[0]["pushed"], 1)
+
+    def test_chunk_of_crashed_run_is_pushed_on_the_next_run(self):
+        # A worker died between taking the chunk and pushing it
+        self.redis.sadd(PROCESSING_KEY, 75000000000)
+
+        result, pushes = self.flush()
+
+        self.assertEqual(result, {"queued": 1, "pushed": 1})
+        self.assertEqual([line["tei"] for line in pushes[0]], [75000000000])
+        self.assertNotIn(PROCESSING_KEY, self.redis.sets)
+
+    def test_expired_lock_of_slow_run_is_not_released_by_it(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_roip_sync_for_tei(75000000000)
+
+        def lock_expires_and_next_run_starts(*args, **kwargs):
+            self.redis.keys[FLUSH_LOCK_KEY] = "next-run"
+            return mock.DEFAULT
+
+        with mock.patch("RadioAssetManagement.tasks.requests.post", side_effect=lock_expires_and_next_run_starts):
+            flush_roip_outbox.apply().get()
+
+        self.assertEqual(self.redis.keys[FLUSH_LOCK_KEY], "next-run")